@@ -26,18 +26,33 @@ from langchain.schema import Document, HumanMessage
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from pydantic import BaseModel
 from tavily import TavilyClient
-import psycopg2
-import numpy as np
-from openai import OpenAI
 from datetime import datetime
 
 from crag_graph import get_crag_graph
-
-# Configuration PostgreSQL pour PGVector uniquement
-postgres_connection_string = os.getenv("POSTGRES_CONNECTION_STRING")
-
-
-app = FastAPI(title="Dagan Agent RAG API", version="2.0.0")
+from database.pool import get_async_connection, pool_stats, close_pools
+from database.shards import async_shard_connection, close_shard_pools, shard_for_document, shard_pool_stats
+from database.schema import ensure_collection_partition, ensure_embedding_schema
+from tools.embedding_cache import get_embedding_cache
+from tools.embeddings import embed_documents, matryoshka_prefix
+from tools.vector_io import copy_chunks
+from tools.small_to_big import ENABLE_SMALL_TO_BIG, split_parent_child, store_parents
+from tools.embedding_batcher import batcher_stats
+from tools.mmap_index import get_mmap_index
+from tools.result_cache import get_result_cache
+from tools.retrieval import transfer_stats
+from tools.similarity_threshold import pruning_stats
+from tools.reranker import reranker_stats
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Fermer les pools PostgreSQL partagés à l'arrêt du serveur
+    await close_shard_pools()
+    await close_pools()
+
+
+app = FastAPI(title="Dagan Agent RAG API", version="2.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -52,6 +67,38 @@ async def health_check():
     return {"status": "everything is ok"}
 
 
+@app.get("/health/db")
+async def health_check_db():
+    """Vérifie la connexion PostgreSQL et retourne les statistiques des pools"""
+    try:
+        async with get_async_connection() as conn:
+            await conn.execute("SELECT 1")
+        return {"status": "ok", "pools": pool_stats()}
+    except Exception as e:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "error", "error": str(e), "pools": pool_stats()}
+        )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Compteurs de performance des sous-systèmes (pools, caches)"""
+    embedding_cache = get_embedding_cache()
+    mmap_index = get_mmap_index()
+    result_cache = get_result_cache()
+    return {
+        "db_pools": {**pool_stats(), **shard_pool_stats()},
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "embedding_batchers": batcher_stats(),
+        "mmap_index": mmap_index.stats() if mmap_index else None,
+        "result_cache": result_cache.stats() if result_cache else None,
+        "retrieval_transfer": transfer_stats(),
+        "candidate_pruning": pruning_stats(),
+        "reranking": reranker_stats(),
+    }
+
+
 class VectorizeRequest(BaseModel):
     url: str
     # Pas de thread_id nécessaire : documents publics partagés
@@ -176,58 +223,40 @@ async def vectorize_file(
         
         print(f"✓ {len(documents)} documents créés avec métadonnées")
         
-        # 7. Génération des embeddings et stockage dans PGVector
-        openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        conn = psycopg2.connect(postgres_connection_string)
-        cursor = conn.cursor()
-        
-        # Vérifier/créer la table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS langchain_pg_embedding (
-                id TEXT PRIMARY KEY,
-                collection_id TEXT,
-                embedding VECTOR(2000),
-                document TEXT,
-                cmetadata JSONB
-            )
-        """)
-        
-        # Créer l'index si nécessaire
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS langchain_pg_embedding_embedding_idx 
-            ON langchain_pg_embedding 
-            USING ivfflat (embedding vector_cosine_ops)
-            WITH (lists = 100)
-        """)
-        
-        conn.commit()
-        
-        # 8. Générer embeddings et insérer
-        uuids = [str(uuid4()) for _ in range(len(documents))]
-        
-        for i, (doc, doc_id) in enumerate(zip(documents, uuids)):
-            # Générer embedding
-            response = openai_client.embeddings.create(
-                model="text-embedding-3-large",
-                input=doc.page_content,
-                dimensions=2000
-            )
-            embedding = response.data[0].embedding
+        # Chunks hiérarchiques : parents stockés tels quels, seuls les enfants sont embeddés
+        parents = []
+        if ENABLE_SMALL_TO_BIG:
+            parents, documents = split_parent_child(documents)
+            print(f"✓ {len(parents)} sections parentes → {len(documents)} chunks enfants")
+        
+        # 7. Génération des embeddings (par lots) et stockage dans PGVector
+        embeddings = embed_documents([doc.page_content for doc in documents])
+        
+        # Avec SHARD_DSNS : tous les chunks et parents du fichier vont sur le shard de sa clé de placement
+        shard = shard_for_document(collection, documents[0].metadata if documents else None)
+        async with async_shard_connection(shard) as conn, conn.cursor() as cursor:
+            # Vérifier/créer la table et l'index vectoriel (mode configurable, voir database/schema.py)
+            await ensure_embedding_schema(conn)
+            # Table partitionnée : partition de la collection créée à sa première ingestion
+            partitioned = await ensure_collection_partition(conn, collection)
+            if parents:
+                await store_parents(cursor, collection, parents)
             
-            # Insérer dans PGVector
-            cursor.execute("""
-                INSERT INTO langchain_pg_embedding (id, collection_id, embedding, document, cmetadata)
-                VALUES (%s, %s, %s::vector, %s, %s)
-                ON CONFLICT (id) DO UPDATE 
-                SET embedding = EXCLUDED.embedding, 
-                    document = EXCLUDED.document, 
-                    cmetadata = EXCLUDED.cmetadata
-            """, (doc_id, collection, embedding, doc.page_content, json.dumps(doc.metadata)))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+            # 8. Insérer les chunks embeddés
+            uuids = [str(uuid4()) for _ in range(len(documents))]
+            
+            # COPY binaire (vecteurs non sérialisés en texte) puis upsert en une instruction
+            await copy_chunks(cursor, (
+                (doc_id, collection, embedding, matryoshka_prefix(embedding), doc.page_content, doc.metadata)
+                for doc, doc_id, embedding in zip(documents, uuids, embeddings)
+            ), partitioned=partitioned)
+            
+            await conn.commit()
+        
+        # Les résultats en cache couvrant cette collection sont périmés
+        result_cache = get_result_cache()
+        if result_cache is not None:
+            result_cache.invalidate(collection)
         
         print(f"✓ {len(documents)} documents vectorisés et stockés dans collection '{collection}'")
         
@@ -239,6 +268,7 @@ async def vectorize_file(
                 "file_size": file_size,
                 "collection": collection,
                 "documents_count": len(documents),
+                "parent_sections_count": len(parents),
                 "chunks_info": {
                     "chunk_size": 4000,
                     "chunk_overlap": 800,
@@ -335,82 +365,43 @@ async def vectorize_url(
         
         print(f"✓ {len(documents)} documents créés avec métadonnées de chunks")
 
-        # 5. Initialize OpenAI client for embeddings (direct API)
-        openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        # 6. Connect to PostgreSQL and create embeddings
-        conn = psycopg2.connect(postgres_connection_string)
-        cursor = conn.cursor()
+        # Hierarchical chunks: parents stored as-is, only children are embedded
+        parents = []
+        if ENABLE_SMALL_TO_BIG:
+            parents, documents = split_parent_child(documents)
+            print(f"✓ {len(parents)} sections parentes → {len(documents)} chunks enfants")
+
+        # 5. Generate embeddings in batches (direct OpenAI API)
+        embeddings = embed_documents([doc.page_content for doc in documents])
         
+        # 6. Connect to PostgreSQL (shared pool) and store embeddings
         collection_name = os.getenv("DOCUMENTS_COLLECTION", "crawled_documents")
         
-        # Modifier la table existante pour changer collection_id de UUID à TEXT
-        # D'abord, vérifier si la table existe et si la colonne est de type UUID
-        cursor.execute("""
-            SELECT column_name, data_type 
-            FROM information_schema.columns 
-            WHERE table_name = 'langchain_pg_embedding' 
-            AND column_name = 'collection_id'
-        """)
-        column_info = cursor.fetchone()
-        
-        if column_info and column_info[1] == 'uuid':
-            # La colonne existe et est de type UUID, on la modifie en TEXT
-            print("⚠️  Modification de la colonne collection_id (UUID → TEXT)...")
-            cursor.execute("""
-                ALTER TABLE langchain_pg_embedding 
-                ALTER COLUMN collection_id TYPE TEXT 
-                USING collection_id::TEXT
-            """)
-            conn.commit()
-            print("Colonne collection_id modifiée en TEXT")
-        
-        # Create table if not exists (avec collection_id en TEXT)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS langchain_pg_embedding (
-                id TEXT PRIMARY KEY,
-                collection_id TEXT,
-                embedding VECTOR(2000),
-                document TEXT,
-                cmetadata JSONB
-            )
-        """)
-        
-        # Créer un index pour optimiser les recherches de similarité si pas existant
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS langchain_pg_embedding_embedding_idx 
-            ON langchain_pg_embedding 
-            USING ivfflat (embedding vector_cosine_ops)
-            WITH (lists = 100)
-        """)
-        
-        conn.commit()
-        
-        # 7. Generate embeddings and store in PGVector
-        uuids = [str(uuid4()) for _ in range(len(documents))]
-        
-        for i, (doc, doc_id) in enumerate(zip(documents, uuids)):
-            # Generate embedding using direct OpenAI API
-            response = openai_client.embeddings.create(
-                model="text-embedding-3-large",
-                input=doc.page_content,
-                dimensions=2000
-            )
-            embedding = response.data[0].embedding
+        # With SHARD_DSNS: every chunk and parent of the page goes to the shard of its placement key
+        shard = shard_for_document(collection_name, documents[0].metadata if documents else None)
+        async with async_shard_connection(shard) as conn, conn.cursor() as cursor:
+            # Create table + vector index if needed (collection_id UUID → TEXT migrated there too)
+            await ensure_embedding_schema(conn)
+            # Partitioned table: the collection's partition is created on its first ingest
+            partitioned = await ensure_collection_partition(conn, collection_name)
+            if parents:
+                await store_parents(cursor, collection_name, parents)
             
-            # Store in PGVector avec collection_name en TEXT
-            cursor.execute("""
-                INSERT INTO langchain_pg_embedding (id, collection_id, embedding, document, cmetadata)
-                VALUES (%s, %s, %s::vector, %s, %s)
-                ON CONFLICT (id) DO UPDATE 
-                SET embedding = EXCLUDED.embedding, 
-                    document = EXCLUDED.document, 
-                    cmetadata = EXCLUDED.cmetadata
-            """, (doc_id, collection_name, embedding, doc.page_content, json.dumps(doc.metadata)))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+            # 7. Store chunks in PGVector
+            uuids = [str(uuid4()) for _ in range(len(documents))]
+            
+            # COPY binaire (vecteurs non sérialisés en texte) puis upsert en une instruction
+            await copy_chunks(cursor, (
+                (doc_id, collection_name, embedding, matryoshka_prefix(embedding), doc.page_content, doc.metadata)
+                for doc, doc_id, embedding in zip(documents, uuids, embeddings)
+            ), partitioned=partitioned)
+            
+            await conn.commit()
+        
+        # Les résultats en cache couvrant cette collection sont périmés
+        result_cache = get_result_cache()
+        if result_cache is not None:
+            result_cache.invalidate(collection_name)
         
         print(f"✓ {len(documents)} documents vectorisés et stockés dans PGVector")
 
@@ -419,6 +410,7 @@ async def vectorize_url(
                 "success": True,
                 "message": f"Successfully vectorized {len(documents)} chunks from {body.url}",
                 "documents_count": len(documents),
+                "parent_sections_count": len(parents),
                 "chunks_info": {
                     "chunk_size": 4000,
                     "chunk_overlap": 800,
@@ -787,9 +779,6 @@ async def crag_stream(
             # LOGGING DE LA CONVERSATION (PostgreSQL)
             # ─────────────────────────────────────────────────────────
             try:
-                conn = psycopg2.connect(postgres_connection_string)
-                cursor = conn.cursor()
-                
                 # Déterminer les tools utilisés basé sur les sources
                 tools_used = []
                 vector_searches = 0
@@ -809,34 +798,31 @@ async def crag_stream(
                 if collected_sources and "reranker" not in tools_used:
                     tools_used.append("reranker")
                 
-                # Insérer dans la table conversations
-                cursor.execute("""
-                    INSERT INTO conversations (
-                        id, question, answer, sources, tools_used,
-                        vector_searches, web_searches, status
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                        answer = EXCLUDED.answer,
-                        sources = EXCLUDED.sources,
-                        tools_used = EXCLUDED.tools_used,
-                        vector_searches = EXCLUDED.vector_searches,
-                        web_searches = EXCLUDED.web_searches,
-                        status = EXCLUDED.status,
-                        updated_at = NOW()
-                """, (
-                    thread_id,
-                    body.question,
-                    accumulated_answer,
-                    json.dumps(collected_sources),
-                    tools_used,
-                    vector_searches,
-                    web_searches,
-                    "completed"
-                ))
-                
-                conn.commit()
-                cursor.close()
-                conn.close()
+                # Insérer dans la table conversations (connexion du pool partagé)
+                async with get_async_connection() as conn:
+                    await conn.execute("""
+                        INSERT INTO conversations (
+                            id, question, answer, sources, tools_used,
+                            vector_searches, web_searches, status
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (id) DO UPDATE SET
+                            answer = EXCLUDED.answer,
+                            sources = EXCLUDED.sources,
+                            tools_used = EXCLUDED.tools_used,
+                            vector_searches = EXCLUDED.vector_searches,
+                            web_searches = EXCLUDED.web_searches,
+                            status = EXCLUDED.status,
+                            updated_at = NOW()
+                    """, (
+                        thread_id,
+                        body.question,
+                        accumulated_answer,
+                        json.dumps(collected_sources),
+                        tools_used,
+                        vector_searches,
+                        web_searches,
+                        "completed"
+                    ))
                 
                 print(f"💾 Conversation {thread_id} enregistrée dans PostgreSQL")
                 
@@ -866,27 +852,21 @@ async def crag_stream(
             
             # Logger l'erreur dans la base de données
             try:
-                conn = psycopg2.connect(postgres_connection_string)
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    INSERT INTO conversations (
-                        id, question, status, error_message
-                    ) VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                        status = EXCLUDED.status,
-                        error_message = EXCLUDED.error_message,
-                        updated_at = NOW()
-                """, (
-                    thread_id,
-                    body.question,
-                    "error",
-                    str(e)
-                ))
-                
-                conn.commit()
-                cursor.close()
-                conn.close()
+                async with get_async_connection() as conn:
+                    await conn.execute("""
+                        INSERT INTO conversations (
+                            id, question, status, error_message
+                        ) VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (id) DO UPDATE SET
+                            status = EXCLUDED.status,
+                            error_message = EXCLUDED.error_message,
+                            updated_at = NOW()
+                    """, (
+                        thread_id,
+                        body.question,
+                        "error",
+                        str(e)
+                    ))
                 
                 print(f"💾 Erreur de conversation {thread_id} enregistrée dans PostgreSQL")
                 
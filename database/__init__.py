@@ -0,0 +1,8 @@
+"""
+Accès PostgreSQL / pgvector pour Dagan
+Pool de connexions partagé et helpers de schéma
+"""
+
+from .pool import get_connection, get_async_connection, pool_stats, close_pools
+
+__all__ = ["get_connection", "get_async_connection", "pool_stats", "close_pools"]
@@ -0,0 +1,159 @@
+"""
+Pool de connexions PostgreSQL partagé (psycopg3 + pgvector)
+
+Évite un handshake TCP/TLS/auth complet à chaque appel de tool ou d'endpoint :
+- get_connection() : connexion synchrone (tools LangChain exécutés dans un thread)
+- get_async_connection() : connexion asynchrone (endpoints FastAPI)
+
+Les types pgvector sont enregistrés une seule fois à la création de chaque connexion,
+et chaque connexion est vérifiée avant d'être prêtée (health check).
+"""
+
+import os
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Optional
+
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+from pgvector.psycopg import register_vector, register_vector_async
+
+# Configuration
+POSTGRES_CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_WAITING = int(os.getenv("DB_POOL_MAX_WAITING", "20"))  # Clients en file d'attente max (0 = illimité)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # Attente max d'une connexion libre (secondes)
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))  # Fermeture des connexions inactives (secondes)
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # Recyclage des connexions (secondes)
+
+_sync_pool: Optional[ConnectionPool] = None
+_async_pool: Optional[AsyncConnectionPool] = None
+_sync_lock = threading.Lock()
+_async_lock: Optional[asyncio.Lock] = None  # Créé à la première utilisation, dans une boucle active
+
+
+def _configure_connection(conn) -> None:
+    """Enregistre les types pgvector (vector, halfvec, bit) sur une nouvelle connexion"""
+    register_vector(conn)
+    conn.commit()  # Le pool exige une connexion au repos après configuration
+
+
+async def _configure_async_connection(conn) -> None:
+    await register_vector_async(conn)
+    await conn.commit()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Retourne le pool synchrone du processus (créé à la première utilisation)
+    """
+    global _sync_pool
+
+    if _sync_pool is None:
+        with _sync_lock:
+            if _sync_pool is None:
+                _sync_pool = ConnectionPool(
+                    conninfo=POSTGRES_CONNECTION_STRING,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_waiting=DB_POOL_MAX_WAITING,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    configure=_configure_connection,
+                    check=ConnectionPool.check_connection,
+                    name="dagan-sync",
+                    open=True,
+                )
+                print(f"✓ Pool PostgreSQL synchrone ouvert (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+
+    return _sync_pool
+
+
+def _get_async_lock() -> asyncio.Lock:
+    """
+    Verrou asynchrone créé à la première utilisation : créé à l'import, il serait lié
+    (avant Python 3.10) à la boucle courante de l'import, pas à celle d'uvicorn
+    """
+    global _async_lock
+
+    if _async_lock is None:
+        with _sync_lock:
+            if _async_lock is None:
+                _async_lock = asyncio.Lock()
+    return _async_lock
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """
+    Retourne le pool asynchrone du processus (ouvert dans la boucle d'événements courante)
+    """
+    global _async_pool
+
+    if _async_pool is None:
+        async with _get_async_lock():
+            if _async_pool is None:
+                pool = AsyncConnectionPool(
+                    conninfo=POSTGRES_CONNECTION_STRING,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_waiting=DB_POOL_MAX_WAITING,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    configure=_configure_async_connection,
+                    check=AsyncConnectionPool.check_connection,
+                    name="dagan-async",
+                    open=False,
+                )
+                await pool.open()
+                _async_pool = pool
+                print(f"✓ Pool PostgreSQL asynchrone ouvert (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+
+    return _async_pool
+
+
+@contextmanager
+def get_connection():
+    """
+    Prête une connexion du pool synchrone.
+    COMMIT automatique en sortie, ROLLBACK si une exception est levée.
+    """
+    with get_pool().connection() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def get_async_connection():
+    """
+    Prête une connexion du pool asynchrone.
+    COMMIT automatique en sortie, ROLLBACK si une exception est levée.
+    """
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Statistiques des pools ouverts (connexions actives, en attente, erreurs...)
+    """
+    stats = {}
+    if _sync_pool is not None:
+        stats["sync"] = _sync_pool.get_stats()
+    if _async_pool is not None:
+        stats["async"] = _async_pool.get_stats()
+    return stats
+
+
+async def close_pools() -> None:
+    """Ferme proprement les pools (arrêt de l'application)"""
+    global _sync_pool, _async_pool
+
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+    if _sync_pool is not None:
+        _sync_pool.close()
+        _sync_pool = None
@@ -0,0 +1,855 @@
+"""
+Schéma de la table langchain_pg_embedding et de son index vectoriel
+
+Modes d'index configurables :
+- VECTOR_INDEX_TYPE : "hnsw" (défaut) ou "ivfflat"
+- VECTOR_STORAGE : "vector" (float32) ou "halfvec" (float16, index 2x plus petit)
+
+Avec VECTOR_STORAGE=halfvec, la colonne reste en VECTOR(2000) et l'index porte sur
+l'expression embedding::halfvec(2000) : la requête de recherche doit utiliser la même
+expression (voir distance_expression).
+
+Quantification binaire optionnelle (ENABLE_BINARY_QUANTIZATION) : colonne générée
+embedding_bit BIT(2000) = binary_quantize(embedding), 250 octets par chunk au lieu de 8000,
+indexée en HNSW (distance de Hamming) pour une première passe de candidats (pgvector >= 0.7).
+Sur une table existante, colonne et index sont ajoutés par `manage.py migrate-schema`.
+
+Recherche en deux étapes (Matryoshka) : colonne embedding_short VECTOR(256), préfixe
+normalisé de l'embedding complet, écrite à l'ingestion (ou par `manage.py backfill-short-embeddings`)
+et indexée en HNSW produit scalaire pour la génération de candidats.
+
+Un index ivfflat calcule ses centroïdes à la création : il n'est donc jamais créé
+sur une table vide, mais via `python manage.py migrate-index` une fois les données chargées.
+
+Partitionnement par collection (ENABLE_COLLECTION_PARTITIONING) : table partitionnée
+LIST (collection_id), une partition par collection (créée à sa première ingestion) et une
+partition DEFAULT de secours. Les index déclarés sur la table parente (HNSW compris) existent
+sur chaque partition : une recherche filtrée par collection ne parcourt que ses partitions,
+et supprimer une collection est un DETACH + DROP instantané au lieu d'un DELETE suivi d'un
+VACUUM. Clé primaire (collection_id, id). Migration d'une table existante :
+`python manage.py partition-table`.
+
+Aucune instruction du chemin d'ingestion ne réécrit ou n'indexe une table peuplée. Colonnes
+dérivées (document_tsv de la recherche hybride, embedding_bit de la quantification binaire)
+et index secondaires sont créés avec la
+table, ou ajoutés à une table existante par `python manage.py migrate-schema` : colonne
+nullable maintenue par trigger et remplie par lots, index CREATE INDEX CONCURRENTLY.
+"""
+
+import os
+import re
+import math
+import time
+import hashlib
+from typing import Callable, Dict, List, Optional
+
+import psycopg
+from psycopg import sql
+
+# Configuration
+POSTGRES_CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
+EMBEDDING_TABLE = "langchain_pg_embedding"
+PARENT_TABLE = "langchain_pg_parent"  # Sections parentes des chunks small-to-big (tools/small_to_big.py)
+VECTOR_INDEX_NAME = "langchain_pg_embedding_embedding_idx"
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "2000"))
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()  # hnsw | ivfflat
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "vector").lower()  # vector | halfvec
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+IVFFLAT_MIN_ROWS = 1000  # En dessous, les centroïdes ivfflat n'ont pas de sens
+INDEX_BUILD_MAINTENANCE_WORK_MEM = os.getenv("INDEX_BUILD_MAINTENANCE_WORK_MEM", "1GB")
+ENABLE_BINARY_QUANTIZATION = os.getenv("ENABLE_BINARY_QUANTIZATION", "false").lower() in ("true", "1", "yes")
+BINARY_INDEX_NAME = "langchain_pg_embedding_embedding_bit_idx"
+SHORT_EMBEDDING_DIMENSIONS = int(os.getenv("SHORT_EMBEDDING_DIMENSIONS", "256"))
+SHORT_INDEX_NAME = "langchain_pg_embedding_embedding_short_idx"
+SHORT_BACKFILL_BATCH_SIZE = 1000
+TEXT_SEARCH_CONFIG = "french"
+# Colonne générée : maintenue par PostgreSQL à chaque INSERT/UPDATE (recherche lexicale)
+DOCUMENT_TSV_COLUMN = (
+    f"document_tsv TSVECTOR GENERATED ALWAYS AS "
+    f"(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(document, ''))) STORED"
+)
+BINARY_VECTOR_COLUMN = (
+    f"embedding_bit BIT({EMBEDDING_DIMENSIONS}) GENERATED ALWAYS AS "
+    f"(binary_quantize(embedding)::bit({EMBEDDING_DIMENSIONS})) STORED"
+)
+
+# Partitionnement LIST (collection_id)
+ENABLE_COLLECTION_PARTITIONING = os.getenv("ENABLE_COLLECTION_PARTITIONING", "false").lower() in ("true", "1", "yes")
+DEFAULT_PARTITION = f"{EMBEDDING_TABLE}_default"  # Voir embedding_table_statements
+UNASSIGNED_COLLECTION = "unassigned"  # collection_id des lignes sans collection lors de la migration
+PARTITIONED_CHECK_SQL = "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))"
+# Colonnes copiées lors de la migration (les colonnes générées sont recalculées)
+MIGRATED_COLUMNS = "id, collection_id, embedding, document, cmetadata, updated_at, embedding_short"
+
+PARENT_TABLE_STATEMENT = f"""
+    CREATE TABLE IF NOT EXISTS {PARENT_TABLE} (
+        id TEXT PRIMARY KEY,
+        collection_id TEXT,
+        document TEXT,
+        cmetadata JSONB,
+        updated_at TIMESTAMPTZ DEFAULT NOW()
+    )
+"""
+
+INDEX_TYPES = ("hnsw", "ivfflat")
+STORAGES = ("vector", "halfvec")
+
+
+def _validate_mode(index_type: str, storage: str) -> None:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"VECTOR_INDEX_TYPE invalide: {index_type} (attendu: {', '.join(INDEX_TYPES)})")
+    if storage not in STORAGES:
+        raise ValueError(f"VECTOR_STORAGE invalide: {storage} (attendu: {', '.join(STORAGES)})")
+
+
+def indexed_expression(storage: Optional[str] = None) -> str:
+    """Expression SQL indexée (colonne brute ou cast halfvec)"""
+    storage = storage or VECTOR_STORAGE
+    if storage == "halfvec":
+        return f"(embedding::halfvec({EMBEDDING_DIMENSIONS}))"
+    return "embedding"
+
+
+def distance_expression(param: str = "%(query)b", storage: Optional[str] = None) -> str:
+    """
+    Expression de distance cosinus identique à celle de l'index,
+    pour que le planner puisse l'utiliser dans un ORDER BY.
+    """
+    storage = storage or VECTOR_STORAGE
+    if storage == "halfvec":
+        return f"{indexed_expression(storage)} <=> {param}::halfvec({EMBEDDING_DIMENSIONS})"
+    return f"embedding <=> {param}::vector"
+
+
+def ivfflat_lists(row_count: int) -> int:
+    """Nombre de listes ivfflat recommandé par pgvector (rows/1000, puis sqrt(rows) au-delà d'1M)"""
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+
+def partition_name(collection: str) -> str:
+    """Nom de la partition d'une collection (≤ 63 caractères, suffixe haché : noms distincts garantis)"""
+    slug = re.sub(r"[^a-z0-9]+", "_", collection.lower()).strip("_")[:24]
+    digest = hashlib.blake2b(collection.encode("utf-8"), digest_size=4).hexdigest()
+    return f"{EMBEDDING_TABLE}_p_{slug}_{digest}"
+
+
+def partition_statement(collection: str, table: str = EMBEDDING_TABLE) -> sql.Composed:
+    """CREATE TABLE ... PARTITION OF pour une collection (valeur littérale : pas de paramètre en DDL)"""
+    return sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN ({})").format(
+        sql.Identifier(partition_name(collection)), sql.Identifier(table), sql.Literal(collection)
+    )
+
+
+def index_definition(
+    index_name: str = VECTOR_INDEX_NAME,
+    index_type: Optional[str] = None,
+    storage: Optional[str] = None,
+    row_count: int = 0,
+    concurrently: bool = False,
+    if_not_exists: bool = False,
+    table: str = EMBEDDING_TABLE,
+    only: bool = False,
+) -> str:
+    """
+    Construit l'instruction CREATE INDEX de l'index vectoriel.
+
+    Args:
+        index_name: Nom de l'index
+        index_type: "hnsw" ou "ivfflat" (défaut: VECTOR_INDEX_TYPE)
+        storage: "vector" ou "halfvec" (défaut: VECTOR_STORAGE)
+        row_count: Nombre de lignes (dimensionne les listes ivfflat)
+        concurrently: CREATE INDEX CONCURRENTLY (sans bloquer les écritures)
+        if_not_exists: Ajoute IF NOT EXISTS
+        table: Table indexée (une partition lors d'une reconstruction partition par partition)
+        only: ON ONLY (index de la table partitionnée seule, invalide jusqu'au rattachement des partitions)
+    """
+    index_type = index_type or VECTOR_INDEX_TYPE
+    storage = storage or VECTOR_STORAGE
+    _validate_mode(index_type, storage)
+
+    opclass = "halfvec_cosine_ops" if storage == "halfvec" else "vector_cosine_ops"
+    if index_type == "hnsw":
+        options = f"m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}"
+    else:
+        options = f"lists = {ivfflat_lists(row_count)}"
+
+    return (
+        "CREATE INDEX "
+        + ("CONCURRENTLY " if concurrently else "")
+        + ("IF NOT EXISTS " if if_not_exists else "")
+        + f"{index_name} ON {'ONLY ' if only else ''}{table} "
+        + f"USING {index_type} ({indexed_expression(storage)} {opclass}) WITH ({options})"
+    )
+
+
+def embedding_table_statements(
+    table: str = EMBEDDING_TABLE,
+    partitioned: bool = ENABLE_COLLECTION_PARTITIONING,
+    primary_key: bool = True,
+) -> List[str]:
+    """
+    CREATE TABLE de la table des embeddings (et de sa partition DEFAULT si partitionnée).
+
+    Args:
+        primary_key: False pour un chargement en masse (clé ajoutée après, primary_key_statement)
+    """
+    # Colonne générée dès la création : un ADD COLUMN après chargement réécrirait la table
+    binary_column = f"{BINARY_VECTOR_COLUMN}," if ENABLE_BINARY_QUANTIZATION else ""
+    partition_key = ", PRIMARY KEY (collection_id, id)" if primary_key else ""
+    if not partitioned:
+        return [f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id TEXT {"PRIMARY KEY" if primary_key else "NOT NULL"},
+            collection_id TEXT,
+            embedding VECTOR({EMBEDDING_DIMENSIONS}),
+            document TEXT,
+            cmetadata JSONB,
+            updated_at TIMESTAMPTZ DEFAULT NOW(),
+            embedding_short VECTOR({SHORT_EMBEDDING_DIMENSIONS}),
+            {binary_column}
+            {DOCUMENT_TSV_COLUMN}
+        )
+        """]
+    return [
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id TEXT NOT NULL,
+            collection_id TEXT NOT NULL,
+            embedding VECTOR({EMBEDDING_DIMENSIONS}),
+            document TEXT,
+            cmetadata JSONB,
+            updated_at TIMESTAMPTZ DEFAULT NOW(),
+            embedding_short VECTOR({SHORT_EMBEDDING_DIMENSIONS}),
+            {binary_column}
+            {DOCUMENT_TSV_COLUMN}{partition_key}
+        ) PARTITION BY LIST (collection_id)
+        """,
+        # Collections dont la partition n'a pas pu être créée (devrait rester vide)
+        f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT",
+    ]
+
+
+def primary_key_statement(table: str, partitioned: bool = ENABLE_COLLECTION_PARTITIONING) -> str:
+    """Clé primaire ajoutée après un chargement en masse (embedding_table_statements(primary_key=False))"""
+    columns = "collection_id, id" if partitioned else "id"
+    return f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({columns})"
+
+
+def _index_definition(using: str) -> Callable[..., str]:
+    """definition(name, table, concurrently, only) d'un index secondaire (voir build_index_concurrently)"""
+    def definition(name: str, table: str, concurrently: bool = False, only: bool = False, if_not_exists: bool = False) -> str:
+        return (
+            f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{'IF NOT EXISTS ' if if_not_exists else ''}"
+            f"{name} ON {'ONLY ' if only else ''}{table} {using}"
+        )
+    return definition
+
+
+def secondary_index_definitions(table: str = EMBEDDING_TABLE) -> Dict[str, Callable[..., str]]:
+    """
+    Index secondaires coûteux à construire sur une table peuplée : jamais dans le chemin
+    d'une ingestion, construits CONCURRENTLY par migrate_schema.
+
+    Returns:
+        {nom de l'index: definition(name, table, concurrently, only)}
+    """
+    definitions = {
+        # Recherche lexicale (mode hybride)
+        f"{table}_document_tsv_idx": _index_definition("USING gin (document_tsv)"),
+        # Filtres poussés dans la recherche (tools.retrieval.SearchFilters)
+        f"{table}_cmetadata_idx": _index_definition("USING gin (cmetadata)"),
+        f"{table}_url_idx": _index_definition("((cmetadata->>'url') text_pattern_ops)"),
+    }
+    # Copie binaire des embeddings (première passe Hamming, voir tools/retrieval.py)
+    if ENABLE_BINARY_QUANTIZATION:
+        definitions[f"{table}_embedding_bit_idx"] = _index_definition(
+            f"USING hnsw (embedding_bit bit_hamming_ops) WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+        )
+    return definitions
+
+
+def secondary_index_statements(table: str = EMBEDDING_TABLE) -> List[str]:
+    """CREATE INDEX simples des index secondaires, pour une table vide ou juste chargée"""
+    return [
+        definition(name, table, if_not_exists=True)
+        for name, definition in secondary_index_definitions(table).items()
+    ]
+
+
+# Colonnes dérivées ajoutées à une table existante par migrate_schema : (nom, type, source, expression).
+# Les tables créées ensuite les ont en colonnes générées (embedding_table_statements).
+DERIVED_COLUMNS = [
+    ("document_tsv", "TSVECTOR", "document", f"to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce({{row}}document, ''))"),
+]
+if ENABLE_BINARY_QUANTIZATION:
+    DERIVED_COLUMNS.append((
+        "embedding_bit", f"BIT({EMBEDDING_DIMENSIONS})", "embedding",
+        f"binary_quantize({{row}}embedding)::bit({EMBEDDING_DIMENSIONS})",
+    ))
+
+
+def embedding_schema_statements(table: str = EMBEDDING_TABLE, partitioned: bool = ENABLE_COLLECTION_PARTITIONING) -> List[str]:
+    """
+    Instructions idempotentes de création de la table et de ses index,
+    exécutées avant chaque ingestion : uniquement des instructions sans réécriture de la
+    table. Colonnes dérivées et index secondaires : secondary_index_statements (table vide
+    ou juste chargée) ou migrate_schema (table peuplée, manage.py migrate-schema).
+
+    Args:
+        table: Table cible (nom temporaire lors de la migration vers le partitionnement)
+        partitioned: Table partitionnée par collection_id (création uniquement)
+    """
+    statements = [
+        *embedding_table_statements(table, partitioned),
+        # Date de dernière écriture : synchronisation incrémentale des index locaux (mmap)
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW()",
+        # Préfixe Matryoshka normalisé (colonne nullable : ajout instantané, index via le backfill)
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS embedding_short VECTOR({SHORT_EMBEDDING_DIMENSIONS})",
+        f"CREATE INDEX IF NOT EXISTS {table}_collection_idx ON {table} (collection_id)",
+        f"CREATE INDEX IF NOT EXISTS {table}_updated_at_idx ON {table} (updated_at)",
+        # Sections parentes des chunks enfants (small-to-big), sans embedding
+        PARENT_TABLE_STATEMENT,
+        f"CREATE INDEX IF NOT EXISTS langchain_pg_parent_collection_idx ON {PARENT_TABLE} (collection_id)",
+    ]
+    # HNSW se construit incrémentalement : on peut le créer sur une table vide
+    if VECTOR_INDEX_TYPE == "hnsw":
+        statements.append(index_definition(index_name=f"{table}_embedding_idx", if_not_exists=True, table=table))
+    return statements
+
+
+_missing_warned = False
+
+
+async def _warn_missing_secondary_indexes(cursor) -> None:
+    """Signale (une fois par processus) les index secondaires absents d'une table peuplée"""
+    global _missing_warned
+
+    if _missing_warned:
+        return
+    await cursor.execute(
+        "SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NULL",
+        (list(secondary_index_definitions()),)
+    )
+    missing = [row[0] for row in await cursor.fetchall()]
+    if missing:
+        print(f"⚠️  Index absents ({', '.join(missing)}) : lancer `python manage.py migrate-schema`")
+    _missing_warned = True
+
+
+async def ensure_embedding_schema(conn) -> None:
+    """
+    Crée la table langchain_pg_embedding et ses index si nécessaire (connexion async).
+    Migre aussi l'ancienne colonne collection_id UUID → TEXT.
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT data_type
+            FROM information_schema.columns
+            WHERE table_name = 'langchain_pg_embedding'
+            AND column_name = 'collection_id'
+        """)
+        column_info = await cursor.fetchone()
+
+        if column_info and column_info[0] == 'uuid':
+            print("⚠️  Modification de la colonne collection_id (UUID → TEXT)...")
+            await cursor.execute(f"""
+                ALTER TABLE {EMBEDDING_TABLE}
+                ALTER COLUMN collection_id TYPE TEXT
+                USING collection_id::TEXT
+            """)
+            print("Colonne collection_id modifiée en TEXT")
+
+        await cursor.execute(PARTITIONED_CHECK_SQL, (EMBEDDING_TABLE,))
+        partitioned = (await cursor.fetchone())[0]
+        await cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (EMBEDDING_TABLE,))
+        exists = (await cursor.fetchone())[0]
+        if ENABLE_COLLECTION_PARTITIONING and exists and not partitioned:
+            print("⚠️  Table non partitionnée : lancer `python manage.py partition-table`")
+
+        # Table existante : sa structure fait foi (ENABLE_COLLECTION_PARTITIONING ne vaut qu'à la création)
+        for statement in embedding_schema_statements(partitioned=partitioned if exists else ENABLE_COLLECTION_PARTITIONING):
+            await cursor.execute(statement)
+
+        if not exists:
+            # Table vide : index secondaires immédiats
+            for statement in secondary_index_statements():
+                await cursor.execute(statement)
+        else:
+            await _warn_missing_secondary_indexes(cursor)
+
+    await conn.commit()
+
+
+async def ensure_collection_partition(conn, collection: str) -> bool:
+    """
+    Crée la partition de `collection` à sa première ingestion si la table est partitionnée
+    (connexion async ; elle hérite des index de la table parente).
+
+    Returns:
+        True si la table est partitionnée (cible ON CONFLICT (collection_id, id))
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute(PARTITIONED_CHECK_SQL, (EMBEDDING_TABLE,))
+        if not (await cursor.fetchone())[0]:
+            return False
+
+        await cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (partition_name(collection),))
+        if not (await cursor.fetchone())[0]:
+            try:
+                async with conn.transaction():
+                    await cursor.execute(partition_statement(collection))
+                print(f"✓ Partition {partition_name(collection)} créée (collection '{collection}')")
+            except psycopg.Error as e:
+                # Lignes de cette collection déjà présentes dans la partition DEFAULT : elles y restent
+                print(f"⚠️  Partition de '{collection}' non créée, écriture dans {DEFAULT_PARTITION}: {e}")
+
+    # Verrou de la table parente relâché avant l'ingestion
+    await conn.commit()
+    return True
+
+
+def _is_partitioned(cursor, table: str = EMBEDDING_TABLE) -> bool:
+    cursor.execute(PARTITIONED_CHECK_SQL, (table,))
+    return bool(cursor.fetchone()[0])
+
+
+def _partitions(cursor, table: str = EMBEDDING_TABLE) -> List[str]:
+    cursor.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+        """,
+        (table,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _table_indexes(cursor, table: str) -> List[str]:
+    cursor.execute(
+        """
+        SELECT c.relname
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(%s)
+        """,
+        (table,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _drop_index(cursor, index_name: str, partitioned: bool) -> None:
+    """DROP INDEX CONCURRENTLY, sauf index de table partitionnée (non supporté : DROP simple)"""
+    cursor.execute(f"DROP INDEX {'' if partitioned else 'CONCURRENTLY '}IF EXISTS {index_name}")
+
+
+def build_index_concurrently(cursor, index_name: str, definition: Callable[..., str]) -> None:
+    """
+    Construit un index sans bloquer les écritures (connexion en autocommit).
+
+    Table simple : CREATE INDEX CONCURRENTLY. Table partitionnée (CONCURRENTLY interdit sur la
+    parente) : index ON ONLY sur la parente (invalide), un index CONCURRENTLY par partition
+    rattaché aussitôt ; l'index parent devient valide au rattachement de la dernière partition.
+
+    Args:
+        definition: (index_name, table, concurrently, only) → instruction CREATE INDEX
+    """
+    if not _is_partitioned(cursor):
+        cursor.execute(definition(index_name, EMBEDDING_TABLE, True, False))
+        return
+
+    cursor.execute(definition(index_name, EMBEDDING_TABLE, False, True))
+    stamp = int(time.time())
+    for position, partition in enumerate(_partitions(cursor)):
+        child_name = f"{index_name[:40]}_{stamp}_{position}"
+        print(f"   → {partition}")
+        cursor.execute(definition(child_name, partition, True, False))
+        cursor.execute(f"ALTER INDEX {index_name} ATTACH PARTITION {child_name}")
+
+
+def _index_is_valid(cursor, index_name: str) -> bool:
+    cursor.execute(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+        (index_name,)
+    )
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def migrate_vector_index(
+    index_type: Optional[str] = None,
+    storage: Optional[str] = None,
+    keep_previous: bool = False,
+) -> str:
+    """
+    Reconstruit l'index vectoriel sans interruption de service :
+    1. CREATE INDEX CONCURRENTLY sous un nom temporaire (lectures/écritures non bloquées)
+    2. Échange des noms dans une transaction courte (lock_timeout)
+    3. DROP INDEX CONCURRENTLY de l'ancien index (sauf keep_previous)
+
+    Utiliser keep_previous=True lors d'un changement de VECTOR_STORAGE : les workers
+    non redémarrés continuent d'utiliser l'ancien index jusqu'au redéploiement.
+
+    Returns:
+        Instruction CREATE INDEX exécutée
+    """
+    index_type = index_type or VECTOR_INDEX_TYPE
+    storage = storage or VECTOR_STORAGE
+    _validate_mode(index_type, storage)
+
+    new_name = f"{VECTOR_INDEX_NAME}_new"
+    previous_name = f"{VECTOR_INDEX_NAME}_previous"
+
+    # CREATE INDEX CONCURRENTLY est interdit dans une transaction : connexion dédiée en autocommit
+    with psycopg.connect(POSTGRES_CONNECTION_STRING, autocommit=True) as conn, conn.cursor() as cursor:
+        partitioned = _is_partitioned(cursor)
+        cursor.execute(f"SELECT COUNT(*) FROM {EMBEDDING_TABLE}")
+        row_count = cursor.fetchone()[0]
+        if index_type == "ivfflat" and row_count < IVFFLAT_MIN_ROWS:
+            raise RuntimeError(
+                f"Seulement {row_count} lignes : un index ivfflat nécessite au moins {IVFFLAT_MIN_ROWS} lignes "
+                "pour des centroïdes pertinents. Utiliser VECTOR_INDEX_TYPE=hnsw ou charger les données d'abord."
+            )
+
+        # Reste d'une migration interrompue (index INVALID) ou précédente (keep_previous)
+        _drop_index(cursor, new_name, partitioned)
+        _drop_index(cursor, previous_name, partitioned)
+        cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", (INDEX_BUILD_MAINTENANCE_WORK_MEM,))
+
+        def definition(name: str, table: str, concurrently: bool, only: bool) -> str:
+            # Listes ivfflat dimensionnées sur la table indexée (partition comprise)
+            rows = row_count
+            if index_type == "ivfflat" and table != EMBEDDING_TABLE:
+                rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            return index_definition(
+                index_name=name,
+                index_type=index_type,
+                storage=storage,
+                row_count=rows,
+                concurrently=concurrently,
+                table=table,
+                only=only,
+            )
+
+        statement = definition(new_name, EMBEDDING_TABLE, True, False)
+        print(f"→ Construction du nouvel index ({row_count} lignes{', par partition' if partitioned else ''}): {statement}")
+        build_index_concurrently(cursor, new_name, definition)
+
+        if not _index_is_valid(cursor, new_name):
+            raise RuntimeError(f"L'index {new_name} est invalide après construction, migration annulée")
+
+        # Échange atomique des noms (verrou bref, abandon si une requête longue le bloque)
+        with conn.transaction():
+            cursor.execute("SET LOCAL lock_timeout = '5s'")
+            cursor.execute(f"ALTER INDEX IF EXISTS {VECTOR_INDEX_NAME} RENAME TO {previous_name}")
+            cursor.execute(f"ALTER INDEX {new_name} RENAME TO {VECTOR_INDEX_NAME}")
+        print(f"✓ Index {VECTOR_INDEX_NAME} remplacé ({index_type}, {storage})")
+
+        if not keep_previous:
+            _drop_index(cursor, previous_name, partitioned)
+            print("✓ Ancien index supprimé")
+        else:
+            print(f"ℹ️  Ancien index conservé sous le nom {previous_name}")
+
+    return statement
+
+
+def short_index_definition(name: str, table: str = EMBEDDING_TABLE, concurrently: bool = False, only: bool = False) -> str:
+    """CREATE INDEX HNSW (produit scalaire) de embedding_short"""
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{name} ON {'ONLY ' if only else ''}{table} "
+        f"USING hnsw (embedding_short vector_ip_ops) WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+    )
+
+
+def backfill_short_embeddings(batch_size: int = SHORT_BACKFILL_BATCH_SIZE) -> int:
+    """
+    Remplit embedding_short pour les lignes existantes (par lots courts, sans verrou long),
+    puis crée son index HNSW (CONCURRENTLY).
+
+    Le préfixe est calculé côté serveur : l2_normalize(subvector(embedding, 1, N)) (pgvector >= 0.7).
+
+    Returns:
+        Nombre de lignes remplies
+    """
+    total = 0
+    with psycopg.connect(POSTGRES_CONNECTION_STRING, autocommit=True) as conn:
+        while True:
+            cursor = conn.execute(
+                f"""
+                UPDATE {EMBEDDING_TABLE}
+                SET embedding_short = l2_normalize(subvector(embedding, 1, {SHORT_EMBEDDING_DIMENSIONS}))
+                WHERE id IN (
+                    SELECT id FROM {EMBEDDING_TABLE}
+                    WHERE embedding_short IS NULL AND embedding IS NOT NULL
+                    LIMIT %s
+                )
+                """,
+                (batch_size,)
+            )
+            if cursor.rowcount <= 0:
+                break
+            total += cursor.rowcount
+            print(f"   {total} lignes remplies...")
+
+        print(f"🔨 Création de l'index {SHORT_INDEX_NAME} (CONCURRENTLY)...")
+        conn.execute(f"SET maintenance_work_mem = '{INDEX_BUILD_MAINTENANCE_WORK_MEM}'")
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (SHORT_INDEX_NAME,))
+            if not cursor.fetchone()[0]:
+                build_index_concurrently(cursor, SHORT_INDEX_NAME, short_index_definition)
+
+    print(f"✓ embedding_short rempli pour {total} lignes")
+    return total
+
+
+def _add_derived_column(conn, column: str, column_type: str, source: str, expression: str, batch_size: int) -> int:
+    """
+    Ajoute une colonne dérivée sans réécrire la table : colonne nullable (ajout instantané),
+    maintenue par un trigger pour les nouvelles écritures, remplie par lots courts pour
+    les lignes existantes.
+
+    Returns:
+        Nombre de lignes remplies
+    """
+    conn.execute(f"ALTER TABLE {EMBEDDING_TABLE} ADD COLUMN IF NOT EXISTS {column} {column_type}")
+    generated = conn.execute(
+        """
+        SELECT is_generated = 'ALWAYS' FROM information_schema.columns
+        WHERE table_name = %s AND column_name = %s
+        """,
+        (EMBEDDING_TABLE, column)
+    ).fetchone()[0]
+    if generated:
+        return 0
+
+    function = f"{EMBEDDING_TABLE}_{column}_fill"
+    with conn.transaction():
+        conn.execute(f"""
+            CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                NEW.{column} := {expression.format(row="NEW.")};
+                RETURN NEW;
+            END
+            $$
+        """)
+        conn.execute(f"DROP TRIGGER IF EXISTS {function} ON {EMBEDDING_TABLE}")
+        conn.execute(
+            f"CREATE TRIGGER {function} BEFORE INSERT OR UPDATE OF {source} ON {EMBEDDING_TABLE} "
+            f"FOR EACH ROW EXECUTE FUNCTION {function}()"
+        )
+
+    total = 0
+    while True:
+        cursor = conn.execute(
+            f"""
+            UPDATE {EMBEDDING_TABLE}
+            SET {column} = {expression.format(row="")}
+            WHERE id IN (
+                SELECT id FROM {EMBEDDING_TABLE}
+                WHERE {column} IS NULL AND {source} IS NOT NULL
+                LIMIT %s
+            )
+            """,
+            (batch_size,)
+        )
+        if cursor.rowcount <= 0:
+            break
+        total += cursor.rowcount
+        print(f"   {column}: {total} lignes remplies...")
+    return total
+
+
+def migrate_schema(batch_size: int = SHORT_BACKFILL_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Met une table peuplée au niveau du schéma courant, hors du chemin des requêtes :
+    1. Colonnes dérivées absentes (DERIVED_COLUMNS) : nullable + trigger + remplissage par lots
+    2. Index secondaires absents ou invalides : CREATE INDEX CONCURRENTLY (par partition si besoin)
+
+    Returns:
+        Lignes remplies par colonne dérivée
+    """
+    filled: Dict[str, int] = {}
+    with psycopg.connect(POSTGRES_CONNECTION_STRING, autocommit=True) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (EMBEDDING_TABLE,))
+        if not cursor.fetchone()[0]:
+            raise RuntimeError(f"{EMBEDDING_TABLE} n'existe pas (créée à la première ingestion)")
+
+        for column, column_type, source, expression in DERIVED_COLUMNS:
+            filled[column] = _add_derived_column(conn, column, column_type, source, expression, batch_size)
+
+        partitioned = _is_partitioned(cursor)
+        cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", (INDEX_BUILD_MAINTENANCE_WORK_MEM,))
+        for name, definition in secondary_index_definitions().items():
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+            if cursor.fetchone()[0]:
+                if _index_is_valid(cursor, name):
+                    continue
+                # Reste d'une construction CONCURRENTLY interrompue
+                _drop_index(cursor, name, partitioned)
+            print(f"🔨 Création de l'index {name} (CONCURRENTLY)...")
+            build_index_concurrently(cursor, name, definition)
+
+    print(f"✓ Schéma à jour ({', '.join(f'{column}: {count} lignes' for column, count in filled.items())})")
+    return filled
+
+
+def drop_previous_vector_index() -> None:
+    """Supprime l'index conservé par migrate_vector_index(keep_previous=True)"""
+    with psycopg.connect(POSTGRES_CONNECTION_STRING, autocommit=True) as conn, conn.cursor() as cursor:
+        _drop_index(cursor, f"{VECTOR_INDEX_NAME}_previous", _is_partitioned(cursor))
+    print(f"✓ Index {VECTOR_INDEX_NAME}_previous supprimé")
+
+
+def drop_collection(collection: str) -> str:
+    """
+    Supprime une collection (chunks et sections parentes).
+
+    Table partitionnée : DETACH + DROP de sa partition dans une transaction courte
+    (opération de catalogue, pas de VACUUM). DETACH ... CONCURRENTLY est interdit en
+    présence d'une partition DEFAULT : verrou bref sur la parente, borné par lock_timeout.
+    Sinon (ou lignes dans la partition DEFAULT) : DELETE.
+
+    Returns:
+        "partition" ou "delete"
+    """
+    with psycopg.connect(POSTGRES_CONNECTION_STRING, autocommit=True) as conn, conn.cursor() as cursor:
+        partition = partition_name(collection)
+        method = "delete"
+        if _is_partitioned(cursor) and partition in _partitions(cursor):
+            with conn.transaction():
+                cursor.execute("SET LOCAL lock_timeout = '5s'")
+                cursor.execute(f"ALTER TABLE {EMBEDDING_TABLE} DETACH PARTITION {partition}")
+                cursor.execute(f"DROP TABLE {partition}")
+            method = "partition"
+            print(f"✓ Partition {partition} détachée et supprimée")
+
+        # Lignes hors partition dédiée (table simple ou partition DEFAULT)
+        cursor.execute(f"DELETE FROM {EMBEDDING_TABLE} WHERE collection_id = %s", (collection,))
+        if cursor.rowcount:
+            print(f"✓ {cursor.rowcount} chunks supprimés (DELETE)")
+        cursor.execute(f"DELETE FROM {PARENT_TABLE} WHERE collection_id = %s", (collection,))
+    return method
+
+
+def _rename_indexes(cursor, table: str, prefix: str) -> None:
+    """Renomme les index <table>_* de `table` en <prefix>_*"""
+    for index in _table_indexes(cursor, table):
+        if index.startswith(f"{table}_"):
+            cursor.execute(f"ALTER INDEX {index} RENAME TO {prefix}_{index[len(table) + 1:]}")
+
+
+def swap_embedding_table(cursor, new_table: str, old_table: Optional[str] = None) -> None:
+    """
+    Remplace langchain_pg_embedding par `new_table` (dans la transaction courante),
+    index et partition DEFAULT compris.
+
+    Args:
+        new_table: Table construite sous un nom temporaire (mêmes suffixes d'index)
+        old_table: Nouveau nom de la table remplacée (None : la table cible n'existe pas)
+    """
+    if old_table:
+        _rename_indexes(cursor, EMBEDDING_TABLE, old_table)
+        cursor.execute(f"ALTER TABLE {EMBEDDING_TABLE} RENAME TO {old_table}")
+    _rename_indexes(cursor, new_table, EMBEDDING_TABLE)
+    cursor.execute(f"ALTER TABLE {new_table} RENAME TO {EMBEDDING_TABLE}")
+    cursor.execute(f"ALTER TABLE IF EXISTS {new_table}_default RENAME TO {DEFAULT_PARTITION}")
+
+
+def partition_embedding_table() -> Dict[str, int]:
+    """
+    Migre langchain_pg_embedding vers une table partitionnée par collection_id :
+    1. Nouvelle table partitionnée (nom temporaire), une partition par collection existante
+    2. Copie collection par collection (lectures et écritures continuent sur l'ancienne table)
+    3. Création des index après chargement (plus rapide qu'une insertion indexée)
+    4. Transaction courte : rattrapage des lignes écrites pendant la copie, échange des noms
+       de tables et d'index. L'ancienne table est conservée (_unpartitioned) pour retour arrière.
+
+    Les suppressions faites pendant la copie ne sont pas reportées. Les lignes sans
+    collection_id sont rangées dans la collection UNASSIGNED_COLLECTION.
+
+    Returns:
+        Lignes copiées par collection
+    """
+    new_table = f"{EMBEDDING_TABLE}_partitioned"
+    old_table = f"{EMBEDDING_TABLE}_unpartitioned"
+    copied: Dict[str, int] = {}
+
+    with psycopg.connect(POSTGRES_CONNECTION_STRING, autocommit=True) as conn, conn.cursor() as cursor:
+        if _is_partitioned(cursor):
+            raise RuntimeError(f"{EMBEDDING_TABLE} est déjà partitionnée")
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (old_table,))
+        if cursor.fetchone()[0]:
+            raise RuntimeError(f"{old_table} existe (migration précédente) : la supprimer avant de relancer")
+
+        # Reste d'une migration interrompue
+        cursor.execute(f"DROP TABLE IF EXISTS {new_table} CASCADE")
+        for statement in embedding_table_statements(new_table, partitioned=True):
+            cursor.execute(statement)
+
+        cursor.execute("SELECT NOW()")
+        started_at = cursor.fetchone()[0]
+        cursor.execute(f"SELECT DISTINCT collection_id FROM {EMBEDDING_TABLE}")
+        collections = [row[0] for row in cursor.fetchall()]
+
+        for collection in collections:
+            target = collection if collection is not None else UNASSIGNED_COLLECTION
+            cursor.execute(partition_statement(target, table=new_table))
+            condition = "collection_id = %s" if collection is not None else "collection_id IS NULL"
+            cursor.execute(
+                f"""
+                INSERT INTO {new_table} ({MIGRATED_COLUMNS})
+                SELECT id, %s, embedding, document, cmetadata, updated_at, embedding_short
+                FROM {EMBEDDING_TABLE} WHERE {condition}
+                """,
+                (target, collection) if collection is not None else (target,)
+            )
+            copied[target] = cursor.rowcount
+            print(f"   {target}: {cursor.rowcount} lignes → {partition_name(target)}")
+
+        print("🔨 Création des index (par partition)...")
+        cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", (INDEX_BUILD_MAINTENANCE_WORK_MEM,))
+        for statement in [*embedding_schema_statements(new_table, partitioned=True), *secondary_index_statements(new_table)]:
+            cursor.execute(statement)
+        if VECTOR_INDEX_TYPE == "ivfflat":
+            cursor.execute(index_definition(
+                index_name=f"{new_table}_embedding_idx", row_count=sum(copied.values()), table=new_table
+            ))
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (SHORT_INDEX_NAME,))
+        if cursor.fetchone()[0]:
+            cursor.execute(short_index_definition(f"{new_table}_embedding_short_idx", new_table))
+
+        with conn.transaction():
+            cursor.execute("SET LOCAL lock_timeout = '10s'")
+            # Bloque les écritures (pas les lectures) le temps du rattrapage et de l'échange
+            cursor.execute(f"LOCK TABLE {EMBEDDING_TABLE} IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute(
+                f"SELECT DISTINCT collection_id FROM {EMBEDDING_TABLE} WHERE updated_at >= %s AND collection_id IS NOT NULL",
+                (started_at,)
+            )
+            for (collection,) in cursor.fetchall():
+                if collection not in copied:
+                    cursor.execute(partition_statement(collection, table=new_table))
+            cursor.execute(
+                f"""
+                INSERT INTO {new_table} ({MIGRATED_COLUMNS})
+                SELECT id, COALESCE(collection_id, %s), embedding, document, cmetadata, updated_at, embedding_short
+                FROM {EMBEDDING_TABLE} WHERE updated_at >= %s
+                ON CONFLICT (collection_id, id) DO UPDATE
+                SET embedding = EXCLUDED.embedding,
+                    embedding_short = EXCLUDED.embedding_short,
+                    document = EXCLUDED.document,
+                    cmetadata = EXCLUDED.cmetadata,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                (UNASSIGNED_COLLECTION, started_at)
+            )
+            print(f"   Rattrapage: {cursor.rowcount} lignes écrites pendant la copie")
+
+            swap_embedding_table(cursor, new_table, old_table)
+
+    print(f"✓ {EMBEDDING_TABLE} partitionnée ({len(copied)} collections) ; ancienne table : {old_table}")
+    return copied
@@ -0,0 +1,194 @@
+"""
+Sharding de la base vectorielle sur plusieurs instances PostgreSQL (pgvector)
+
+Avec SHARD_DSNS (chaînes de connexion séparées par des virgules), les chunks sont répartis
+entre les instances et chaque recherche est envoyée à toutes en parallèle (scatter-gather,
+voir tools/sharding.py). Sans SHARD_DSNS, tout passe par POSTGRES_CONNECTION_STRING.
+
+Placement (SHARD_KEY) : hash stable (blake2b, pas hash() qui change à chaque processus)
+- "source" : URL du document, ou nom de fichier pour les uploads (défaut) ;
+  tous les chunks et parents d'un même document sont sur le même shard
+- "collection" : toute une collection sur un même shard
+
+Changer SHARD_DSNS ou SHARD_KEY déplace le placement : les documents déjà ingérés
+restent sur leur shard d'origine (toujours interrogé), une ré-ingestion peut créer un
+doublon sur un autre shard.
+
+Chaque shard a ses propres pools (mêmes réglages DB_POOL_*), créés à la première utilisation.
+"""
+
+import os
+import hashlib
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, List, Optional
+
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+
+from database.pool import (
+    DB_POOL_MAX_IDLE,
+    DB_POOL_MAX_LIFETIME,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MAX_WAITING,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_TIMEOUT,
+    _configure_async_connection,
+    _configure_connection,
+    get_async_connection,
+    get_connection,
+)
+
+# Configuration
+SHARD_DSNS = [dsn.strip() for dsn in os.getenv("SHARD_DSNS", "").split(",") if dsn.strip()]
+SHARD_KEY = os.getenv("SHARD_KEY", "source").lower()  # source | collection
+
+# Champs de cmetadata identifiant le document source (même convention que small_to_big)
+SOURCE_KEYS = ("url", "filename")
+
+_sync_pools: Dict[int, ConnectionPool] = {}
+_async_pools: Dict[int, AsyncConnectionPool] = {}
+_sync_lock = threading.Lock()
+_async_lock: Optional[asyncio.Lock] = None  # Créé à la première utilisation, dans une boucle active
+
+
+def is_sharded() -> bool:
+    return bool(SHARD_DSNS)
+
+
+def shard_for_key(key: str, shard_count: Optional[int] = None) -> int:
+    """Shard d'une clé de placement (hash stable entre processus et redémarrages)"""
+    shard_count = shard_count or len(SHARD_DSNS) or 1
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+def placement_key(collection: str, metadata: Optional[Dict] = None) -> str:
+    """Clé de placement d'un document selon SHARD_KEY"""
+    if SHARD_KEY == "source":
+        for key in SOURCE_KEYS:
+            if (metadata or {}).get(key):
+                return f"{key}:{metadata[key]}"
+    return f"collection:{collection}"
+
+
+def shard_for_document(collection: str, metadata: Optional[Dict] = None) -> Optional[int]:
+    """Shard d'un document à l'ingestion (None sans sharding)"""
+    if not is_sharded():
+        return None
+    return shard_for_key(placement_key(collection, metadata))
+
+
+def get_shard_pool(shard: int) -> ConnectionPool:
+    """Pool synchrone d'un shard (créé à la première utilisation)"""
+    if shard not in _sync_pools:
+        with _sync_lock:
+            if shard not in _sync_pools:
+                _sync_pools[shard] = ConnectionPool(
+                    conninfo=SHARD_DSNS[shard],
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_waiting=DB_POOL_MAX_WAITING,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    configure=_configure_connection,
+                    check=ConnectionPool.check_connection,
+                    name=f"dagan-shard-{shard}",
+                    open=True,
+                )
+                print(f"✓ Pool PostgreSQL du shard {shard} ouvert")
+
+    return _sync_pools[shard]
+
+
+def _get_async_lock() -> asyncio.Lock:
+    """
+    Verrou asynchrone créé à la première utilisation : créé à l'import, il serait lié
+    (avant Python 3.10) à la boucle courante de l'import, pas à celle d'uvicorn
+    """
+    global _async_lock
+
+    if _async_lock is None:
+        with _sync_lock:
+            if _async_lock is None:
+                _async_lock = asyncio.Lock()
+    return _async_lock
+
+
+async def get_async_shard_pool(shard: int) -> AsyncConnectionPool:
+    """Pool asynchrone d'un shard (ouvert dans la boucle d'événements courante)"""
+    if shard not in _async_pools:
+        async with _get_async_lock():
+            if shard not in _async_pools:
+                pool = AsyncConnectionPool(
+                    conninfo=SHARD_DSNS[shard],
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_waiting=DB_POOL_MAX_WAITING,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    configure=_configure_async_connection,
+                    check=AsyncConnectionPool.check_connection,
+                    name=f"dagan-async-shard-{shard}",
+                    open=False,
+                )
+                await pool.open()
+                _async_pools[shard] = pool
+                print(f"✓ Pool PostgreSQL asynchrone du shard {shard} ouvert")
+
+    return _async_pools[shard]
+
+
+@contextmanager
+def shard_connection(shard: Optional[int] = None):
+    """
+    Connexion synchrone au shard `shard`, ou au pool principal si None
+    (lignes sans clé "shard" : déploiement non shardé)
+    """
+    if shard is None:
+        with get_connection() as conn:
+            yield conn
+    else:
+        with get_shard_pool(shard).connection() as conn:
+            yield conn
+
+
+@asynccontextmanager
+async def async_shard_connection(shard: Optional[int] = None):
+    """Connexion asynchrone au shard `shard`, ou au pool principal si None"""
+    if shard is None:
+        async with get_async_connection() as conn:
+            yield conn
+    else:
+        pool = await get_async_shard_pool(shard)
+        async with pool.connection() as conn:
+            yield conn
+
+
+def group_by_shard(rows: List[Dict]) -> Dict[Optional[int], List[Dict]]:
+    """Lignes de recherche regroupées par shard d'origine (clé "shard", None sans sharding)"""
+    groups: Dict[Optional[int], List[Dict]] = {}
+    for row in rows:
+        groups.setdefault(row.get("shard"), []).append(row)
+    return groups
+
+
+def shard_pool_stats() -> Dict[str, Dict[str, int]]:
+    stats = {}
+    for shard, pool in _sync_pools.items():
+        stats[f"shard-{shard}"] = pool.get_stats()
+    for shard, pool in _async_pools.items():
+        stats[f"async-shard-{shard}"] = pool.get_stats()
+    return stats
+
+
+async def close_shard_pools() -> None:
+    """Ferme les pools des shards (arrêt de l'application)"""
+    for pool in list(_async_pools.values()):
+        await pool.close()
+    _async_pools.clear()
+    for pool in list(_sync_pools.values()):
+        pool.close()
+    _sync_pools.clear()
@@ -36,21 +36,53 @@ CREATE TABLE IF NOT EXISTS langchain_pg_embedding (
     collection_id TEXT NOT NULL,            -- Nom de la collection (e.g., "crawled_documents")
     embedding VECTOR(2000),                 -- OpenAI text-embedding-3-large (2000 dimensions)
     document TEXT NOT NULL,                 -- Contenu textuel du chunk
-    cmetadata JSONB                         -- Métadonnées : {url, favicon, chunk_index, chunk_count, is_official, ...}
+    cmetadata JSONB,                        -- Métadonnées : {url, favicon, chunk_index, chunk_count, is_official, ...}
+    updated_at TIMESTAMPTZ DEFAULT NOW(),   -- Dernière écriture (synchronisation incrémentale de l'index mmap)
+    embedding_short VECTOR(256),            -- Préfixe Matryoshka normalisé (RETRIEVAL_MODE=two_stage)
+    -- Texte indexé pour la recherche lexicale (mode hybride), maintenu automatiquement à l'ingestion
+    document_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('french', coalesce(document, ''))) STORED
 );
 
 
 -- ============================================
 -- 3. INDEX POUR RECHERCHE VECTORIELLE
 -- ============================================
--- Index IVFFlat pour recherche de similarité cosinus
--- Optimal pour datasets de taille moyenne (10K-1M vecteurs)
+-- Index HNSW pour recherche de similarité cosinus
+-- Contrairement à IVFFlat, HNSW peut être créé sur une table vide
+-- (IVFFlat calcule ses centroïdes à la création : un index créé à vide est inutile)
 -- 
 -- Utilisation : ORDER BY embedding <=> query_vector
+-- 
+-- Modes alternatifs (VECTOR_INDEX_TYPE / VECTOR_STORAGE, voir database/schema.py) :
+-- - halfvec : index 2x plus petit, la requête utilise alors embedding::halfvec(2000)
+--     USING hnsw ((embedding::halfvec(2000)) halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)
+-- - ivfflat : à construire une fois les données chargées (lists ≈ lignes / 1000)
+-- 
+-- Changement de mode sans interruption (CREATE INDEX CONCURRENTLY + échange) :
+--     python manage.py migrate-index --type hnsw --storage halfvec
 CREATE INDEX IF NOT EXISTS langchain_pg_embedding_embedding_idx 
 ON langchain_pg_embedding 
-USING ivfflat (embedding vector_cosine_ops)
-WITH (lists = 100);
+USING hnsw (embedding vector_cosine_ops)
+WITH (m = 16, ef_construction = 64);
+
+
+-- Quantification binaire optionnelle (ENABLE_BINARY_QUANTIZATION=true, pgvector >= 0.7)
+-- Première passe en distance de Hamming sur 250 octets/chunk, puis rescoring cosinus exact
+-- (RETRIEVAL_MODE=quantized). Créé automatiquement à l'ingestion quand l'option est active :
+-- 
+-- ALTER TABLE langchain_pg_embedding ADD COLUMN IF NOT EXISTS embedding_bit BIT(2000)
+--     GENERATED ALWAYS AS (binary_quantize(embedding)::bit(2000)) STORED;
+-- CREATE INDEX IF NOT EXISTS langchain_pg_embedding_embedding_bit_idx
+-- ON langchain_pg_embedding USING hnsw (embedding_bit bit_hamming_ops) WITH (m = 16, ef_construction = 64);
+
+
+-- Recherche en deux étapes (RETRIEVAL_MODE=two_stage) : candidats sur le préfixe 256 dims
+-- Vecteurs normalisés → produit scalaire (<#>) équivalent au cosinus
+-- Tables existantes : python manage.py backfill-short-embeddings (remplit puis indexe)
+CREATE INDEX IF NOT EXISTS langchain_pg_embedding_embedding_short_idx 
+ON langchain_pg_embedding 
+USING hnsw (embedding_short vector_ip_ops)
+WITH (m = 16, ef_construction = 64);
 
 
 -- ============================================
@@ -63,6 +95,19 @@ CREATE INDEX IF NOT EXISTS langchain_pg_embedding_collection_idx
 ON langchain_pg_embedding (collection_id);
 
 
+-- Synchronisation incrémentale de l'index local mmap (manage.py sync-mmap-index)
+CREATE INDEX IF NOT EXISTS langchain_pg_embedding_updated_at_idx 
+ON langchain_pg_embedding (updated_at);
+
+
+-- Recherche lexicale plein texte (RETRIEVAL_MODE=hybrid, fusion RRF avec la recherche dense)
+-- Tokens exacts des requêtes administratives : ANID, DGDN, "F CFA", numéros de formulaires
+-- 
+-- Utilisation : WHERE document_tsv @@ plainto_tsquery('french', 'carte ANID')
+CREATE INDEX IF NOT EXISTS langchain_pg_embedding_document_tsv_idx 
+ON langchain_pg_embedding USING gin(document_tsv);
+
+
 -- ============================================
 -- 5. INDEX JSONB POUR MÉTADONNÉES
 -- ============================================
@@ -74,6 +119,30 @@ ON langchain_pg_embedding (collection_id);
 CREATE INDEX IF NOT EXISTS langchain_pg_embedding_cmetadata_idx 
 ON langchain_pg_embedding USING gin(cmetadata);
 
+-- Filtre par préfixe d'URL (SearchFilters.url_prefix)
+-- 
+-- Utilisation : WHERE cmetadata->>'url' LIKE 'https://service-public.gouv.tg/%'
+CREATE INDEX IF NOT EXISTS langchain_pg_embedding_url_idx 
+ON langchain_pg_embedding ((cmetadata->>'url') text_pattern_ops);
+
+
+-- ============================================
+-- 5b. TABLE : langchain_pg_parent (chunks small-to-big)
+-- ============================================
+-- Sections parentes (découpage 4000/800) des chunks enfants (~500 caractères)
+-- embeddés dans langchain_pg_embedding (ENABLE_SMALL_TO_BIG=true).
+-- Les enfants pointent vers leur parent via cmetadata->>'parent_id'.
+CREATE TABLE IF NOT EXISTS langchain_pg_parent (
+    id TEXT PRIMARY KEY,
+    collection_id TEXT NOT NULL,
+    document TEXT NOT NULL,
+    cmetadata JSONB,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS langchain_pg_parent_collection_idx 
+ON langchain_pg_parent (collection_id);
+
 
 -- ============================================
 -- 6. TABLE : conversations (Tracking/Monitoring)
@@ -126,34 +195,115 @@ FOR EACH ROW
 EXECUTE FUNCTION update_conversations_updated_at();
 
 
+-- ============================================
+-- 6b. TABLE : embedding_cache (Cache des embeddings de requêtes)
+-- ============================================
+-- Niveau persistant du cache d'embeddings (EMBEDDING_CACHE_BACKEND=postgres)
+-- Clé : sha256(modèle | dimensions | requête normalisée)
+-- Valeur : vecteur float32 brut (BYTEA)
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    key TEXT PRIMARY KEY,
+    embedding BYTEA NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+
+-- ============================================
+-- 6b bis. TABLE : rerank_cache (Cache des scores du reranking LLM)
+-- ============================================
+-- Niveau persistant du cache de reranking (RERANK_CACHE_BACKEND=postgres)
+-- Clé : sha256(version du prompt | documents/web | question normalisée | sha256(texte du candidat))
+-- Valeur : score LLM 0-10 ; expiration (RERANK_CACHE_TTL) et taille (RERANK_CACHE_MAX_ROWS) gérées par l'application
+CREATE TABLE IF NOT EXISTS rerank_cache (
+    key TEXT PRIMARY KEY,
+    score REAL NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS rerank_cache_created_idx ON rerank_cache (created_at);
+
+
+-- ============================================
+-- 6c. TABLES : similarity_log / similarity_thresholds (Seuils calibrés)
+-- ============================================
+-- Journal des candidats rerankés (ENABLE_SIMILARITY_LOG=true) :
+-- similarité cosinus et score du reranker LLM (0-10) par collection
+CREATE TABLE IF NOT EXISTS similarity_log (
+    id BIGSERIAL PRIMARY KEY,
+    collection_id TEXT,
+    similarity REAL NOT NULL,
+    rerank_score REAL NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS similarity_log_created_at_idx
+ON similarity_log (created_at);
+
+-- Seuils par collection (THRESHOLD_STRATEGY=calibrated), recalculés par :
+-- python manage.py calibrate-thresholds
+CREATE TABLE IF NOT EXISTS similarity_thresholds (
+    collection_id TEXT PRIMARY KEY,
+    threshold REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- ============================================
+-- 6d. TABLE : rerank_eval_log (Évaluation du reranking)
+-- ============================================
+-- Une ligne par recherche échantillonnée (RERANK_EVAL_SAMPLE_RATE) : ordre par similarité
+-- comparé à l'ordre reranké, latence ajoutée. Synthèse : python manage.py rerank-report
+CREATE TABLE IF NOT EXISTS rerank_eval_log (
+    id BIGSERIAL PRIMARY KEY,
+    collection_id TEXT,
+    candidates INTEGER NOT NULL,
+    top_k INTEGER NOT NULL,
+    spearman REAL,
+    top_k_overlap REAL NOT NULL,
+    latency_ms REAL NOT NULL,
+    llm_called BOOLEAN NOT NULL,
+    shadow BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS rerank_eval_log_created_at_idx
+ON rerank_eval_log (created_at);
+
 -- ============================================
 -- 7. FONCTION : match_documents
 -- ============================================
--- Fonction helper pour recherche de similarité vectorielle
+-- Fonction helper pour recherche de similarité vectorielle (équivalent SQL de
+-- tools.retrieval.search_documents, pour les appels RPC Supabase)
 -- 
 -- Paramètres :
 -- - query_embedding : Vecteur de la question (VECTOR(2000))
--- - collection_name_param : Nom de la collection à interroger
+-- - collection_names : Collections à interroger (NULL = toutes)
 -- - match_threshold : Seuil de similarité minimum (défaut: 0.7)
 -- - match_count : Nombre maximum de résultats (défaut: 5)
--- - filter_metadata : Filtre JSONB optionnel (défaut: NULL)
+-- - filter_metadata : Filtre JSONB optionnel, ex: '{"is_official": true}' (défaut: NULL)
 -- 
 -- Retour :
 -- - id : Identifiant du document
+-- - collection_id : Collection du document
 -- - document : Contenu textuel
 -- - cmetadata : Métadonnées complètes
 -- - similarity : Score de similarité (0-1, plus proche de 1 = plus similaire)
 -- 
--- Utilisation optionnelle (actuellement vector_search_tool fait la recherche directement)
+-- Le ORDER BY porte sur la distance (index HNSW) ; le seuil est appliqué après le LIMIT.
+-- hnsw.iterative_scan (pgvector >= 0.8) poursuit le parcours de l'index tant que les
+-- filtres n'ont pas laissé passer match_count lignes.
+DROP FUNCTION IF EXISTS match_documents(VECTOR(2000), TEXT, FLOAT, INT, JSONB);
+
 CREATE OR REPLACE FUNCTION match_documents(
     query_embedding VECTOR(2000),
-    collection_name_param TEXT,
+    collection_names TEXT[] DEFAULT NULL,
     match_threshold FLOAT DEFAULT 0.7,
     match_count INT DEFAULT 5,
     filter_metadata JSONB DEFAULT NULL
 )
 RETURNS TABLE (
     id TEXT,
+    collection_id TEXT,
     document TEXT,
     cmetadata JSONB,
     similarity FLOAT
@@ -161,19 +311,27 @@ RETURNS TABLE (
 LANGUAGE plpgsql
 AS $$
 BEGIN
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
+
     RETURN QUERY
-    SELECT
-        e.id,
-        e.document,
-        e.cmetadata,
-        1 - (e.embedding <=> query_embedding) AS similarity
-    FROM langchain_pg_embedding e
-    WHERE 
-        e.collection_id = collection_name_param
-        AND (filter_metadata IS NULL OR e.cmetadata @> filter_metadata)
-        AND 1 - (e.embedding <=> query_embedding) > match_threshold
-    ORDER BY e.embedding <=> query_embedding
-    LIMIT match_count;
+    WITH nearest AS MATERIALIZED (
+        SELECT
+            e.id,
+            e.collection_id,
+            e.document,
+            e.cmetadata,
+            e.embedding <=> query_embedding AS distance
+        FROM langchain_pg_embedding e
+        WHERE 
+            (collection_names IS NULL OR e.collection_id = ANY(collection_names))
+            AND (filter_metadata IS NULL OR e.cmetadata @> filter_metadata)
+        ORDER BY e.embedding <=> query_embedding
+        LIMIT match_count
+    )
+    SELECT n.id, n.collection_id, n.document, n.cmetadata, 1 - n.distance
+    FROM nearest n
+    WHERE 1 - n.distance > match_threshold
+    ORDER BY n.distance;
 END;
 $$;
 
@@ -189,6 +347,11 @@ $$;
 -- Retour : Nombre de documents supprimés
 -- 
 -- Utilisation : Maintenance, nettoyage de données
+-- 
+-- Table partitionnée par collection (ENABLE_COLLECTION_PARTITIONING, manage.py partition-table) :
+-- la partition de la collection est détachée puis supprimée (pas de DELETE ligne à ligne).
+-- Le nom de partition est calculé côté Python (database/schema.py, partition_name) :
+-- elle est retrouvée par sa borne FOR VALUES IN ('<collection>').
 CREATE OR REPLACE FUNCTION delete_documents_by_collection(
     collection_name_param TEXT
 )
@@ -196,12 +359,33 @@ RETURNS INTEGER
 LANGUAGE plpgsql
 AS $$
 DECLARE
-    deleted_count INTEGER;
+    deleted_count INTEGER := 0;
+    partition_oid REGCLASS;
+    partition_rows INTEGER;
 BEGIN
+    SELECT c.oid::regclass INTO partition_oid
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'langchain_pg_embedding'::regclass
+    AND pg_get_expr(c.relpartbound, c.oid) = format('FOR VALUES IN (%L)', collection_name_param);
+
+    IF partition_oid IS NOT NULL THEN
+        EXECUTE format('SELECT COUNT(*) FROM %s', partition_oid) INTO partition_rows;
+        SET LOCAL lock_timeout = '5s';
+        EXECUTE format('ALTER TABLE langchain_pg_embedding DETACH PARTITION %s', partition_oid);
+        EXECUTE format('DROP TABLE %s', partition_oid);
+        deleted_count := partition_rows;
+    END IF;
+
+    -- Table non partitionnée, ou lignes restées dans la partition DEFAULT
     DELETE FROM langchain_pg_embedding
     WHERE collection_id = collection_name_param;
     
-    GET DIAGNOSTICS deleted_count = ROW_COUNT;
+    GET DIAGNOSTICS partition_rows = ROW_COUNT;
+    deleted_count := deleted_count + partition_rows;
+    
+    DELETE FROM langchain_pg_parent
+    WHERE collection_id = collection_name_param;
     
     RETURN deleted_count;
 END;
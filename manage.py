@@ -0,0 +1,362 @@
+"""
+Commandes de maintenance Dagan (base vectorielle)
+
+Usage :
+    python manage.py check-index
+    python manage.py migrate-index [--type hnsw|ivfflat] [--storage vector|halfvec] [--keep-previous]
+    python manage.py drop-previous-index
+    python manage.py build-mmap-index [--dtype float16|float32]
+    python manage.py sync-mmap-index
+    python manage.py bench-quantized [--queries 50] [--top-k 20] [--candidates 200]
+    python manage.py backfill-short-embeddings [--batch-size 1000]
+    python manage.py migrate-schema [--batch-size 1000]
+    python manage.py bench-vector-io [--samples 200]
+    python manage.py shard-status
+    python manage.py calibrate-thresholds [--percentile 10] [--min-samples 50] [--days 30]
+    python manage.py partition-table
+    python manage.py drop-collection NAME
+    python manage.py export-snapshot PATH [--dtype float16|float32] [--batch-size 2000]
+    python manage.py import-snapshot PATH [--batch-size 2000]
+    python manage.py rerank-report [--days 30]
+"""
+
+import sys
+import argparse
+
+# Charger les variables d'environnement AVANT les imports qui en dépendent
+from dotenv import load_dotenv
+load_dotenv()
+
+from psycopg.rows import dict_row
+
+from database.pool import get_connection
+from database.schema import EMBEDDING_DIMENSIONS
+
+
+def cmd_check_index(args) -> int:
+    """Vérifie que la requête de vector_search_tool utilise l'index ANN (EXPLAIN)"""
+    from tools.retrieval import check_index_usage
+
+    with get_connection() as conn, conn.cursor(row_factory=dict_row) as cursor:
+        try:
+            indexes = check_index_usage(cursor, dimensions=args.dimensions)
+        except RuntimeError as e:
+            print(f"✗ {e}")
+            return 1
+        finally:
+            conn.rollback()
+
+    print(f"✓ Index ANN utilisé par la recherche vectorielle: {', '.join(indexes)}")
+    return 0
+
+
+def cmd_migrate_index(args) -> int:
+    """Reconstruit l'index vectoriel (CONCURRENTLY) puis l'échange sans interruption"""
+    from database.schema import migrate_vector_index
+
+    try:
+        migrate_vector_index(index_type=args.type, storage=args.storage, keep_previous=args.keep_previous)
+    except (RuntimeError, ValueError) as e:
+        print(f"✗ {e}")
+        return 1
+    return 0
+
+
+def cmd_drop_previous_index(args) -> int:
+    """Supprime l'ancien index conservé par migrate-index --keep-previous"""
+    from database.schema import drop_previous_vector_index
+
+    drop_previous_vector_index()
+    return 0
+
+
+def cmd_build_mmap_index(args) -> int:
+    """Exporte tout le corpus pgvector vers l'index local memmap"""
+    from tools.mmap_index import build_mmap_index
+
+    build_mmap_index(dtype=args.dtype)
+    return 0
+
+
+def cmd_sync_mmap_index(args) -> int:
+    """Ajoute un segment avec les lignes modifiées et marque les tombstones"""
+    from tools.mmap_index import sync_mmap_index
+
+    sync_mmap_index()
+    return 0
+
+
+def cmd_bench_quantized(args) -> int:
+    """Compare rappel et latence : exact, ANN actuel, binaire + rescoring"""
+    from tools.search_benchmark import benchmark_quantized_search
+
+    with get_connection() as conn:
+        try:
+            report = benchmark_quantized_search(
+                conn, query_count=args.queries, top_k=args.top_k, candidates=args.candidates
+            )
+        except Exception as e:
+            print(f"✗ {e} (colonne embedding_bit absente ? ENABLE_BINARY_QUANTIZATION=true puis ingestion)")
+            return 1
+
+    print(f"Requêtes: {report['queries']} | top_k: {report['top_k']} | candidats Hamming: {report['candidates']}")
+    for name in ("exact", "ann", "quantized"):
+        latency = report["latency_ms"][name]
+        recall = report["recall"].get(name, 1.0)
+        print(
+            f"  {name:<10} rappel@{report['top_k']}: {recall:.4f} | "
+            f"p50 {latency['p50']} ms | p95 {latency['p95']} ms"
+        )
+    return 0
+
+
+def cmd_bench_vector_io(args) -> int:
+    """Coût CPU du transport des vecteurs : texte vs binaire (API, requêtes, COPY)"""
+    from tools.search_benchmark import benchmark_vector_io
+
+    with get_connection() as conn:
+        report = benchmark_vector_io(conn, samples=args.samples)
+
+    print(f"Vecteurs: {report['samples']} x {report['dimensions']} dimensions (µs par vecteur)")
+    for name, label in (("api", "réponse API"), ("query", "par requête"), ("copy", "par chunk (COPY)")):
+        text, binary = report[name]["text"], report[name]["binary"]
+        print(
+            f"  {label:<18} texte: CPU {text['cpu_us']} µs / {text['wall_us']} µs | "
+            f"binaire: CPU {binary['cpu_us']} µs / {binary['wall_us']} µs"
+        )
+    return 0
+
+
+def cmd_shard_status(args) -> int:
+    """Vérifie chaque shard de SHARD_DSNS : connexion, version pgvector, chunks par collection"""
+    from database.schema import EMBEDDING_TABLE
+    from database.shards import SHARD_DSNS, SHARD_KEY, shard_connection
+
+    if not SHARD_DSNS:
+        print("SHARD_DSNS vide : déploiement non shardé")
+        return 0
+
+    print(f"{len(SHARD_DSNS)} shards | placement par {SHARD_KEY}")
+    failures = 0
+    for shard in range(len(SHARD_DSNS)):
+        try:
+            with shard_connection(shard) as conn:
+                version = conn.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'").fetchone()
+                table = conn.execute("SELECT to_regclass(%s)", (EMBEDDING_TABLE,)).fetchone()[0]
+                counts = conn.execute(
+                    f"SELECT collection_id, COUNT(*) FROM {EMBEDDING_TABLE} GROUP BY collection_id ORDER BY 1"
+                ).fetchall() if table else []
+        except Exception as e:
+            print(f"  ✗ shard-{shard}: {e}")
+            failures += 1
+            continue
+        summary = ", ".join(f"{collection}={count}" for collection, count in counts) or "vide"
+        print(f"  ✓ shard-{shard}: pgvector {version[0] if version else 'absent'} | {summary}")
+    return 1 if failures else 0
+
+
+def cmd_calibrate_thresholds(args) -> int:
+    """Recalcule les seuils de similarité par collection à partir de similarity_log"""
+    from tools.similarity_threshold import calibrate_thresholds
+
+    try:
+        report = calibrate_thresholds(percentile=args.percentile, min_samples=args.min_samples, days=args.days)
+    except Exception as e:
+        print(f"✗ {e} (tables similarity_log / similarity_thresholds absentes ? voir supabase_script.sql)")
+        return 1
+
+    if not report:
+        print("Aucune similarité journalisée (ENABLE_SIMILARITY_LOG=true puis trafic réel)")
+        return 0
+    for entry in report:
+        status = "✓" if entry["calibrated"] else "…"
+        print(
+            f"  {status} {entry['collection_id']}: seuil {entry['threshold']} "
+            f"({entry['relevant']} pertinents / {entry['total']} journalisés)"
+        )
+    return 0
+
+
+def cmd_rerank_report(args) -> int:
+    """Synthèse par collection du gain du reranking face à sa latence (rerank_eval_log)"""
+    from tools.rerank_eval import rerank_report
+
+    try:
+        report = rerank_report(days=args.days)
+    except Exception as e:
+        print(f"✗ {e} (table rerank_eval_log absente ? voir supabase_script.sql)")
+        return 1
+
+    if not report:
+        print("Aucune évaluation journalisée (RERANK_EVAL_SAMPLE_RATE > 0 puis trafic réel)")
+        return 0
+    for entry in report:
+        per_changed = f"{entry['ms_per_changed']} ms" if entry["ms_per_changed"] is not None else "aucun changement"
+        print(
+            f"  {entry['collection_id'] or '(sans collection)'}: {entry['searches']} recherches | "
+            f"LLM {entry['llm_rate']:.0%} | Spearman {entry['spearman']} | "
+            f"recouvrement top-k {entry['top_k_overlap']:.0%} | "
+            f"latence p50 {entry['latency_p50_ms']} ms, p95 {entry['latency_p95_ms']} ms | "
+            f"par document remplacé: {per_changed}"
+        )
+    return 0
+
+
+def cmd_partition_table(args) -> int:
+    """Migre langchain_pg_embedding vers une table partitionnée par collection_id"""
+    from database.schema import partition_embedding_table
+
+    try:
+        copied = partition_embedding_table()
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        return 1
+
+    for collection, count in copied.items():
+        print(f"  ✓ {collection}: {count} chunks")
+    return 0
+
+
+def cmd_drop_collection(args) -> int:
+    """Supprime une collection (DETACH + DROP de sa partition si la table est partitionnée)"""
+    from database.schema import drop_collection
+
+    method = drop_collection(args.name)
+    print(f"✓ Collection {args.name} supprimée ({'partition' if method == 'partition' else 'DELETE'})")
+    return 0
+
+
+def cmd_export_snapshot(args) -> int:
+    """Exporte la base vectorielle dans un instantané NPZ (curseur serveur, mémoire constante)"""
+    from tools.snapshot import export_snapshot
+
+    try:
+        export_snapshot(args.path, dtype=args.dtype, batch_size=args.batch_size)
+    except (RuntimeError, ValueError) as e:
+        print(f"✗ {e}")
+        return 1
+    return 0
+
+
+def cmd_import_snapshot(args) -> int:
+    """Charge un instantané dans une base vide (COPY, puis création des index)"""
+    from tools.snapshot import import_snapshot
+
+    try:
+        import_snapshot(args.path, batch_size=args.batch_size)
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        return 1
+    return 0
+
+
+def cmd_backfill_short_embeddings(args) -> int:
+    """Remplit embedding_short (préfixe Matryoshka) des lignes existantes et crée son index"""
+    from database.schema import backfill_short_embeddings
+
+    backfill_short_embeddings(batch_size=args.batch_size)
+    return 0
+
+
+def cmd_migrate_schema(args) -> int:
+    """Colonnes dérivées et index secondaires d'une table peuplée, sans bloquer les écritures"""
+    from database.schema import migrate_schema
+
+    try:
+        migrate_schema(batch_size=args.batch_size)
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        return 1
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Commandes de maintenance Dagan")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check_index = subparsers.add_parser("check-index", help="Vérifier l'utilisation de l'index ANN (EXPLAIN)")
+    check_index.add_argument(
+        "--dimensions", type=int, default=EMBEDDING_DIMENSIONS, help="Dimensions des embeddings (défaut: EMBEDDING_DIMENSIONS)"
+    )
+    check_index.set_defaults(func=cmd_check_index)
+
+    migrate_index = subparsers.add_parser("migrate-index", help="Reconstruire l'index vectoriel sans interruption")
+    migrate_index.add_argument("--type", choices=["hnsw", "ivfflat"], help="Type d'index (défaut: VECTOR_INDEX_TYPE)")
+    migrate_index.add_argument("--storage", choices=["vector", "halfvec"], help="Stockage indexé (défaut: VECTOR_STORAGE)")
+    migrate_index.add_argument(
+        "--keep-previous", action="store_true",
+        help="Conserver l'ancien index (changement de VECTOR_STORAGE avant redéploiement)"
+    )
+    migrate_index.set_defaults(func=cmd_migrate_index)
+
+    drop_previous = subparsers.add_parser("drop-previous-index", help="Supprimer l'index conservé par --keep-previous")
+    drop_previous.set_defaults(func=cmd_drop_previous_index)
+
+    build_mmap = subparsers.add_parser("build-mmap-index", help="Construire l'index vectoriel local (memmap)")
+    build_mmap.add_argument("--dtype", choices=["float16", "float32"], default="float16", help="Précision stockée")
+    build_mmap.set_defaults(func=cmd_build_mmap_index)
+
+    sync_mmap = subparsers.add_parser("sync-mmap-index", help="Synchroniser l'index local avec pgvector (incrémental)")
+    sync_mmap.set_defaults(func=cmd_sync_mmap_index)
+
+    bench_quantized = subparsers.add_parser("bench-quantized", help="Banc d'essai de la recherche quantifiée binaire")
+    bench_quantized.add_argument("--queries", type=int, default=50, help="Nombre de requêtes")
+    bench_quantized.add_argument("--top-k", type=int, default=20, help="Résultats par requête")
+    bench_quantized.add_argument("--candidates", type=int, default=200, help="Candidats de la passe Hamming")
+    bench_quantized.set_defaults(func=cmd_bench_quantized)
+
+    backfill_short = subparsers.add_parser(
+        "backfill-short-embeddings", help="Remplir embedding_short pour la recherche en deux étapes"
+    )
+    backfill_short.add_argument("--batch-size", type=int, default=1000, help="Lignes mises à jour par lot")
+    backfill_short.set_defaults(func=cmd_backfill_short_embeddings)
+
+    migrate_schema = subparsers.add_parser(
+        "migrate-schema", help="Ajouter colonnes dérivées et index secondaires sans bloquer les écritures"
+    )
+    migrate_schema.add_argument("--batch-size", type=int, default=1000, help="Lignes remplies par lot")
+    migrate_schema.set_defaults(func=cmd_migrate_schema)
+
+    bench_vector_io = subparsers.add_parser("bench-vector-io", help="Banc d'essai du transport binaire des vecteurs")
+    bench_vector_io.add_argument("--samples", type=int, default=200, help="Nombre de vecteurs")
+    bench_vector_io.set_defaults(func=cmd_bench_vector_io)
+
+    calibrate = subparsers.add_parser("calibrate-thresholds", help="Calibrer les seuils de similarité par collection")
+    calibrate.add_argument("--percentile", type=float, default=10, help="Percentile des similarités pertinentes")
+    calibrate.add_argument("--min-samples", type=int, default=50, help="Chunks pertinents requis par collection")
+    calibrate.add_argument("--days", type=int, default=30, help="Fenêtre du journal (jours)")
+    calibrate.set_defaults(func=cmd_calibrate_thresholds)
+
+    rerank_report = subparsers.add_parser("rerank-report", help="Gain du reranking face à sa latence, par collection")
+    rerank_report.add_argument("--days", type=int, default=30, help="Fenêtre du journal (jours)")
+    rerank_report.set_defaults(func=cmd_rerank_report)
+
+    shard_status = subparsers.add_parser("shard-status", help="État des shards (SHARD_DSNS)")
+    shard_status.set_defaults(func=cmd_shard_status)
+
+    partition_table = subparsers.add_parser(
+        "partition-table", help="Partitionner langchain_pg_embedding par collection"
+    )
+    partition_table.set_defaults(func=cmd_partition_table)
+
+    drop_collection = subparsers.add_parser("drop-collection", help="Supprimer une collection et ses chunks")
+    drop_collection.add_argument("name", help="collection_id à supprimer")
+    drop_collection.set_defaults(func=cmd_drop_collection)
+
+    export_snapshot = subparsers.add_parser("export-snapshot", help="Exporter la base vectorielle (instantané NPZ)")
+    export_snapshot.add_argument("path", help="Fichier .npz écrit")
+    export_snapshot.add_argument("--dtype", choices=["float16", "float32"], default="float16", help="Précision des vecteurs")
+    export_snapshot.add_argument("--batch-size", type=int, default=2000, help="Lignes par lot du curseur serveur")
+    export_snapshot.set_defaults(func=cmd_export_snapshot)
+
+    import_snapshot = subparsers.add_parser("import-snapshot", help="Charger un instantané dans une base vide")
+    import_snapshot.add_argument("path", help="Fichier .npz produit par export-snapshot")
+    import_snapshot.add_argument("--batch-size", type=int, default=2000, help="Lignes par bloc COPY")
+    import_snapshot.set_defaults(func=cmd_import_snapshot)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
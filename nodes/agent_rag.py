@@ -151,6 +151,7 @@ Exemples de reformulation :
 
 **WORKFLOW OBLIGATOIRE :**
 1. TOUJOURS commencer par vector_search_tool avec mots-clés optimisés (2-4 mots MAX + Togo/site:.gouv.tg)
+   - Filtres optionnels si la question l'exige : officiel:oui (documents officiels), source:file_upload (fichiers déposés), collection:NOM
 2. ⚠️ VÉRIFIER LA PERTINENCE des résultats vector_search :
    - Si les résultats semblent hors-sujet ou génériques (pas spécifiques à la question)
    - Ou si la similarité est faible (< 70%)
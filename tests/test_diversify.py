@@ -0,0 +1,52 @@
+"""Diversification des candidats : déduplication textuelle et sélection MMR"""
+
+import numpy as np
+
+from tools.diversify import dedupe_by_text, diversify, mmr_select
+
+
+def unit(*values: float) -> np.ndarray:
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_dedupe_keeps_best_ranked_of_near_duplicates():
+    text = "La demande de passeport se fait en ligne sur le portail officiel avec une photo"
+    rows = [
+        {"id": "a", "document": text},
+        {"id": "b", "document": text + " récente"},
+        {"id": "c", "document": "Le casier judiciaire est délivré par le tribunal de Lomé"},
+        {"id": "d", "document": ""},
+        {"id": "e", "document": None},
+    ]
+
+    kept = dedupe_by_text(rows, threshold=0.8)
+
+    # Textes vides jamais considérés comme doublons
+    assert [row["id"] for row in kept] == ["a", "c", "d", "e"]
+    assert [row["id"] for row in dedupe_by_text(rows, threshold=1.01)] == ["a", "b", "c", "d", "e"]
+
+
+def test_mmr_skips_redundant_candidate():
+    vectors = np.stack([unit(1, 0), unit(1, 0.01), unit(0, 1)])
+    similarities = np.array([0.9, 0.89, 0.8], dtype=np.float32)
+
+    assert mmr_select(similarities, vectors, top_k=2, lambda_=0.5) == [0, 2]
+    # λ = 1 : pertinence seule
+    assert mmr_select(similarities, vectors, top_k=2, lambda_=1.0) == [0, 1]
+
+
+def test_mmr_top_k_larger_than_candidates():
+    vectors = np.stack([unit(1, 0), unit(0, 1)])
+    assert sorted(mmr_select(np.array([0.5, 0.6]), vectors, top_k=5)) == [0, 1]
+
+
+def test_diversify_uses_mmap_short_vectors_without_database():
+    rows = [
+        {"id": "a", "cosine_similarity": 0.9, "short_vector": unit(1, 0)},
+        {"id": "b", "cosine_similarity": 0.89, "short_vector": unit(1, 0.01)},
+        {"id": "c", "cosine_similarity": 0.8, "short_vector": unit(0, 1)},
+    ]
+
+    assert [row["id"] for row in diversify(rows, top_k=2, lambda_=0.5)] == ["a", "c"]
+    assert diversify(rows[:2], top_k=2) == rows[:2]
@@ -0,0 +1,67 @@
+"""Cache des embeddings de requêtes : normalisation des clés, LRU borné en octets, niveau SQLite"""
+
+import numpy as np
+
+from tools.embedding_cache import EmbeddingCache, SQLiteEmbeddingStore, cache_key, normalize_query
+
+MODEL = "text-embedding-3-large"
+DIMENSIONS = 4
+
+
+def vector(value: float) -> np.ndarray:
+    return np.full(DIMENSIONS, value, dtype=np.float32)  # 16 octets
+
+
+def test_normalize_query_merges_trivial_variants():
+    assert normalize_query('  « Passeport   TOGO » ?') == "passeport togo"
+    assert cache_key("Passeport Togo", MODEL, DIMENSIONS) == cache_key("passeport togo.", MODEL, DIMENSIONS)
+    assert cache_key("passeport togo", MODEL, DIMENSIONS) != cache_key("passeport togo", MODEL, 8)
+
+
+def test_lru_evicts_oldest_entries_beyond_max_bytes():
+    cache = EmbeddingCache(max_bytes=2 * vector(0).nbytes)
+    cache.put("a", MODEL, DIMENSIONS, vector(1))
+    cache.put("b", MODEL, DIMENSIONS, vector(2))
+    assert cache.get("a", MODEL, DIMENSIONS) is not None  # "a" devient le plus récent
+
+    cache.put("c", MODEL, DIMENSIONS, vector(3))
+
+    assert cache.get("b", MODEL, DIMENSIONS) is None
+    assert cache.get("a", MODEL, DIMENSIONS) is not None
+    assert cache.get("c", MODEL, DIMENSIONS) is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 2 * vector(0).nbytes <= stats["max_bytes"]
+    assert stats["evictions"] == 1
+
+
+def test_replacing_an_entry_does_not_count_its_bytes_twice():
+    cache = EmbeddingCache(max_bytes=2 * vector(0).nbytes)
+    cache.put("a", MODEL, DIMENSIONS, vector(1))
+    cache.put("a", MODEL, DIMENSIONS, vector(2))
+    cache.put("b", MODEL, DIMENSIONS, vector(3))
+
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 2 * vector(0).nbytes, 0)
+    np.testing.assert_array_equal(cache.get("a", MODEL, DIMENSIONS), vector(2))
+
+
+def test_entry_larger_than_max_bytes_is_still_kept_alone():
+    cache = EmbeddingCache(max_bytes=1)
+    cache.put("a", MODEL, DIMENSIONS, vector(1))
+    cache.put("b", MODEL, DIMENSIONS, vector(2))
+
+    assert cache.stats()["entries"] == 1
+    assert cache.get("b", MODEL, DIMENSIONS) is not None
+
+
+def test_sqlite_store_fills_memory_level(tmp_path):
+    store = SQLiteEmbeddingStore(str(tmp_path / "embeddings.sqlite"))
+    EmbeddingCache(store=store).put("passeport togo", MODEL, DIMENSIONS, vector(0.5))
+
+    cache = EmbeddingCache(store=store)
+    np.testing.assert_array_equal(cache.get("Passeport Togo", MODEL, DIMENSIONS), vector(0.5))
+    assert cache.get("passeport togo", MODEL, DIMENSIONS) is not None
+
+    stats = cache.stats()
+    assert (stats["persistent_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 0)
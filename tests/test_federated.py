@@ -0,0 +1,99 @@
+"""Recherche fédérée : fusion par score normalisé et délais de scatter"""
+
+import threading
+import time
+
+import pytest
+
+from tools import federated
+from tools.federated import normalize_and_merge, scatter
+
+
+def row(id_: str, similarity: float, rrf: float = None) -> dict:
+    return {"id": id_, "cosine_similarity": similarity, "rrf_score": rrf}
+
+
+def sleeper(seconds: float, rows=None):
+    def run():
+        time.sleep(seconds)
+        return rows if rows is not None else [row(f"{seconds}", 0.5)]
+    return run
+
+
+def test_normalize_and_merge_min_max_per_list():
+    results = {
+        "crawled_documents": [row("a", 0.9), row("b", 0.8), row("c", 0.7)],
+        "file_uploads": [row("d", 0.6), row("e", 0.4)],
+    }
+
+    merged = normalize_and_merge(results)
+
+    assert [(r["id"], r["normalized_score"]) for r in merged] == [
+        ("a", 1.0), ("d", 1.0), ("b", 0.5), ("c", 0.0), ("e", 0.0)
+    ]
+    # Similarité brute conservée (seuil de vector_search_tool inchangé)
+    assert merged[1]["cosine_similarity"] == 0.6
+
+
+def test_normalize_and_merge_prefers_rrf_and_dedupes():
+    results = {
+        "a": [row("x", 0.2, rrf=0.03), row("y", 0.9, rrf=0.01)],
+        "b": [row("x", 0.2, rrf=0.05)],  # Liste d'une ligne : score normalisé 1
+        "c": [],
+    }
+
+    merged = normalize_and_merge(results, top_k=2)
+
+    assert [(r["id"], r["normalized_score"]) for r in merged] == [("x", 1.0), ("y", 0.0)]
+
+
+def test_scatter_reports_ok_error_and_timeout():
+    def fail():
+        raise RuntimeError("connexion refusée")
+
+    results, report = scatter({"fast": sleeper(0.01), "slow": sleeper(1.0), "broken": fail}, timeout=0.2)
+
+    assert set(results) == {"fast"}
+    assert report["fast"]["status"] == "ok" and report["fast"]["rows"] == 1
+    assert report["broken"] == {**report["broken"], "status": "error", "error": "connexion refusée"}
+    assert report["slow"]["status"] == "timeout"
+    assert report["slow"]["latency_ms"] == pytest.approx(200, abs=100)
+
+
+def test_scatter_timeout_starts_when_task_starts():
+    # Un worker : la seconde tâche attend la première (0.15 s) puis dispose de son propre délai
+    started = time.perf_counter()
+    results, report = scatter({"first": sleeper(0.15), "second": sleeper(0.15)}, timeout=0.25, max_workers=1)
+
+    assert set(results) == {"first", "second"}
+    assert time.perf_counter() - started >= 0.3
+
+
+def test_scatter_gives_up_unstarted_tasks_after_all_waves():
+    started = time.perf_counter()
+    results, report = scatter({"first": sleeper(1.0), "second": sleeper(0.01)}, timeout=0.1, max_workers=1)
+
+    assert results == {}
+    assert report["first"]["status"] == report["second"]["status"] == "timeout"
+    # Deux vagues au plus : timeout × ceil(tâches / workers)
+    assert time.perf_counter() - started < 0.5
+
+
+def test_scatter_waits_for_in_flight_slot_outside_task_timeout(monkeypatch):
+    monkeypatch.setattr(federated, "_in_flight", threading.BoundedSemaphore(1))
+
+    results, report = scatter({"a": sleeper(0.15), "b": sleeper(0.15)}, timeout=0.25, max_workers=1)
+    assert set(results) == {"a", "b"}
+
+    # Place occupée jusqu'à la dernière échéance : tâche abandonnée, signalée hors délai
+    federated._in_flight.acquire()
+    try:
+        results, report = scatter({"a": sleeper(0.01)}, timeout=0.1)
+    finally:
+        federated._in_flight.release()
+    assert results == {}
+    assert report["a"]["status"] == "timeout"
+
+
+def test_scatter_without_tasks():
+    assert scatter({}, timeout=1) == ({}, {})
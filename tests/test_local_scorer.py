@@ -0,0 +1,53 @@
+"""Score local du reranking en cascade : BM25, score 0-10 et détection d'ambiguïté"""
+
+import numpy as np
+
+from tools.local_scorer import bm25_scores, is_ambiguous, local_scores, tokenize
+
+
+def test_tokenize_folds_accents_and_drops_stopwords():
+    assert tokenize("Délivrance du passeport à Lomé : coût ?") == ["delivrance", "passeport", "lome", "cout"]
+
+
+def test_bm25_ranks_matching_texts_and_favors_rare_terms():
+    texts = [
+        "Le passeport biométrique est délivré par la DGDN",
+        "La carte d'identité est délivrée à Lomé",
+        "Le coût du passeport ordinaire est de 25 000 F CFA",
+        "Horaires d'ouverture des services",
+    ]
+
+    scores = bm25_scores("coût du passeport", texts)
+
+    assert scores[3] == 0 and scores[1] == 0
+    # "cout" n'apparaît qu'une fois : IDF plus élevé que "passeport"
+    assert scores[2] > scores[0] > 0
+
+
+def test_bm25_without_query_terms():
+    assert bm25_scores("de la", ["texte"]).tolist() == [0.0]
+    assert bm25_scores("passeport", []).shape == (0,)
+
+
+def test_local_scores_documents_on_ten_point_scale():
+    documents = [
+        {"content": "Coût du passeport : 25 000 F CFA", "similarity_score": 0.82,
+         "metadata": {"is_official": True, "chunk_index": 0, "chunk_count": 4}},
+        {"content": "Horaires des services", "similarity_score": 0.70,
+         "metadata": {"chunk_index": 3, "chunk_count": 4}},
+    ]
+
+    scores = local_scores("coût du passeport", documents)
+
+    assert scores[0] == 10.0
+    assert 0 <= scores[1] < scores[0]
+    assert local_scores("coût", [], "web").shape == (0,)
+
+
+def test_is_ambiguous_compares_boundary_gap_to_margin():
+    scores = np.array([9.0, 8.0, 7.5, 3.0])
+
+    assert is_ambiguous(scores, top_k=2, margin=1.0) == (True, 0.5)
+    assert is_ambiguous(scores, top_k=3, margin=1.0) == (False, 4.5)
+    # Pas plus de candidats que top_k : rien à départager
+    assert is_ambiguous(scores, top_k=4, margin=1.0) == (False, float("inf"))
@@ -0,0 +1,62 @@
+"""Extraction de passages : segmentation, budget de tokens et positions dans le texte source"""
+
+from tools import passages
+from tools.passages import PASSAGE_SEPARATOR, extract_passages, passage_text, segment
+
+TEXT = (
+    "Le service public du Togo accueille les usagers du lundi au vendredi. "
+    "Les bureaux ferment à 17 heures.\n"
+    "- Pièces à fournir : acte de naissance, certificat de nationalité.\n"
+    "Le coût du passeport ordinaire est de 25 000 F CFA, payable en ligne. "
+    "Le délai de délivrance est de deux semaines."
+)
+
+
+def test_segment_spans_trim_whitespace_and_cut_long_sentences(monkeypatch):
+    spans = segment(TEXT)
+
+    assert [TEXT[start:end] for start, end in spans][:3] == [
+        "Le service public du Togo accueille les usagers du lundi au vendredi.",
+        "Les bureaux ferment à 17 heures.",
+        "- Pièces à fournir : acte de naissance, certificat de nationalité.",
+    ]
+    assert all(not TEXT[start].isspace() and not TEXT[end - 1].isspace() for start, end in spans)
+
+    monkeypatch.setattr(passages, "MAX_SENTENCE_CHARS", 20)
+    long_spans = segment("mot " * 30)
+    assert all(end - start <= 20 for start, end in long_spans)
+
+
+def test_short_text_is_returned_whole():
+    assert extract_passages("passeport", "Texte court.", max_tokens=100) == ("Texte court.", [{"start": 0, "end": 12}])
+
+
+def test_offsets_point_to_passages_in_source_text():
+    text, offsets = extract_passages("coût du passeport", TEXT, max_tokens=25)
+
+    assert text == PASSAGE_SEPARATOR.join(TEXT[o["start"]:o["end"]] for o in offsets)
+    assert "25 000 F CFA" in text
+    assert "lundi au vendredi" not in text
+    assert [o["start"] for o in offsets] == sorted(o["start"] for o in offsets)
+
+
+def test_adjacent_sentences_merge_into_one_passage():
+    _, offsets = extract_passages("coût délai délivrance passeport", TEXT, max_tokens=35)
+
+    assert len(offsets) == 1
+    assert TEXT[offsets[0]["start"]:offsets[0]["end"]] == (
+        "Le coût du passeport ordinaire est de 25 000 F CFA, payable en ligne. "
+        "Le délai de délivrance est de deux semaines."
+    )
+
+
+def test_sentence_longer_than_budget_is_truncated():
+    source = "Passeport " * 40
+    text, offsets = extract_passages("passeport", source, max_tokens=5)
+    assert offsets == [{"start": 0, "end": 20}]
+    assert text == source[:20]
+
+
+def test_passage_text_falls_back_to_truncation(monkeypatch):
+    monkeypatch.setattr(passages, "ENABLE_PASSAGE_EXTRACTION", False)
+    assert passage_text("coût", TEXT, max_tokens=10, fallback_chars=30) == TEXT[:30]
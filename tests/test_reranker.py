@@ -0,0 +1,77 @@
+"""Étage LLM du reranking : groupes notés en parallèle et calibration sur l'ancre (LLM simulé)"""
+
+import asyncio
+
+import pytest
+
+from tools import reranker
+from tools.reranker import _llm_scores
+
+# Note "vraie" de chaque candidat ; le LLM simulé ajoute un biais propre à chaque groupe
+TRUE_SCORES = {0: 4.0, 1: 6.0, 2: 5.0, 3: 3.0, 4: 8.0}
+TEXTS = [f"doc-{i}" for i in range(len(TRUE_SCORES))]
+
+
+@pytest.fixture
+def groups(monkeypatch):
+    """Groupes envoyés au LLM simulé (indices de la liste complète)"""
+    sent = []
+
+    async def score_group(client, messages, temperature):
+        indices = [int(text.split("-")[1]) for text in messages]
+        sent.append(indices)
+        bias = 0.0 if len(sent) == 1 else 2.0
+        return {position: TRUE_SCORES[i] + bias for position, i in enumerate(indices)}
+
+    monkeypatch.setattr(reranker, "RERANK_BATCH_SIZE", 2)
+    monkeypatch.setattr(reranker, "_document_messages", lambda question, texts: texts)
+    monkeypatch.setattr(reranker, "_score_group", score_group)
+    monkeypatch.setattr(reranker, "_get_client", lambda: None)
+    monkeypatch.setattr(reranker, "run_coroutine", lambda coroutine, timeout=None: asyncio.run(coroutine))
+    return sent
+
+
+def test_single_group_is_not_calibrated(groups):
+    scores = _llm_scores("documents", "question", TEXTS, [0, 1], local=[1, 2, 0, 0, 0])
+
+    assert groups == [[0, 1]]
+    assert scores == {0: 4.0, 1: 6.0}
+
+
+def test_groups_are_shifted_onto_anchor_reference(groups):
+    scores = _llm_scores("documents", "question", TEXTS, [0, 1, 2, 3], local=[1, 5, 2, 3, 0])
+
+    # Ancre : meilleur score local (1), ajoutée au groupe qui ne la contient pas
+    assert groups == [[0, 1], [2, 3, 1]]
+    # Ancre notée 6 puis 8 : référence 7, groupes décalés de +1 et -1
+    assert scores == {0: 5.0, 1: 7.0, 2: 6.0, 3: 4.0}
+
+
+def test_anchor_is_chosen_among_candidates_to_score(groups):
+    # doc-4 a le meilleur score local mais son score LLM est en cache : pas d'ancre
+    scores = _llm_scores("documents", "question", TEXTS, [0, 1, 2], local=[1, 2, 5, 0, 9])
+
+    assert groups == [[0, 1, 2], [2]]
+    assert all(4 not in group for group in groups)
+    assert set(scores) == {0, 1, 2}
+    assert scores[2] == 6.0
+
+
+def test_calibrated_scores_are_clamped(groups, monkeypatch):
+    monkeypatch.setitem(TRUE_SCORES, 3, 9.5)
+    scores = _llm_scores("documents", "question", TEXTS, [0, 3, 4], local=[0, 0, 0, 1, 9])
+
+    assert groups == [[0, 3, 4], [4]]
+    assert max(scores.values()) <= 10.0
+
+
+def test_failed_group_returns_no_partial_scores(groups, monkeypatch):
+    async def score_group(client, messages, temperature):
+        if messages == ["doc-2"]:
+            raise RuntimeError("réponse JSON invalide")
+        return {0: 5.0}
+
+    monkeypatch.setattr(reranker, "_score_group", score_group)
+
+    with pytest.raises(RuntimeError, match="JSON"):
+        _llm_scores("documents", "question", TEXTS, [0, 1, 2], local=[0, 0, 1, 0, 0])
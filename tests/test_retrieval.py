@@ -0,0 +1,134 @@
+"""Requêtes de recherche (SQL généré, sans base) : filtres, recherche ANN, fusion RRF du mode hybride"""
+
+import re
+
+import numpy as np
+
+from database.schema import EMBEDDING_TABLE, distance_expression
+from tools import retrieval
+from tools.retrieval import SearchFilters, build_hybrid_query, build_search_query, hybrid_search_chunks
+
+
+class RecordingCursor:
+    """Curseur factice : garde les requêtes et paramètres exécutés"""
+
+    def __init__(self, rows=None):
+        self.executed = []
+        self.rows = rows or []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+    def fetchall(self):
+        return self.rows
+
+
+def compact(sql: str) -> str:
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def test_empty_filters_add_no_clause():
+    assert SearchFilters().is_empty()
+    assert SearchFilters().where_clause() == ("", {})
+
+
+def test_filters_build_parameterized_where_clause():
+    filters = SearchFilters(
+        collections=("crawled_documents", "file_uploads"),
+        metadata={"is_official": True},
+        url_prefix="https://service-public.gouv.tg/",
+    )
+    where, params = filters.where_clause()
+
+    assert where == (
+        "WHERE collection_id = ANY(%(f_collections)s)"
+        " AND cmetadata @> %(f_metadata)s::jsonb"
+        " AND cmetadata->>'url' LIKE %(f_url_prefix)s"
+    )
+    assert params == {
+        "f_collections": ["crawled_documents", "file_uploads"],
+        "f_metadata": '{"is_official": true}',
+        "f_url_prefix": "https://service-public.gouv.tg/%",
+    }
+
+
+def test_url_prefix_escapes_like_wildcards():
+    _, params = SearchFilters(url_prefix="https://a.tg/100%_vrai\\").where_clause()
+    assert params["f_url_prefix"] == "https://a.tg/100\\%\\_vrai\\\\%"
+
+
+def test_merge_and_cache_variant():
+    base = SearchFilters(collections=("crawled_documents",), metadata={"source": "web"}, url_prefix="https://a.tg/")
+    merged = base.merge(SearchFilters(metadata={"is_official": True}))
+
+    assert merged.collections == ("crawled_documents",)
+    assert merged.metadata == {"source": "web", "is_official": True}
+    assert merged.url_prefix == "https://a.tg/"
+    assert base.merge(SearchFilters(collections=("file_uploads",))).collections == ("file_uploads",)
+    # Les collections ne font pas partie de la variante (portée gérée à part par le cache)
+    assert merged.cache_variant() == SearchFilters(metadata=merged.metadata, url_prefix=merged.url_prefix).cache_variant()
+
+
+def test_search_query_orders_by_index_distance():
+    distance = distance_expression("%(query)b")
+    sql = compact(build_search_query(("id", "document")))
+
+    assert f"1 - ({distance}) AS cosine_similarity" in sql
+    assert sql.endswith(f"FROM {EMBEDDING_TABLE} ORDER BY {distance} LIMIT %(limit)s")
+    assert "1 - distance" not in sql.split("ORDER BY", 1)[1]
+
+
+def test_filtered_search_query_limits_before_final_sort():
+    where, _ = SearchFilters(metadata={"is_official": True}).where_clause()
+    sql = compact(build_search_query(("id", "octet_length(document) AS payload_bytes"), where=where))
+
+    assert sql.startswith("WITH nearest AS MATERIALIZED (")
+    assert f"{where} ORDER BY {distance_expression('%(query)b')} LIMIT %(limit)s )" in sql
+    # Expression projetée relue par son alias hors de la CTE
+    assert "SELECT id, payload_bytes, 1 - distance AS cosine_similarity FROM nearest ORDER BY distance" in sql
+
+
+def test_hybrid_query_fuses_dense_and_lexical_ranks():
+    sql = compact(build_hybrid_query())
+
+    # Branche dense triée sur l'expression de distance de l'index (ANN utilisable)
+    assert f"ORDER BY {distance_expression('%(query)b')} LIMIT %(candidates)s" in sql
+    assert "ROW_NUMBER() OVER (ORDER BY lexical_score DESC) AS rank" in sql
+    # Un candidat absent d'une liste compte 0 pour celle-ci, pas NULL
+    assert "FULL OUTER JOIN lexical l ON l.id = d.id" in sql
+    assert (
+        "COALESCE(%(dense_weight)s / (%(rrf_k)s + d.rank), 0) "
+        "+ COALESCE(%(lexical_weight)s / (%(rrf_k)s + l.rank), 0) AS rrf_score"
+    ) in sql
+    assert sql.endswith("ORDER BY f.rrf_score DESC LIMIT %(limit)s")
+
+
+def test_hybrid_query_applies_filters_to_both_branches():
+    where, _ = SearchFilters(collections=("file_uploads",)).where_clause()
+    sql = compact(build_hybrid_query(where=where))
+
+    assert f"FROM {EMBEDDING_TABLE} WHERE collection_id = ANY(%(f_collections)s) ORDER BY" in sql
+    assert "WHERE document_tsv @@ q.query AND collection_id = ANY(%(f_collections)s)" in sql
+
+
+def test_hybrid_search_parameters(monkeypatch):
+    monkeypatch.setattr(retrieval, "VECTOR_ITERATIVE_SCAN", "relaxed_order")
+    monkeypatch.setattr(retrieval, "VECTOR_SEARCH_PROBES", None)
+    monkeypatch.setattr(retrieval, "VECTOR_SEARCH_EF_SEARCH", None)
+    cursor = RecordingCursor(rows=[{"id": "a"}])
+    query = np.zeros(4, dtype=np.float32)
+
+    rows = hybrid_search_chunks(
+        cursor, query, "formulaire ANID site:service-public.gouv.tg", top_k=5,
+        dense_weight=1.0, lexical_weight=0.5, filters=SearchFilters(url_prefix="https://a.tg/"),
+    )
+
+    assert rows == [{"id": "a"}]
+    settings = [params[0] for _, params in cursor.executed[:-1]]
+    assert settings == ["relaxed_order", "relaxed_order"]  # Recherche filtrée : parcours itératif
+    _, params = cursor.executed[-1]
+    assert params["text"] == "formulaire ANID"
+    assert params["candidates"] == 10
+    assert params["limit"] == 5
+    assert (params["dense_weight"], params["lexical_weight"], params["rrf_k"]) == (1.0, 0.5, retrieval.RRF_K)
+    assert params["f_url_prefix"] == "https://a.tg/%"
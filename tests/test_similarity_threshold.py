@@ -0,0 +1,96 @@
+"""Seuil adaptatif : stratégies d'élagage, sauvetage et comparaison au seuil fixe"""
+
+import numpy as np
+import pytest
+
+from tools import similarity_threshold
+from tools.similarity_threshold import prune_candidates
+
+
+@pytest.fixture(autouse=True)
+def default_thresholds(monkeypatch):
+    monkeypatch.setattr(similarity_threshold, "SIMILARITY_THRESHOLD", 0.70)
+    monkeypatch.setattr(similarity_threshold, "THRESHOLD_FLOOR", 0.55)
+    monkeypatch.setattr(similarity_threshold, "THRESHOLD_CEILING", 0.85)
+    monkeypatch.setattr(similarity_threshold, "THRESHOLD_MIN_GAP", 0.04)
+
+
+def rows(*similarities, collection="crawled_documents"):
+    return [
+        {"id": f"{collection}-{i}", "cosine_similarity": value, "collection_id": collection}
+        for i, value in enumerate(similarities)
+    ]
+
+
+def similarities(kept):
+    return [row["cosine_similarity"] for row in kept]
+
+
+CANDIDATES = (0.90, 0.75, 0.74, 0.73, 0.60)
+
+
+def test_fixed_strategy():
+    kept, report = prune_candidates(rows(*CANDIDATES), strategy="fixed")
+    assert similarities(kept) == [0.90, 0.75, 0.74, 0.73]
+    assert report["kept"] == report["baseline_kept"] == 4
+    assert report["rerank_calls_avoided"] == report["web_fallbacks_avoided"] == 0
+
+
+def test_gap_strategy_cuts_at_largest_gap_and_clamps():
+    kept, report = prune_candidates(rows(*CANDIDATES), strategy="gap", rerank_above=3)
+
+    # Plus grande cassure après 0.90, seuil borné au plafond
+    assert report["threshold"] == 0.85
+    assert similarities(kept) == [0.90]
+    assert report["rerank_calls_avoided"] == 1
+
+
+def test_gap_strategy_without_clear_gap_falls_back_to_fixed():
+    _, report = prune_candidates(rows(0.80, 0.78, 0.76, 0.74), strategy="gap")
+    assert report["threshold"] == 0.70
+
+
+def test_zscore_strategy():
+    values = np.array(CANDIDATES)
+    expected = min(max(values.mean() + 0.5 * values.std(), 0.55), 0.85)
+
+    kept, report = prune_candidates(rows(*CANDIDATES), strategy="zscore")
+
+    assert report["threshold"] == round(expected, 4)
+    assert similarities(kept) == [value for value in CANDIDATES if value >= expected]
+
+
+def test_rescue_keeps_best_chunks_instead_of_web_fallback():
+    kept, report = prune_candidates(rows(0.66, 0.64, 0.58), strategy="fixed")
+
+    assert report["rescued"]
+    assert similarities(kept) == [0.66, 0.64]
+    assert report["baseline_kept"] == 0
+    assert report["web_fallbacks_avoided"] == 1
+
+
+def test_nothing_kept_below_floor():
+    kept, report = prune_candidates(rows(0.50, 0.40), strategy="gap")
+    assert kept == [] and not report["rescued"]
+
+
+def test_keep_predicate_overrides_threshold():
+    candidates = rows(0.90, 0.60)
+    candidates[1]["lexical_rank"] = 1
+
+    kept, report = prune_candidates(candidates, strategy="fixed", keep=lambda row: row.get("lexical_rank") == 1)
+
+    assert similarities(kept) == [0.90, 0.60]
+    assert report["baseline_kept"] == 2
+
+
+def test_calibrated_strategy_uses_per_collection_thresholds(monkeypatch):
+    monkeypatch.setattr(similarity_threshold, "get_calibrated_thresholds", lambda: {"file_uploads": 0.60})
+    candidates = rows(0.72, 0.71) + rows(0.62, 0.58, collection="file_uploads")
+
+    kept, report = prune_candidates(candidates, strategy="calibrated")
+
+    # crawled_documents non calibrée : seuil gap (0.71) ; file_uploads : 0.60
+    assert similarities(kept) == [0.72, 0.71, 0.62]
+    assert report["thresholds"] == {"file_uploads": 0.60}
+    assert report["threshold"] == 0.60
@@ -0,0 +1,71 @@
+"""Instantanés NPZ : écriture en flux et relecture par blocs, sans base"""
+
+import json
+import zipfile
+
+import numpy as np
+
+from tools.snapshot import (
+    MANIFEST_ENTRY,
+    _BlobColumn,
+    _BlobReader,
+    _open_entry,
+    _read_rows,
+    _write_entry,
+    read_manifest,
+)
+
+
+def test_blob_column_round_trip_in_blocks(tmp_path):
+    values = ["id-1".encode(), b"", "Délivrance du passeport".encode("utf-8"), b"x" * 5000, "{}".encode()]
+    path = tmp_path / "snapshot.npz"
+
+    with zipfile.ZipFile(path, "w", allowZip64=True) as archive:
+        column = _BlobColumn(str(tmp_path), "documents")
+        column.extend(values[:2])
+        column.extend(values[2:])
+        column.write_to(archive)
+
+    with zipfile.ZipFile(path) as archive:
+        reader = _BlobReader(archive, "documents")
+        blocks = [reader.read(2), reader.read(2), reader.read(2), reader.read(2)]
+        reader.close()
+
+    assert [len(block) for block in blocks] == [2, 2, 1, 0]
+    assert [value for block in blocks for value in block] == values
+
+    # Entrées .npy standard : lisibles par np.load
+    archive = np.load(path)
+    offsets = archive["documents.offsets"]
+    assert offsets.tolist() == [0, *np.cumsum([len(value) for value in values]).tolist()]
+    assert archive["documents.data"].tobytes() == b"".join(values)
+
+
+def test_vectors_entry_written_by_chunks(tmp_path):
+    vectors = np.random.default_rng(0).standard_normal((5, 8)).astype(np.float32)
+    path = tmp_path / "snapshot.npz"
+
+    with zipfile.ZipFile(path, "w", allowZip64=True) as archive:
+        chunks = (vectors[i:i + 2].astype("float16").tobytes() for i in range(0, 5, 2))
+        _write_entry(archive, "vectors", "float16", vectors.shape, chunks, compress=False)
+
+    np.testing.assert_array_equal(np.load(path)["vectors"], vectors.astype(np.float16))
+    with zipfile.ZipFile(path) as archive:
+        f, shape, dtype = _open_entry(archive, "vectors")
+        first = _read_rows(f, dtype, 3, shape[1:])
+        rest = _read_rows(f, dtype, 3, shape[1:])
+        f.close()
+    assert shape == (5, 8) and dtype == np.float16
+    assert first.shape == (3, 8) and rest.shape == (2, 8)
+    np.testing.assert_array_equal(np.concatenate([first, rest]), vectors.astype(np.float16))
+
+
+def test_manifest_round_trip(tmp_path):
+    manifest = {"version": 1, "rows": 3, "collections": ["crawled_documents", "file_uploads"], "model": "é"}
+    encoded = json.dumps(manifest, ensure_ascii=False)
+    path = tmp_path / "snapshot.npz"
+
+    with zipfile.ZipFile(path, "w") as archive:
+        _write_entry(archive, MANIFEST_ENTRY, f"<U{len(encoded)}", (), [encoded.encode("utf-32-le")])
+
+    assert read_manifest(str(path)) == manifest
@@ -0,0 +1,45 @@
+"""
+Boucle asyncio d'arrière-plan partagée
+
+Les tools LangChain sont synchrones (exécutés dans un thread par l'agent ReAct).
+Cette boucle unique, dans un thread démon, permet à tous ces threads de soumettre
+des coroutines à des services asynchrones communs (micro-batching, appels parallèles).
+"""
+
+import asyncio
+import threading
+from typing import Any, Coroutine, Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Retourne la boucle d'arrière-plan (démarrée à la première utilisation)"""
+    global _loop
+
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="dagan-async-runner", daemon=True)
+                thread.start()
+                _loop = loop
+
+    return _loop
+
+
+def run_coroutine(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """
+    Exécute une coroutine sur la boucle d'arrière-plan et attend son résultat
+    depuis un thread synchrone.
+
+    Raises:
+        concurrent.futures.TimeoutError: Si le résultat n'arrive pas dans `timeout` secondes
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+    try:
+        return future.result(timeout)
+    except Exception:
+        future.cancel()
+        raise
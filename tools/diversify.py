@@ -0,0 +1,134 @@
+"""
+Diversification des chunks candidats avant reranking
+
+Avec 800 caractères de recouvrement entre chunks, les CRAG_TOP_K lignes remontées sont
+souvent des quasi-doublons de la même page, tous envoyés au reranker LLM. Deux étapes :
+- MMR (maximal marginal relevance), vectorisé NumPy, sans besoin du texte :
+  score = λ · sim(question, chunk) − (1 − λ) · max sim(chunk, chunks déjà retenus)
+- Déduplication textuelle : Jaccard sur les trigrammes de mots ≥ MMR_DEDUP_THRESHOLD
+
+Les similarités entre chunks utilisent le préfixe Matryoshka normalisé (256 dims,
+embedding_short ou calculé côté serveur) : 1 Ko par candidat au lieu de 8 Ko. Les lignes
+du backend mmap portent déjà ce préfixe (short_vector) : aucune requête dans ce cas.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Set
+
+import numpy as np
+
+from database.shards import group_by_shard, shard_connection
+from database.schema import EMBEDDING_TABLE, SHORT_EMBEDDING_DIMENSIONS
+from tools.retrieval import id_lookup_clause
+
+# Configuration
+ENABLE_MMR = os.getenv("ENABLE_MMR", "true").lower() in ("true", "1", "yes")
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))  # 1 = pertinence seule, 0 = diversité seule
+MMR_TOP_K = int(os.getenv("MMR_TOP_K", "10"))  # Candidats transmis au reranker
+MMR_DEDUP_THRESHOLD = float(os.getenv("MMR_DEDUP_THRESHOLD", "0.8"))
+
+
+def _shingles(text: str, size: int = 3) -> Set[tuple]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def dedupe_by_text(rows: List[Dict], threshold: float = MMR_DEDUP_THRESHOLD) -> List[Dict]:
+    """
+    Supprime les chunks dont le texte recouvre (Jaccard des trigrammes) un chunk mieux classé
+    """
+    kept, kept_shingles = [], []
+    for row in rows:
+        shingles = _shingles(row.get("document") or "")
+        duplicate = any(
+            shingles and other and len(shingles & other) / len(shingles | other) >= threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(row)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def mmr_select(query_similarities: np.ndarray, vectors: np.ndarray, top_k: int, lambda_: float = MMR_LAMBDA) -> List[int]:
+    """
+    Sélection MMR gloutonne.
+
+    Args:
+        query_similarities: (n,) similarité question ↔ candidat
+        vectors: (n, d) vecteurs normalisés des candidats
+        top_k: Nombre de candidats à retenir
+        lambda_: Compromis pertinence / diversité
+
+    Returns:
+        Indices retenus, dans l'ordre de sélection
+    """
+    count = len(query_similarities)
+    top_k = min(top_k, count)
+    pairwise = vectors @ vectors.T
+    redundancy = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    selected = []
+
+    for _ in range(top_k):
+        if selected:
+            scores = lambda_ * query_similarities - (1 - lambda_) * redundancy
+        else:
+            scores = query_similarities.astype(np.float32)
+        scores = np.where(available, scores, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+
+    return selected
+
+
+def fetch_candidate_vectors(rows: Sequence[Dict], shard: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    Préfixes Matryoshka normalisés des candidats, en une requête
+    (embedding_short, ou calculé côté serveur pour les lignes pas encore remplies)
+    """
+    where, params = id_lookup_clause(list(rows))
+    with shard_connection(shard) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT id, COALESCE(
+                embedding_short,
+                l2_normalize(subvector(embedding, 1, {SHORT_EMBEDDING_DIMENSIONS}))
+            ) AS vector
+            FROM {EMBEDDING_TABLE}
+            {where}
+            """,
+            params
+        ).fetchall()
+    return {row[0]: np.asarray(row[1], dtype=np.float32) for row in rows}
+
+
+def diversify(rows: List[Dict], top_k: int = MMR_TOP_K, lambda_: float = MMR_LAMBDA) -> List[Dict]:
+    """
+    MMR sur les lignes candidates (format search_chunks ou ID_COLUMNS : seuls id et
+    cosine_similarity sont nécessaires, le texte peut être chargé après).
+    La déduplication textuelle (dedupe_by_text) se fait une fois le texte disponible.
+
+    Returns:
+        Au plus top_k lignes, dans l'ordre de sélection MMR
+    """
+    if len(rows) <= top_k:
+        return rows
+
+    # Lignes du backend mmap : préfixe déjà en mémoire, pas d'aller-retour PostgreSQL
+    vectors = {row["id"]: row["short_vector"] for row in rows if row.get("short_vector") is not None}
+    missing = [row for row in rows if row["id"] not in vectors]
+    for shard, shard_rows in group_by_shard(missing).items():
+        vectors.update(fetch_candidate_vectors(shard_rows, shard))
+    if len(vectors) != len(rows):
+        # Candidat sans vecteur (supprimé entre-temps) : pas de MMR, simple troncature
+        return rows[:top_k]
+
+    matrix = np.stack([vectors[row["id"]] for row in rows])
+    query_similarities = np.array([row["cosine_similarity"] for row in rows], dtype=np.float32)
+    return [rows[i] for i in mmr_select(query_similarities, matrix, top_k, lambda_)]
@@ -0,0 +1,168 @@
+"""
+Micro-batching des embeddings entre requêtes concurrentes
+
+Sous charge, chaque question déclenche son propre appel `embeddings.create` à une seule
+entrée. Le batcher regroupe les demandes reçues pendant une courte fenêtre (ex: 10 ms)
+ou jusqu'à N entrées, envoie UN appel batché, puis redistribue chaque vecteur à son appelant.
+Moins d'allers-retours API et moins de rate limits aux heures de pointe.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from openai import AsyncOpenAI
+
+from tools.async_runner import get_background_loop, run_coroutine
+from tools.vector_io import acreate_embeddings
+
+# Configuration
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+ENABLE_EMBEDDING_BATCHING = os.getenv("ENABLE_EMBEDDING_BATCHING", "false").lower() in ("true", "1", "yes")
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "10"))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "64"))  # L'API accepte jusqu'à 2048 entrées
+EMBEDDING_BATCH_TIMEOUT = float(os.getenv("EMBEDDING_BATCH_TIMEOUT", "30"))
+METRICS_WINDOW = 1000  # Nombre de mesures conservées pour les percentiles
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    array = np.asarray(values, dtype=np.float64)
+    return {
+        "p50": round(float(np.percentile(array, 50)), 2),
+        "p95": round(float(np.percentile(array, 95)), 2),
+        "max": round(float(array.max()), 2),
+    }
+
+
+class EmbeddingBatcher:
+    """
+    Service asynchrone de regroupement des appels d'embeddings.
+    Toutes les méthodes async s'exécutent sur la boucle d'arrière-plan partagée.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        dimensions: int,
+        window_ms: float = EMBEDDING_BATCH_WINDOW_MS,
+        max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE,
+    ):
+        self.model = model
+        self.dimensions = dimensions
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._client: Optional[AsyncOpenAI] = None
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight = set()  # Garde une référence sur les tâches d'envoi en cours
+
+        # Métriques (fenêtre glissante)
+        self._batch_sizes: Deque[int] = deque(maxlen=METRICS_WINDOW)
+        self._queue_wait_ms: Deque[float] = deque(maxlen=METRICS_WINDOW)
+        self._api_latency_ms: Deque[float] = deque(maxlen=METRICS_WINDOW)
+        self._counters = {"requests": 0, "api_calls": 0, "deduplicated": 0, "errors": 0}
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Ajoute une entrée au batch courant et attend son vecteur"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        self._counters["requests"] += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def embed_sync(self, text: str, timeout: float = EMBEDDING_BATCH_TIMEOUT) -> np.ndarray:
+        """Version synchrone de embed() pour les tools LangChain"""
+        return run_coroutine(self.embed(text), timeout=timeout)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future, float]]) -> None:
+        if self._client is None:
+            self._client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+        # Dédupliquer les textes identiques du même batch
+        unique_texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self._counters["deduplicated"] += len(batch) - len(unique_texts)
+
+        sent_at = time.perf_counter()
+        for _, _, queued_at in batch:
+            self._queue_wait_ms.append((sent_at - queued_at) * 1000)
+
+        try:
+            # base64 : vecteurs décodés par np.frombuffer, sans liste de flottants intermédiaire
+            embeddings = await acreate_embeddings(self._client, unique_texts, self.model, self.dimensions)
+        except Exception as e:
+            self._counters["errors"] += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._api_latency_ms.append((time.perf_counter() - sent_at) * 1000)
+        self._batch_sizes.append(len(unique_texts))
+        self._counters["api_calls"] += 1
+
+        vectors = dict(zip(unique_texts, embeddings))
+
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(vectors[text])
+
+    def stats(self) -> Dict:
+        calls = self._counters["api_calls"]
+        batch_sizes = list(self._batch_sizes)
+        return {
+            **self._counters,
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else 0.0,
+            "api_calls_saved": max(0, self._counters["requests"] - calls - self._counters["errors"]),
+            "queue_wait_ms": _percentiles(list(self._queue_wait_ms)),
+            "api_latency_ms": _percentiles(list(self._api_latency_ms)),
+        }
+
+
+# --- Instance globale (singleton pattern) ---
+_batchers: Dict[Tuple[str, int], EmbeddingBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_embedding_batcher(model: str, dimensions: int) -> Optional[EmbeddingBatcher]:
+    """
+    Retourne le batcher associé à (modèle, dimensions), ou None si ENABLE_EMBEDDING_BATCHING=false
+    """
+    if not ENABLE_EMBEDDING_BATCHING:
+        return None
+
+    key = (model, dimensions)
+    with _batchers_lock:
+        if key not in _batchers:
+            get_background_loop()  # Démarre la boucle partagée
+            _batchers[key] = EmbeddingBatcher(model=model, dimensions=dimensions)
+        return _batchers[key]
+
+
+def batcher_stats() -> Dict[str, Dict]:
+    """Métriques de tous les batchers actifs"""
+    with _batchers_lock:
+        return {f"{model}:{dimensions}": batcher.stats() for (model, dimensions), batcher in _batchers.items()}
@@ -0,0 +1,213 @@
+"""
+Cache des embeddings de requêtes (text-embedding-3-large)
+
+L'agent ReAct relance souvent les mêmes requêtes par mots-clés ("passeport Togo")
+pour des utilisateurs différents : chaque hit économise un aller-retour OpenAI (150-400 ms).
+
+Deux niveaux :
+- Mémoire : LRU du processus, éviction par taille totale en octets
+- Persistant (optionnel) : fichier SQLite local ou table PostgreSQL `embedding_cache`
+
+Clé : texte normalisé + modèle + dimensions.
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+# Configuration
+ENABLE_EMBEDDING_CACHE = os.getenv("ENABLE_EMBEDDING_CACHE", "true").lower() in ("true", "1", "yes")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 64 MB ≈ 8000 vecteurs
+EMBEDDING_CACHE_BACKEND = os.getenv("EMBEDDING_CACHE_BACKEND", "none").lower()  # none | sqlite | postgres
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalise une requête pour que les variantes triviales partagent la même entrée :
+    Unicode NFKC, minuscules, guillemets/ponctuation de bord retirés, espaces compactés.
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" \t\n\"'`«».,;:!?")
+
+
+def cache_key(text: str, model: str, dimensions: int) -> str:
+    raw = f"{model}|{dimensions}|{normalize_query(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SQLiteEmbeddingStore:
+    """Niveau persistant local (un fichier partagé par les workers, mode WAL)"""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    key TEXT PRIMARY KEY,
+                    embedding BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._conn.execute("SELECT embedding FROM embedding_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embedding_cache (key, embedding, created_at) VALUES (?, ?, ?)",
+                (key, vector.astype(np.float32).tobytes(), time.time())
+            )
+            self._conn.commit()
+
+
+class PostgresEmbeddingStore:
+    """Niveau persistant partagé entre instances (table embedding_cache, voir supabase_script.sql)"""
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        from database.pool import get_connection
+
+        with get_connection() as conn:
+            row = conn.execute("SELECT embedding FROM embedding_cache WHERE key = %s", (key,)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        from database.pool import get_connection
+
+        with get_connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO embedding_cache (key, embedding) VALUES (%s, %s)
+                ON CONFLICT (key) DO NOTHING
+                """,
+                (key, vector.astype(np.float32).tobytes())
+            )
+
+
+class EmbeddingCache:
+    """
+    Cache LRU en mémoire (borné en octets) avec niveau persistant optionnel
+    """
+
+    def __init__(self, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES, store=None):
+        self.max_bytes = max_bytes
+        self.store = store
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "evictions": 0, "store_errors": 0}
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = vector
+            self._bytes += vector.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._counters["evictions"] += 1
+
+    def get(self, text: str, model: str, dimensions: int) -> Optional[np.ndarray]:
+        key = cache_key(text, model, dimensions)
+
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return vector
+
+        if self.store is not None:
+            try:
+                vector = self.store.get(key)
+            except Exception as e:
+                print(f"⚠️ Cache d'embeddings persistant indisponible: {e}")
+                self._count("store_errors")
+                vector = None
+            if vector is not None:
+                self._count("persistent_hits")
+                self._remember(key, vector)
+                return vector
+
+        self._count("misses")
+        return None
+
+    def put(self, text: str, model: str, dimensions: int, vector: np.ndarray) -> None:
+        key = cache_key(text, model, dimensions)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+
+        if self.store is not None:
+            try:
+                self.store.put(key, vector)
+            except Exception as e:
+                print(f"⚠️ Écriture du cache d'embeddings persistant impossible: {e}")
+                self._count("store_errors")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._counters["memory_hits"] + self._counters["persistent_hits"] + self._counters["misses"]
+            hits = lookups - self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "backend": type(self.store).__name__ if self.store is not None else "memory",
+            }
+
+
+# --- Instance globale (singleton pattern) ---
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Retourne le cache d'embeddings du processus, ou None si ENABLE_EMBEDDING_CACHE=false
+    """
+    global _embedding_cache
+
+    if not ENABLE_EMBEDDING_CACHE:
+        return None
+
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                store = None
+                if EMBEDDING_CACHE_BACKEND == "sqlite":
+                    store = SQLiteEmbeddingStore(EMBEDDING_CACHE_PATH)
+                elif EMBEDDING_CACHE_BACKEND == "postgres":
+                    store = PostgresEmbeddingStore()
+                _embedding_cache = EmbeddingCache(max_bytes=EMBEDDING_CACHE_MAX_BYTES, store=store)
+
+    return _embedding_cache
@@ -0,0 +1,90 @@
+"""
+Génération des embeddings de requêtes (OpenAI) avec cache et micro-batching optionnel
+
+Les vecteurs sont demandés en base64 et décodés sans copie (voir tools/vector_io.py).
+"""
+
+import os
+from typing import List
+
+import numpy as np
+from openai import OpenAI
+
+from tools.embedding_cache import get_embedding_cache
+from tools.embedding_batcher import get_embedding_batcher
+from tools.vector_io import create_embeddings
+
+# Configuration
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "2000"))
+SHORT_EMBEDDING_DIMENSIONS = int(os.getenv("SHORT_EMBEDDING_DIMENSIONS", "256"))
+DOCUMENT_EMBEDDING_BATCH_SIZE = 100  # Entrées par appel embeddings.create à l'ingestion
+
+_client = None
+
+
+def _get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        _client = OpenAI(api_key=OPENAI_API_KEY)
+    return _client
+
+
+def embed_query(text: str, model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS) -> np.ndarray:
+    """
+    Retourne l'embedding (float32) d'une requête, depuis le cache si possible.
+
+    Args:
+        text: Requête à encoder
+        model: Modèle d'embedding OpenAI
+        dimensions: Dimensions demandées (Matryoshka)
+
+    Returns:
+        Vecteur numpy float32 de taille `dimensions`
+    """
+    cache = get_embedding_cache()
+    if cache is not None:
+        cached = cache.get(text, model, dimensions)
+        if cached is not None:
+            return cached
+
+    batcher = get_embedding_batcher(model, dimensions)
+    if batcher is not None:
+        # Regroupé avec les requêtes concurrentes dans un seul appel API
+        vector = batcher.embed_sync(text)
+    else:
+        vector = create_embeddings(_get_client(), text, model, dimensions)[0]
+
+    if cache is not None:
+        cache.put(text, model, dimensions, vector)
+    return vector
+
+
+def embed_documents(
+    texts: List[str],
+    model: str = EMBEDDING_MODEL,
+    dimensions: int = EMBEDDING_DIMENSIONS,
+    batch_size: int = DOCUMENT_EMBEDDING_BATCH_SIZE,
+) -> List[np.ndarray]:
+    """
+    Embeddings des chunks à l'ingestion, par lots (un appel API pour `batch_size` chunks).
+    Pas de cache : les chunks sont rarement ré-ingérés à l'identique.
+
+    Returns:
+        Vecteurs numpy float32, dans l'ordre de `texts`
+    """
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(create_embeddings(_get_client(), texts[start:start + batch_size], model, dimensions))
+    return vectors
+
+
+def matryoshka_prefix(vector: np.ndarray, dimensions: int = SHORT_EMBEDDING_DIMENSIONS) -> np.ndarray:
+    """
+    Préfixe normalisé L2 d'un embedding Matryoshka (text-embedding-3-*) :
+    les premières dimensions restent une représentation utilisable à elles seules.
+    """
+    prefix = np.asarray(vector, dtype=np.float32)[:dimensions]
+    norm = np.linalg.norm(prefix)
+    return prefix / norm if norm > 0 else prefix
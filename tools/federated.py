@@ -0,0 +1,248 @@
+"""
+Recherche fédérée par collection
+
+Avec un top-k global, la collection la plus volumineuse (crawled_documents) évince les
+autres (file_uploads). En mode fédéré (ENABLE_FEDERATED_SEARCH), chaque collection est
+interrogée en parallèle (une connexion du pool par collection, dans un thread), avec son
+propre top-k (FEDERATED_TOP_K), puis les résultats sont fusionnés :
+- score de chaque ligne normalisé min-max au sein de sa collection (rrf_score en mode
+  hybride, sinon cosine_similarity), le meilleur chunk de chaque collection valant 1
+- tri global par score normalisé, puis par score brut ; cosine_similarity reste brut
+  (seuil de vector_search_tool inchangé)
+
+Chaque collection a un délai (FEDERATED_TIMEOUT), compté à partir du démarrage de sa
+recherche et appliqué aussi côté serveur (statement_timeout : la requête abandonnée rend sa
+connexion au pool). Une collection lente ou en erreur est absente du résultat mais signalée,
+avec sa latence, dans le rapport renvoyé par le tool. Au plus FEDERATED_MAX_WORKERS
+collections sont interrogées à la fois pour une question, avec des workers propres à la
+question : l'attente dans la file n'est pas comptée dans le délai.
+
+Coût en connexions : chaque recherche en cours emprunte une connexion du pool
+(DB_POOL_MAX_SIZE), soit jusqu'à FEDERATED_MAX_WORKERS × questions simultanées, et une
+recherche hors délai garde la sienne jusqu'à son statement_timeout. SEARCH_MAX_IN_FLIGHT
+borne le total pour tout le processus : au-delà, les recherches attendent une place
+au lieu d'attendre une connexion du pool.
+"""
+
+import os
+import math
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database.pool import DB_POOL_MAX_SIZE, get_connection
+from database.schema import EMBEDDING_TABLE
+from tools.retrieval import RETRIEVAL_MODE, SEARCH_COLUMNS, SearchFilters, search_documents
+
+# Configuration
+ENABLE_FEDERATED_SEARCH = os.getenv("ENABLE_FEDERATED_SEARCH", "false").lower() in ("true", "1", "yes")
+# Collections interrogées (séparées par des virgules, vide = découverte dans la table)
+FEDERATED_COLLECTIONS = tuple(
+    c.strip() for c in os.getenv("FEDERATED_COLLECTIONS", "").split(",") if c.strip()
+)
+FEDERATED_TOP_K = int(os.getenv("FEDERATED_TOP_K", "10"))  # Chunks par collection
+FEDERATED_TIMEOUT = float(os.getenv("FEDERATED_TIMEOUT", "5"))  # Secondes, par collection
+# Recherches simultanées max par question (chacune emprunte une connexion du pool, DB_POOL_MAX_SIZE)
+FEDERATED_MAX_WORKERS = int(os.getenv("FEDERATED_MAX_WORKERS", "4"))
+# Recherches en vol dans tout le processus (fédérées et shards) : une connexion de pool chacune,
+# y compris les recherches hors délai tant que statement_timeout ne les a pas interrompues
+SEARCH_MAX_IN_FLIGHT = int(os.getenv("SEARCH_MAX_IN_FLIGHT", str(DB_POOL_MAX_SIZE)))
+COLLECTION_DISCOVERY_TTL = 300  # Secondes entre deux découvertes des collections
+
+_discovered: Tuple[float, Tuple[str, ...]] = (0.0, ())
+_discovered_lock = threading.Lock()
+_in_flight = threading.BoundedSemaphore(max(1, SEARCH_MAX_IN_FLIGHT))
+
+
+def discover_collections() -> Tuple[str, ...]:
+    """
+    collection_id distincts, par saut d'index (CTE récursive sur l'index collection_id :
+    une lecture par collection au lieu d'un scan de la table). Résultat gardé COLLECTION_DISCOVERY_TTL.
+    """
+    global _discovered
+
+    discovered_at, collections = _discovered
+    if collections and time.time() - discovered_at < COLLECTION_DISCOVERY_TTL:
+        return collections
+
+    # Une seule découverte à la fois : les autres threads attendent puis relisent le résultat
+    with _discovered_lock:
+        discovered_at, collections = _discovered
+        if collections and time.time() - discovered_at < COLLECTION_DISCOVERY_TTL:
+            return collections
+
+        with get_connection() as conn:
+            rows = conn.execute(f"""
+                WITH RECURSIVE skip AS (
+                    (SELECT collection_id FROM {EMBEDDING_TABLE} ORDER BY collection_id LIMIT 1)
+                    UNION ALL
+                    SELECT (
+                        SELECT collection_id FROM {EMBEDDING_TABLE}
+                        WHERE collection_id > skip.collection_id
+                        ORDER BY collection_id LIMIT 1
+                    )
+                    FROM skip
+                    WHERE skip.collection_id IS NOT NULL
+                )
+                SELECT collection_id FROM skip WHERE collection_id IS NOT NULL
+            """).fetchall()
+
+        collections = tuple(row[0] for row in rows)
+        _discovered = (time.time(), collections)
+        return collections
+
+
+def scatter(
+    tasks: Dict[str, Callable[[], List[Dict]]],
+    timeout: float,
+    max_workers: Optional[int] = None,
+) -> Tuple[Dict[str, List[Dict]], Dict[str, Dict]]:
+    """
+    Exécute les recherches en parallèle, chacune bornée à `timeout` secondes.
+
+    Les workers sont propres à l'appel (au plus `max_workers`, par défaut un par tâche) :
+    une question n'attend jamais les recherches d'une autre. Le délai d'une tâche court à
+    partir de son démarrage, pas de sa mise en file ; une tâche jamais démarrée est abandonnée
+    après timeout × nombre de vagues (ceil(tâches / workers)).
+
+    Toutes questions confondues, au plus SEARCH_MAX_IN_FLIGHT recherches tournent à la fois
+    (une connexion du pool chacune, recherches abandonnées comprises) : au-delà, une tâche
+    attend une place plutôt que de saturer le pool.
+
+    Returns:
+        (lignes par nom de tâche terminée, rapport {nom: {status, latency_ms, rows[, error]}})
+        status : ok | timeout | error
+    """
+    if not tasks:
+        return {}, {}
+
+    workers = min(len(tasks), max_workers or len(tasks))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dagan-scatter")
+    started_at = time.perf_counter()
+    last_call = started_at + timeout * math.ceil(len(tasks) / workers)
+    starts: Dict[str, float] = {}
+    latencies: Dict[str, float] = {}
+
+    skipped = set()  # Sans place parmi SEARCH_MAX_IN_FLIGHT avant last_call, ou appel déjà terminé
+    abandoned = threading.Event()
+
+    def timed(name: str, fn: Callable[[], List[Dict]]) -> List[Dict]:
+        # L'attente d'une place ne compte pas dans le délai de la tâche
+        slots = _in_flight
+        if not slots.acquire(timeout=max(0.0, last_call - time.perf_counter())):
+            skipped.add(name)
+            return []
+        try:
+            if abandoned.is_set():
+                skipped.add(name)
+                return []
+            start = starts[name] = time.perf_counter()
+            try:
+                return fn()
+            finally:
+                latencies[name] = (time.perf_counter() - start) * 1000
+        finally:
+            slots.release()
+
+    futures = {name: executor.submit(timed, name, fn) for name, fn in tasks.items()}
+    pending, expired = set(futures), set()
+    try:
+        while pending:
+            now = time.perf_counter()
+            deadlines = [starts[name] + timeout for name in pending if name in starts]
+            next_deadline = min(deadlines + [last_call])
+            done, _ = wait([futures[name] for name in pending], timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+            pending -= {name for name in pending if futures[name] in done}
+            now = time.perf_counter()
+            late = {
+                name for name in pending
+                if not futures[name].done()
+                and ((name in starts and now - starts[name] >= timeout) or now >= last_call)
+            }
+            expired |= late
+            pending -= late
+    finally:
+        # Les recherches en retard continuent en arrière-plan (bornées par statement_timeout,
+        # leur place parmi SEARCH_MAX_IN_FLIGHT n'est rendue qu'à leur fin) ; les autres ne démarrent plus
+        abandoned.set()
+        executor.shutdown(wait=False)
+
+    results, report = {}, {}
+    for name, future in futures.items():
+        if name in expired or name in skipped:
+            # Jamais démarrée : annulée ; en cours : son résultat est ignoré
+            future.cancel()
+            latency = time.perf_counter() - starts.get(name, started_at)
+            report[name] = {"status": "timeout", "latency_ms": round(latency * 1000, 1), "rows": 0}
+            continue
+        try:
+            rows = future.result()
+        except Exception as e:
+            report[name] = {"status": "error", "latency_ms": round(latencies.get(name, 0.0), 1), "rows": 0, "error": str(e)}
+            continue
+        results[name] = rows
+        report[name] = {"status": "ok", "latency_ms": round(latencies[name], 1), "rows": len(rows)}
+    return results, report
+
+
+def _score(row: Dict) -> float:
+    return row["rrf_score"] if row.get("rrf_score") is not None else row["cosine_similarity"]
+
+
+def normalize_and_merge(results: Dict[str, List[Dict]], top_k: Optional[int] = None) -> List[Dict]:
+    """
+    Fusionne des listes classées indépendamment : score min-max par liste (normalized_score),
+    puis tri global. Les lignes déjà vues (même id) ne sont gardées qu'une fois.
+    """
+    merged, seen = [], set()
+    for rows in results.values():
+        if not rows:
+            continue
+        scores = np.array([_score(row) for row in rows], dtype=np.float64)
+        low, high = scores.min(), scores.max()
+        normalized = (scores - low) / (high - low) if high > low else np.ones_like(scores)
+        for row, value in zip(rows, normalized):
+            if row["id"] not in seen:
+                seen.add(row["id"])
+                merged.append({**row, "normalized_score": round(float(value), 4)})
+
+    merged.sort(key=lambda row: (row["normalized_score"], _score(row)), reverse=True)
+    return merged[:top_k] if top_k else merged
+
+
+def federated_search(
+    query_embedding: np.ndarray,
+    top_k: int,
+    question: str = "",
+    filters: Optional[SearchFilters] = None,
+    mode: str = RETRIEVAL_MODE,
+    columns: Sequence[str] = SEARCH_COLUMNS,
+    per_collection_k: int = FEDERATED_TOP_K,
+    timeout: float = FEDERATED_TIMEOUT,
+) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """
+    Recherche parallèle par collection, fusionnée par score normalisé.
+
+    Les collections sont celles des filtres, sinon FEDERATED_COLLECTIONS, sinon toutes
+    (discover_collections). Les autres filtres s'appliquent à chaque collection.
+
+    Returns:
+        (au plus top_k lignes au format de search_documents + normalized_score,
+         rapport par collection {status, latency_ms, rows})
+    """
+    filters = filters or SearchFilters()
+    collections = filters.collections or FEDERATED_COLLECTIONS or discover_collections()
+
+    tasks = {
+        collection: (lambda scoped=replace(filters, collections=(collection,)): search_documents(
+            query_embedding, top_k=per_collection_k, question=question, filters=scoped, mode=mode,
+            columns=columns, statement_timeout=timeout
+        ))
+        for collection in collections
+    }
+    results, report = scatter(tasks, timeout, max_workers=FEDERATED_MAX_WORKERS)
+    return normalize_and_merge(results, top_k), report
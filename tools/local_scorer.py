@@ -0,0 +1,122 @@
+"""
+Score de pertinence local (premier étage du reranking en cascade, voir tools/reranker.py)
+
+Calculé en mémoire, sans appel réseau, sur l'échelle 0-10 du reranker LLM :
+- recouvrement lexical BM25 entre la question et le candidat (IDF calculé sur les candidats)
+- similarité cosinus de la recherche vectorielle (documents) ou fiabilité de la source (web)
+- source officielle (is_official)
+- position du chunk dans sa page (les premiers chunks portent le titre et l'objet de la procédure)
+
+Similarité et BM25 sont normalisés min-max au sein des candidats : seul le classement
+relatif compte pour choisir le top-k. Le score local sert aussi à décider si le LLM est
+nécessaire : voir is_ambiguous.
+"""
+
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Paramètres BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Poids des signaux (somme = 1, score final × 10)
+DOCUMENT_WEIGHTS = {"similarity": 0.5, "lexical": 0.3, "official": 0.1, "position": 0.1}
+# Mêmes priorités que le prompt du reranking web : contenu, source officielle, fiabilité
+WEB_WEIGHTS = {"lexical": 0.5, "official": 0.3, "reliability": 0.2}
+
+# Mots vides français : présents dans toutes les questions, sans pouvoir discriminant
+STOPWORDS = frozenset("""
+a au aux avec ce ces comment dans de des du elle en est et il je la le les leur mais me mon
+ne nous on ou par pas pour qu que quel quelle quelles quels qui sa se ses son sont sur ta te
+tes ton tu un une vos votre vous y d l j s n c m t faut fait faire peut puis etre avoir
+""".split())
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Mots en minuscules sans accents, hors mots vides ("Délivrance" → "delivrance")"""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(char for char in folded if not unicodedata.combining(char))
+    return [word for word in _WORD_PATTERN.findall(folded) if word not in STOPWORDS and len(word) > 1]
+
+
+def bm25_scores(question: str, texts: Sequence[str]) -> np.ndarray:
+    """Scores BM25 de la question pour chaque texte (statistiques calculées sur `texts`)"""
+    query_terms = set(tokenize(question))
+    documents = [Counter(tokenize(text)) for text in texts]
+    if not query_terms or not documents:
+        return np.zeros(len(documents))
+
+    lengths = np.array([sum(counts.values()) for counts in documents], dtype=np.float64)
+    average_length = lengths.mean() or 1.0
+    scores = np.zeros(len(documents))
+    for term in query_terms:
+        frequencies = np.array([counts.get(term, 0) for counts in documents], dtype=np.float64)
+        containing = np.count_nonzero(frequencies)
+        if not containing:
+            continue
+        idf = np.log(1 + (len(documents) - containing + 0.5) / (containing + 0.5))
+        scores += idf * frequencies * (BM25_K1 + 1) / (
+            frequencies + BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+        )
+    return scores
+
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    low, high = values.min(), values.max()
+    return (values - low) / (high - low) if high > low else np.ones_like(values)
+
+
+def local_scores(question: str, documents: List[Dict], kind: str = "documents") -> np.ndarray:
+    """
+    Score local 0-10 de chaque candidat.
+
+    Args:
+        documents: Format de vector_search_tool ({content, similarity_score, metadata})
+            ou de web_search_tool ({content, title, reliability_score, is_official})
+        kind: "documents" ou "web"
+    """
+    if not documents:
+        return np.zeros(0)
+
+    if kind == "web":
+        texts = [f"{doc.get('title', '')} {doc.get('content', '')}" for doc in documents]
+        features = {
+            "lexical": _min_max(bm25_scores(question, texts)),
+            "official": np.array([float(bool(doc.get("is_official"))) for doc in documents]),
+            "reliability": np.array([float(doc.get("reliability_score", 0.5)) for doc in documents]),
+        }
+        weights = WEB_WEIGHTS
+    else:
+        metadata = [doc.get("metadata") or {} for doc in documents]
+        features = {
+            "similarity": _min_max(np.array([float(doc.get("similarity_score", 0.0)) for doc in documents])),
+            "lexical": _min_max(bm25_scores(question, [doc.get("content", "") for doc in documents])),
+            "official": np.array([float(bool(meta.get("is_official"))) for meta in metadata]),
+            "position": np.array([
+                1.0 - meta.get("chunk_index", 0) / max(meta.get("chunk_count", 1), 1) for meta in metadata
+            ]),
+        }
+        weights = DOCUMENT_WEIGHTS
+
+    return 10 * sum(weight * features[name] for name, weight in weights.items())
+
+
+def is_ambiguous(scores: np.ndarray, top_k: int, margin: float) -> Tuple[bool, float]:
+    """
+    Le top-k local est-il incertain ? Compare l'écart entre le dernier candidat retenu et
+    le premier écarté : sous `margin` (échelle 0-10), le classement local ne suffit pas.
+
+    Returns:
+        (ambigu, écart à la frontière du top-k)
+    """
+    if len(scores) <= top_k:
+        return False, float("inf")
+    ordered = np.sort(scores)[::-1]
+    boundary = float(ordered[top_k - 1] - ordered[top_k])
+    return boundary < margin, boundary
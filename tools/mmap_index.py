@@ -0,0 +1,328 @@
+"""
+Backend de recherche vectorielle local en mémoire partagée (numpy memmap)
+
+Pour les déploiements très orientés lecture : le corpus langchain_pg_embedding est exporté
+dans une matrice float16/float32 normalisée, lue en memmap. Tous les workers uvicorn
+partagent les mêmes pages (cache de pages de l'OS) et une question ne coûte plus
+d'aller-retour PostgreSQL. pgvector reste la source de vérité.
+
+Organisation du répertoire (MMAP_INDEX_DIR) :
+- manifest.json : dimensions, dtype, liste des segments, date de synchronisation
+- seg-XXXXX.vectors.npy : matrice (n, dimensions) normalisée L2 (produit scalaire = cosinus)
+- seg-XXXXX.docs.jsonl : {id, collection_id, document, cmetadata} une ligne par vecteur
+- seg-XXXXX.offsets.npy : offset de chaque ligne dans docs.jsonl (accès direct)
+- seg-XXXXX.ids.json : ids des lignes du segment
+- seg-XXXXX.deleted.npy : tombstones (lignes remplacées ou supprimées depuis)
+
+Les segments sont immuables et ajoutés en fin (append-only) par `manage.py sync-mmap-index` ;
+seul le manifest (écrit en dernier, de façon atomique) et les tombstones changent.
+"""
+
+import os
+import json
+import mmap
+import shutil
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+
+from tools.embeddings import matryoshka_prefix
+
+# Configuration
+POSTGRES_CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
+MMAP_INDEX_DIR = os.getenv("MMAP_INDEX_DIR", ".cache/mmap_index")
+MMAP_INDEX_DTYPE = os.getenv("MMAP_INDEX_DTYPE", "float16")  # float16 | float32
+MMAP_SEARCH_BLOCK_ROWS = 65536  # Lignes converties en float32 à la fois pendant le scoring
+EXPORT_BATCH_SIZE = 2000
+# Marge de re-synchronisation : une transaction commencée avant la dernière synchro
+# mais validée après a un updated_at antérieur à synced_at
+SYNC_OVERLAP = timedelta(minutes=10)
+
+MANIFEST_FILE = "manifest.json"
+
+
+def _write_json_atomic(path: str, data) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+
+def _save_npy_atomic(path: str, array: np.ndarray) -> None:
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _segment_path(directory: str, name: str, suffix: str) -> str:
+    return os.path.join(directory, f"{name}.{suffix}")
+
+
+def _export_segment(conn, directory: str, name: str, since=None, dtype: str = MMAP_INDEX_DTYPE) -> Dict:
+    """
+    Exporte les lignes de langchain_pg_embedding (toutes, ou modifiées depuis `since`)
+    dans un nouveau segment, via un curseur serveur (mémoire constante).
+
+    Returns:
+        {"name", "rows", "synced_at"} ("rows" = 0 si rien à exporter)
+    """
+    where = "WHERE updated_at > %(since)s" if since is not None else ""
+    params = {"since": since}
+
+    with conn.transaction():
+        # Instantané cohérent entre le COUNT et le parcours
+        conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        synced_at = conn.execute("SELECT NOW()").fetchone()[0]
+        count = conn.execute(f"SELECT COUNT(*) FROM langchain_pg_embedding {where}", params).fetchone()[0]
+        if count == 0:
+            return {"name": name, "rows": 0, "synced_at": synced_at}
+
+        dimensions = conn.execute("SELECT vector_dims(embedding) FROM langchain_pg_embedding LIMIT 1").fetchone()[0]
+        vectors = np.lib.format.open_memmap(
+            _segment_path(directory, name, "vectors.npy"), mode="w+", dtype=dtype, shape=(count, dimensions)
+        )
+        offsets = np.empty(count, dtype=np.int64)
+        ids = []
+
+        with open(_segment_path(directory, name, "docs.jsonl"), "wb") as docs, \
+                conn.cursor(name=f"mmap_export_{name}") as cursor:
+            cursor.execute(
+                f"SELECT id, collection_id, embedding, document, cmetadata FROM langchain_pg_embedding {where}",
+                params
+            )
+            position = 0
+            while position < count:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                rows = rows[:count - position]
+
+                block = np.stack([np.asarray(row[2], dtype=np.float32) for row in rows])
+                norms = np.linalg.norm(block, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                vectors[position:position + len(rows)] = (block / norms).astype(dtype)
+
+                for i, (doc_id, collection_id, _, document, cmetadata) in enumerate(rows):
+                    offsets[position + i] = docs.tell()
+                    line = json.dumps(
+                        {"id": doc_id, "collection_id": collection_id, "document": document, "cmetadata": cmetadata or {}},
+                        ensure_ascii=False
+                    )
+                    docs.write(line.encode("utf-8") + b"\n")
+                    ids.append(doc_id)
+                position += len(rows)
+
+        vectors.flush()
+        del vectors
+        np.save(_segment_path(directory, name, "offsets.npy"), offsets[:position])
+        np.save(_segment_path(directory, name, "deleted.npy"), np.zeros(position, dtype=bool))
+        with open(_segment_path(directory, name, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(ids, f)
+
+    return {"name": name, "rows": position, "synced_at": synced_at, "dimensions": dimensions}
+
+
+def _export_connection():
+    conn = psycopg.connect(POSTGRES_CONNECTION_STRING)
+    register_vector(conn)
+    return conn
+
+
+def build_mmap_index(directory: str = MMAP_INDEX_DIR, dtype: str = MMAP_INDEX_DTYPE) -> Dict:
+    """
+    Reconstruit complètement l'index local depuis pgvector (un seul segment),
+    dans un répertoire temporaire échangé à la fin.
+    Les workers qui ont encore l'ancien index ouvert continuent de le lire.
+    """
+    directory = directory.rstrip("/")
+    building_dir = f"{directory}.building"
+    shutil.rmtree(building_dir, ignore_errors=True)
+    os.makedirs(building_dir)
+
+    with _export_connection() as conn:
+        segment = _export_segment(conn, building_dir, "seg-00000", dtype=dtype)
+
+    manifest = {
+        "dtype": dtype,
+        "dimensions": segment.get("dimensions"),
+        "synced_at": segment["synced_at"].isoformat(),
+        "segments": [{"name": segment["name"], "rows": segment["rows"]}] if segment["rows"] else [],
+    }
+    _write_json_atomic(os.path.join(building_dir, MANIFEST_FILE), manifest)
+
+    previous_dir = f"{directory}.previous"
+    shutil.rmtree(previous_dir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, previous_dir)
+    os.replace(building_dir, directory)
+    shutil.rmtree(previous_dir, ignore_errors=True)
+
+    print(f"✓ Index mmap construit: {segment['rows']} vecteurs ({dtype}) dans {directory}")
+    return manifest
+
+
+def sync_mmap_index(directory: str = MMAP_INDEX_DIR) -> Dict:
+    """
+    Synchronisation incrémentale avec pgvector :
+    - lignes modifiées depuis la dernière synchro → nouveau segment (append-only)
+    - anciennes versions de ces lignes et lignes supprimées en base → tombstones
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return build_mmap_index(directory)
+
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    since = datetime.fromisoformat(manifest["synced_at"]) - SYNC_OVERLAP
+    name = f"seg-{len(manifest['segments']):05d}"
+
+    with _export_connection() as conn:
+        segment = _export_segment(conn, directory, name, since=since, dtype=manifest["dtype"])
+        live_ids = {row[0] for row in conn.execute("SELECT id FROM langchain_pg_embedding")}
+
+    new_ids = set()
+    if segment["rows"]:
+        with open(_segment_path(directory, name, "ids.json"), encoding="utf-8") as f:
+            new_ids = set(json.load(f))
+
+    # Tombstones : versions remplacées par le nouveau segment ou supprimées en base
+    tombstoned = 0
+    for existing in manifest["segments"]:
+        with open(_segment_path(directory, existing["name"], "ids.json"), encoding="utf-8") as f:
+            ids = json.load(f)
+        deleted_path = _segment_path(directory, existing["name"], "deleted.npy")
+        deleted = np.load(deleted_path)
+        stale = np.fromiter((doc_id in new_ids or doc_id not in live_ids for doc_id in ids), dtype=bool, count=len(ids))
+        newly_deleted = stale & ~deleted
+        if newly_deleted.any():
+            tombstoned += int(newly_deleted.sum())
+            _save_npy_atomic(deleted_path, deleted | stale)
+
+    if segment["rows"]:
+        manifest["segments"].append({"name": name, "rows": segment["rows"]})
+        manifest["dimensions"] = manifest.get("dimensions") or segment.get("dimensions")
+    manifest["synced_at"] = segment["synced_at"].isoformat()
+    _write_json_atomic(manifest_path, manifest)
+
+    print(f"✓ Index mmap synchronisé: +{segment['rows']} vecteurs, {tombstoned} tombstones")
+    return manifest
+
+
+class _Segment:
+    def __init__(self, directory: str, name: str):
+        self.vectors = np.load(_segment_path(directory, name, "vectors.npy"), mmap_mode="r")
+        self.offsets = np.load(_segment_path(directory, name, "offsets.npy"), mmap_mode="r")
+        self.deleted = np.load(_segment_path(directory, name, "deleted.npy"))
+        # docs.jsonl projeté en mémoire en même temps que ses offsets : après un build/sync
+        # qui remplace le fichier, les lectures restent sur la version chargée
+        with open(_segment_path(directory, name, "docs.jsonl"), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def document(self, row: int) -> Dict:
+        start = int(self.offsets[row])
+        end = self.docs.find(b"\n", start)
+        return json.loads(self.docs[start:end if end >= 0 else len(self.docs)])
+
+
+class MmapVectorIndex:
+    """
+    Lecture de l'index local : top-k vectorisé numpy sur les segments memmap.
+    Recharge automatiquement les segments quand le manifest change.
+    """
+
+    def __init__(self, directory: str = MMAP_INDEX_DIR):
+        self.directory = directory
+        self._manifest_mtime = None
+        self._segments: List[_Segment] = []
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        mtime = os.stat(manifest_path).st_mtime_ns
+        if mtime == self._manifest_mtime:
+            return
+        with self._lock:
+            if mtime == self._manifest_mtime:
+                return
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._segments = [_Segment(self.directory, seg["name"]) for seg in manifest["segments"]]
+            self._manifest_mtime = mtime
+            print(f"✓ Index mmap chargé: {sum(len(s.vectors) for s in self._segments)} vecteurs")
+
+    def search(self, query_embedding: np.ndarray, top_k: int) -> List[Dict]:
+        """
+        Retourne les top_k chunks au format de tools.retrieval.search_chunks
+        ({id, document, cmetadata, collection_id, cosine_similarity}), plus short_vector
+        (préfixe Matryoshka normalisé, utilisé par tools/diversify.py)
+        """
+        self._refresh()
+        segments = self._segments
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        best_scores = np.empty(0, dtype=np.float32)
+        best_refs = np.empty((0, 2), dtype=np.int64)  # (segment, ligne)
+
+        for segment_index, segment in enumerate(segments):
+            for start in range(0, len(segment.vectors), MMAP_SEARCH_BLOCK_ROWS):
+                block = np.asarray(segment.vectors[start:start + MMAP_SEARCH_BLOCK_ROWS], dtype=np.float32)
+                scores = block @ query
+                scores[segment.deleted[start:start + len(block)]] = -np.inf
+
+                k = min(top_k, len(scores))
+                top = np.argpartition(-scores, k - 1)[:k]
+                refs = np.column_stack([np.full(k, segment_index), top + start])
+
+                best_scores = np.concatenate([best_scores, scores[top]])
+                best_refs = np.concatenate([best_refs, refs])
+                if len(best_scores) > top_k:
+                    keep = np.argpartition(-best_scores, top_k - 1)[:top_k]
+                    best_scores, best_refs = best_scores[keep], best_refs[keep]
+
+        order = np.argsort(-best_scores)
+        rows = []
+        for i in order:
+            if not np.isfinite(best_scores[i]):
+                continue
+            segment_index, row = best_refs[i]
+            doc = segments[segment_index].document(int(row))
+            doc["cosine_similarity"] = float(best_scores[i])
+            # Préfixe Matryoshka pour la diversification MMR (sans relecture dans PostgreSQL)
+            doc["short_vector"] = matryoshka_prefix(segments[segment_index].vectors[int(row)])
+            rows.append(doc)
+        return rows
+
+    def stats(self) -> Dict:
+        return {
+            "segments": len(self._segments),
+            "vectors": int(sum(len(s.vectors) for s in self._segments)),
+            "tombstones": int(sum(int(s.deleted.sum()) for s in self._segments)),
+        }
+
+
+# --- Instance globale (singleton pattern) ---
+_mmap_index: Optional[MmapVectorIndex] = None
+
+
+def get_mmap_index() -> Optional[MmapVectorIndex]:
+    """
+    Retourne l'index mmap du processus, ou None s'il n'a pas encore été construit
+    (vector_search_tool retombe alors sur pgvector)
+    """
+    global _mmap_index
+
+    if not os.path.exists(os.path.join(MMAP_INDEX_DIR, MANIFEST_FILE)):
+        return None
+    if _mmap_index is None:
+        _mmap_index = MmapVectorIndex(MMAP_INDEX_DIR)
+    return _mmap_index
@@ -0,0 +1,105 @@
+"""
+Extraction de passages ciblés par la question
+
+Au lieu de tronquer les chunks (content[:500] pour le reranker, chunk entier de 4000 caractères
+pour l'agent), chaque chunk est découpé en phrases, notées par BM25 contre la question
+(tools/local_scorer.py), et seules les meilleures sont gardées dans un budget de tokens,
+dans l'ordre du texte. La phrase utile n'est plus perdue quand elle se trouve après le
+500e caractère, et l'agent ne paie plus les tokens des phrases hors sujet.
+
+Notation lexicale uniquement : noter les phrases par embedding demanderait un appel API
+par chunk, pour un gain marginal sur des questions administratives riches en mots-clés.
+
+Les passages gardent leurs positions (start, end) dans le texte d'origine : une citation
+se résout toujours vers la page source (url) et l'extrait exact du chunk.
+"""
+
+import os
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from tools.local_scorer import bm25_scores
+
+# Configuration
+ENABLE_PASSAGE_EXTRACTION = os.getenv("ENABLE_PASSAGE_EXTRACTION", "true").lower() in ("true", "1", "yes")
+PASSAGE_RERANK_TOKENS = int(os.getenv("PASSAGE_RERANK_TOKENS", "128"))  # Par candidat envoyé au reranker
+PASSAGE_CONTEXT_TOKENS = int(os.getenv("PASSAGE_CONTEXT_TOKENS", "300"))  # Par source renvoyée à l'agent
+CHARS_PER_TOKEN = 4  # Estimation pour le français (pas de tokenizer local)
+MAX_SENTENCE_CHARS = 400  # Phrases plus longues (listes, tableaux aplatis) découpées aux espaces
+PASSAGE_SEPARATOR = " … "
+
+# Fin de phrase : ponctuation suivie d'un blanc, ou fin de ligne (listes à puces, titres)
+SENTENCE_PATTERN = re.compile(r"\S.*?(?:[.!?…]+(?=\s|$)|(?=\n)|$)", re.DOTALL)
+
+
+def segment(text: str) -> List[Tuple[int, int]]:
+    """Positions (start, end) des phrases de `text`, blancs de bord exclus"""
+    spans = []
+    for match in SENTENCE_PATTERN.finditer(text):
+        start, end = match.span()
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        while end - start > MAX_SENTENCE_CHARS:
+            cut = text.rfind(" ", start, start + MAX_SENTENCE_CHARS)
+            cut = cut if cut > start else start + MAX_SENTENCE_CHARS
+            spans.append((start, cut))
+            start = cut + 1 if text[cut:cut + 1] == " " else cut
+        if end > start:
+            spans.append((start, end))
+    return spans
+
+
+def extract_passages(question: str, text: str, max_tokens: int) -> Tuple[str, List[Dict]]:
+    """
+    Meilleures phrases de `text` pour la question, dans un budget de `max_tokens`.
+
+    Returns:
+        (passages joints par PASSAGE_SEPARATOR dans l'ordre du texte,
+         positions [{start, end}] des passages dans `text`)
+    """
+    budget = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= budget:
+        return text, [{"start": 0, "end": len(text)}]
+
+    spans = segment(text)
+    if not spans:
+        return "", []
+
+    # Sans mot commun avec la question, ordre du texte (équivalent à une troncature)
+    scores = bm25_scores(question, [text[start:end] for start, end in spans])
+    order = sorted(range(len(spans)), key=lambda i: (-scores[i], i)) if np.any(scores > 0) else range(len(spans))
+
+    selected, used = [], 0
+    for i in order:
+        start, end = spans[i]
+        cost = end - start + len(PASSAGE_SEPARATOR)
+        if used + cost > budget:
+            if selected:
+                continue
+            # Meilleure phrase plus longue que le budget : tronquée
+            end = start + budget
+            cost = budget
+        selected.append((start, end))
+        used += cost
+
+    # Phrases contiguës (séparées par des blancs seulement) fusionnées en un passage
+    passages: List[List[int]] = []
+    for start, end in sorted(selected):
+        if passages and not text[passages[-1][1]:start].strip():
+            passages[-1][1] = end
+        else:
+            passages.append([start, end])
+
+    return (
+        PASSAGE_SEPARATOR.join(text[start:end] for start, end in passages),
+        [{"start": start, "end": end} for start, end in passages],
+    )
+
+
+def passage_text(question: str, text: str, max_tokens: int, fallback_chars: int) -> str:
+    """Texte d'un candidat pour le reranker : passages ciblés, ou troncature si désactivé"""
+    if not ENABLE_PASSAGE_EXTRACTION:
+        return text[:fallback_chars]
+    return extract_passages(question, text, max_tokens)[0]
@@ -0,0 +1,293 @@
+"""
+Cache des scores du reranking LLM (tools/reranker.py)
+
+Les mêmes couples (question, chunk) sont rerankés à chaque reformulation identique de
+l'agent, et avec temperature=0.7 le LLM ne leur donne pas deux fois le même score.
+Un score en cache est réutilisé tel quel : seuls les candidats absents sont envoyés au LLM,
+puis scores en cache et nouveaux scores sont fusionnés.
+
+Clé : type de reranking (documents | web) + question normalisée (même normalisation que le
+cache d'embeddings) + hash du texte du candidat tel qu'il est présenté au LLM. La question
+exacte plutôt qu'un voisinage d'embedding : deux questions proches peuvent appeler des
+documents différents ("passeport" / "passeport perdu").
+
+Deux niveaux, comme tools/embedding_cache.py :
+- Mémoire : LRU du processus, au plus RERANK_CACHE_MAX_ENTRIES scores
+- Persistant (optionnel) : fichier SQLite local ou table PostgreSQL `rerank_cache`,
+  élagué (expirés, puis plus anciens au-delà de RERANK_CACHE_MAX_ROWS) toutes les
+  RERANK_CACHE_PRUNE_EVERY écritures
+
+Chaque score expire après RERANK_CACHE_TTL secondes (contenu des pages mis à jour,
+prompt modifié).
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tools.embedding_cache import normalize_query
+
+# Configuration
+ENABLE_RERANK_CACHE = os.getenv("ENABLE_RERANK_CACHE", "true").lower() in ("true", "1", "yes")
+RERANK_CACHE_TTL = int(os.getenv("RERANK_CACHE_TTL", str(7 * 24 * 3600)))  # Secondes
+RERANK_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "50000"))  # Niveau mémoire
+RERANK_CACHE_MAX_ROWS = int(os.getenv("RERANK_CACHE_MAX_ROWS", "500000"))  # Niveau persistant
+RERANK_CACHE_BACKEND = os.getenv("RERANK_CACHE_BACKEND", "none").lower()  # none | sqlite | postgres
+RERANK_CACHE_PATH = os.getenv("RERANK_CACHE_PATH", ".cache/rerank_scores.sqlite")
+RERANK_CACHE_PRUNE_EVERY = 500  # Écritures persistantes entre deux élagages
+# À incrémenter quand un prompt de reranking change : les anciens scores ne sont plus relus
+RERANK_PROMPT_VERSION = 1
+
+
+def rerank_cache_key(kind: str, question: str, text: str) -> str:
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    raw = f"{RERANK_PROMPT_VERSION}|{kind}|{normalize_query(question)}|{content_hash}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SQLiteRerankStore:
+    """Niveau persistant local (un fichier partagé par les workers, mode WAL)"""
+
+    def __init__(self, path: str = RERANK_CACHE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS rerank_cache (
+                    key TEXT PRIMARY KEY,
+                    score REAL NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS rerank_cache_created_idx ON rerank_cache (created_at)")
+            self._conn.commit()
+
+    def get_many(self, keys: Sequence[str], ttl: int) -> Dict[str, Tuple[float, float]]:
+        placeholders = ", ".join("?" for _ in keys)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, score, created_at FROM rerank_cache WHERE key IN ({placeholders}) AND created_at > ?",
+                (*keys, time.time() - ttl)
+            ).fetchall()
+        return {key: (score, created_at) for key, score, created_at in rows}
+
+    def put_many(self, scores: Dict[str, float]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rerank_cache (key, score, created_at) VALUES (?, ?, ?)",
+                [(key, score, now) for key, score in scores.items()]
+            )
+            self._conn.commit()
+
+    def prune(self, ttl: int, max_rows: int) -> int:
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM rerank_cache WHERE created_at <= ?", (time.time() - ttl,)).rowcount
+            deleted += self._conn.execute(
+                """
+                DELETE FROM rerank_cache WHERE key IN (
+                    SELECT key FROM rerank_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (max_rows,)
+            ).rowcount
+            self._conn.commit()
+        return deleted
+
+
+class PostgresRerankStore:
+    """Niveau persistant partagé entre instances (table rerank_cache, voir supabase_script.sql)"""
+
+    def get_many(self, keys: Sequence[str], ttl: int) -> Dict[str, Tuple[float, float]]:
+        from database.pool import get_connection
+
+        with get_connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT key, score, EXTRACT(EPOCH FROM created_at)
+                FROM rerank_cache
+                WHERE key = ANY(%s) AND created_at > NOW() - make_interval(secs => %s)
+                """,
+                (list(keys), ttl)
+            ).fetchall()
+        return {key: (score, float(created_at)) for key, score, created_at in rows}
+
+    def put_many(self, scores: Dict[str, float]) -> None:
+        from database.pool import get_connection
+
+        with get_connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO rerank_cache (key, score)
+                SELECT * FROM unnest(%s::text[], %s::real[])
+                ON CONFLICT (key) DO UPDATE SET score = EXCLUDED.score, created_at = NOW()
+                """,
+                (list(scores), list(scores.values()))
+            )
+
+    def prune(self, ttl: int, max_rows: int) -> int:
+        from database.pool import get_connection
+
+        with get_connection() as conn:
+            deleted = conn.execute(
+                "DELETE FROM rerank_cache WHERE created_at <= NOW() - make_interval(secs => %s)", (ttl,)
+            ).rowcount
+            deleted += conn.execute(
+                """
+                DELETE FROM rerank_cache WHERE created_at < (
+                    SELECT created_at FROM rerank_cache ORDER BY created_at DESC OFFSET %s LIMIT 1
+                )
+                """,
+                (max_rows,)
+            ).rowcount
+        return deleted
+
+
+class RerankCache:
+    """
+    Cache LRU en mémoire (borné en nombre de scores, avec TTL) et niveau persistant optionnel
+    """
+
+    def __init__(
+        self,
+        ttl: int = RERANK_CACHE_TTL,
+        max_entries: int = RERANK_CACHE_MAX_ENTRIES,
+        max_rows: int = RERANK_CACHE_MAX_ROWS,
+        store=None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.store = store
+        self._entries: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # clé → (score, created_at)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._counters = {
+            "memory_hits": 0, "persistent_hits": 0, "misses": 0,
+            "evictions": 0, "expired": 0, "pruned": 0, "store_errors": 0,
+        }
+
+    def _remember(self, entries: Dict[str, Tuple[float, float]]) -> None:
+        with self._lock:
+            for key, entry in entries.items():
+                self._entries.pop(key, None)
+                self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def get_many(self, kind: str, question: str, texts: List[str]) -> Dict[int, float]:
+        """
+        Scores en cache des candidats `texts`.
+
+        Returns:
+            {indice du candidat: score} pour les seuls candidats trouvés
+        """
+        keys = [rerank_cache_key(kind, question, text) for text in texts]
+        found: Dict[str, float] = {}
+        expires_before = time.time() - self.ttl
+
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] <= expires_before:
+                    del self._entries[key]
+                    self._counters["expired"] += 1
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[0]
+            self._counters["memory_hits"] += len(found)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if self.store is not None and missing:
+            try:
+                stored = self.store.get_many(missing, self.ttl)
+            except Exception as e:
+                print(f"⚠️ Cache de reranking persistant indisponible: {e}")
+                self._count("store_errors")
+                stored = {}
+            if stored:
+                self._remember(stored)
+                found.update((key, score) for key, (score, _) in stored.items())
+                self._count("persistent_hits", len(stored))
+
+        scores = {i: found[key] for i, key in enumerate(keys) if key in found}
+        self._count("misses", len(texts) - len(scores))
+        return scores
+
+    def put_many(self, kind: str, question: str, scored: Dict[str, float]) -> None:
+        """Enregistre des scores LLM ({texte du candidat: score})"""
+        if not scored:
+            return
+        entries = {rerank_cache_key(kind, question, text): float(score) for text, score in scored.items()}
+        now = time.time()
+        self._remember({key: (score, now) for key, score in entries.items()})
+
+        if self.store is None:
+            return
+        try:
+            self.store.put_many(entries)
+            with self._lock:
+                self._writes += len(entries)
+                prune = self._writes >= RERANK_CACHE_PRUNE_EVERY
+                if prune:
+                    self._writes = 0
+            if prune:
+                self._count("pruned", self.store.prune(self.ttl, self.max_rows))
+        except Exception as e:
+            print(f"⚠️ Écriture du cache de reranking persistant impossible: {e}")
+            self._count("store_errors")
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += amount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._counters["memory_hits"] + self._counters["persistent_hits"] + self._counters["misses"]
+            hits = lookups - self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "backend": type(self.store).__name__ if self.store is not None else "memory",
+            }
+
+
+# --- Instance globale (singleton pattern) ---
+_rerank_cache: Optional[RerankCache] = None
+_rerank_cache_lock = threading.Lock()
+
+
+def get_rerank_cache() -> Optional[RerankCache]:
+    """
+    Retourne le cache des scores de reranking du processus, ou None si ENABLE_RERANK_CACHE=false
+    """
+    global _rerank_cache
+
+    if not ENABLE_RERANK_CACHE:
+        return None
+
+    if _rerank_cache is None:
+        with _rerank_cache_lock:
+            if _rerank_cache is None:
+                store = None
+                if RERANK_CACHE_BACKEND == "sqlite":
+                    store = SQLiteRerankStore(RERANK_CACHE_PATH)
+                elif RERANK_CACHE_BACKEND == "postgres":
+                    store = PostgresRerankStore()
+                _rerank_cache = RerankCache(store=store)
+
+    return _rerank_cache
@@ -0,0 +1,162 @@
+"""
+Évaluation du reranking : ordre par similarité et ordre reranké comparés côte à côte
+
+Sur une fraction RERANK_EVAL_SAMPLE_RATE des recherches vectorielles, journalise dans
+rerank_eval_log (voir supabase_script.sql) :
+- la corrélation de Spearman entre similarité cosinus et score de reranking des candidats
+- le recouvrement entre le top-k par similarité et le top-k reranké (1.0 = reranking inutile)
+- la latence ajoutée par rerank_documents et l'appel ou non du LLM (cascade)
+
+Avec ENABLE_RERANKING=true, les recherches échantillonnées sont simplement mesurées.
+Avec ENABLE_RERANKING=false (mode ombre), le reranking tourne sur des copies dans un thread
+à part : l'agent reçoit l'ordre par similarité, sans latence ajoutée.
+
+Synthèse par collection : `python manage.py rerank-report`. La collection d'une recherche
+est la plus fréquente parmi ses candidats.
+"""
+
+import os
+import time
+import random
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from database.pool import get_connection
+
+# Configuration
+RERANK_EVAL_SAMPLE_RATE = float(os.getenv("RERANK_EVAL_SAMPLE_RATE", "0"))  # Fraction des recherches (0 = désactivé)
+
+
+def sample_rerank_eval() -> bool:
+    """Tirage de la recherche courante pour l'évaluation"""
+    return RERANK_EVAL_SAMPLE_RATE > 0 and random.random() < RERANK_EVAL_SAMPLE_RATE
+
+
+def _spearman(x: np.ndarray, y: np.ndarray) -> Optional[float]:
+    if len(x) < 2:
+        return None
+    ranks_x = np.argsort(np.argsort(-x)).astype(np.float64)
+    ranks_y = np.argsort(np.argsort(-y)).astype(np.float64)
+    if ranks_x.std() == 0 or ranks_y.std() == 0:
+        return None
+    return float(np.corrcoef(ranks_x, ranks_y)[0, 1])
+
+
+def compare_orders(candidates: List[Dict], reranked: List[Dict], top_k: int) -> Dict:
+    """
+    Compare l'ordre par similarité des candidats et le top-k renvoyé par rerank_documents
+    (mêmes objets : rerank_documents trie les candidats qu'il reçoit).
+
+    Returns:
+        {spearman (None si non calculable), top_k_overlap}
+    """
+    scored = [doc for doc in candidates if "rerank_score" in doc]
+    spearman = _spearman(
+        np.array([float(doc["similarity_score"]) for doc in scored]),
+        np.array([float(doc["rerank_score"]) for doc in scored]),
+    )
+    similarity_top = sorted(candidates, key=lambda doc: doc["similarity_score"], reverse=True)[:top_k]
+    overlap = len({id(doc) for doc in similarity_top} & {id(doc) for doc in reranked}) / top_k
+    return {"spearman": spearman, "top_k_overlap": overlap}
+
+
+def log_rerank_eval(
+    candidates: List[Dict], reranked: List[Dict], top_k: int, latency_ms: float, shadow: bool = False
+) -> None:
+    """
+    Journalise la comparaison d'une recherche. Une seule instruction ; une erreur
+    n'interrompt jamais la recherche.
+    """
+    comparison = compare_orders(candidates, reranked, top_k)
+    collections = Counter((doc.get("metadata") or {}).get("collection") for doc in candidates)
+    llm_called = any(doc.get("rerank_stage") == "llm" for doc in candidates)
+    print(
+        f"🧪 ÉVALUATION RERANKING{' (ombre)' if shadow else ''}: recouvrement top-{top_k} "
+        f"{comparison['top_k_overlap']:.2f}, Spearman {comparison['spearman'] if comparison['spearman'] is not None else '—'}, "
+        f"{latency_ms:.0f} ms{' (LLM)' if llm_called else ''}"
+    )
+    try:
+        with get_connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO rerank_eval_log
+                    (collection_id, candidates, top_k, spearman, top_k_overlap, latency_ms, llm_called, shadow)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (
+                    collections.most_common(1)[0][0] if collections else None,
+                    len(candidates), top_k, comparison["spearman"], comparison["top_k_overlap"],
+                    latency_ms, llm_called, shadow,
+                )
+            )
+    except Exception as e:
+        print(f"⚠️ Journal d'évaluation du reranking indisponible: {e}")
+
+
+def _shadow_rerank(question: str, candidates: List[Dict], top_k: int) -> None:
+    from tools.reranker import rerank_documents
+
+    try:
+        started = time.perf_counter()
+        reranked = rerank_documents(question, candidates, top_k=top_k)
+        log_rerank_eval(candidates, reranked, top_k, (time.perf_counter() - started) * 1000, shadow=True)
+    except Exception as e:
+        print(f"⚠️ Reranking en mode ombre échoué: {e}")
+
+
+def shadow_rerank(question: str, documents: List[Dict], top_k: int) -> None:
+    """
+    Mode ombre : reranke des copies des candidats dans un thread à part et journalise la
+    comparaison ; les documents de la recherche ne sont pas modifiés.
+    """
+    candidates = [{**doc, "metadata": dict(doc.get("metadata") or {})} for doc in documents]
+    threading.Thread(
+        target=_shadow_rerank, args=(question, candidates, top_k), name="dagan-rerank-shadow", daemon=True
+    ).start()
+
+
+def rerank_report(days: int = 30) -> List[Dict]:
+    """
+    Synthèse de rerank_eval_log par collection (derniers `days` jours).
+
+    Returns:
+        Une entrée par collection : {collection_id, searches, llm_rate, spearman, top_k_overlap,
+        latency_p50_ms, latency_p95_ms, ms_per_changed} où ms_per_changed est la latence totale
+        divisée par le nombre de documents du top-k remplacés par le reranking (None si aucun)
+    """
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT
+                collection_id,
+                COUNT(*) AS searches,
+                AVG(llm_called::int) AS llm_rate,
+                AVG(spearman) AS spearman,
+                AVG(top_k_overlap) AS top_k_overlap,
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms) AS latency_p50_ms,
+                percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms) AS latency_p95_ms,
+                SUM(latency_ms) / NULLIF(SUM((1 - top_k_overlap) * top_k), 0) AS ms_per_changed
+            FROM rerank_eval_log
+            WHERE created_at > NOW() - make_interval(days => %s)
+            GROUP BY collection_id
+            ORDER BY collection_id
+            """,
+            (days,)
+        ).fetchall()
+
+    return [
+        {
+            "collection_id": collection,
+            "searches": searches,
+            "llm_rate": round(float(llm_rate), 3),
+            "spearman": round(float(spearman), 3) if spearman is not None else None,
+            "top_k_overlap": round(float(overlap), 3),
+            "latency_p50_ms": round(float(p50), 1),
+            "latency_p95_ms": round(float(p95), 1),
+            "ms_per_changed": round(float(per_changed), 1) if per_changed is not None else None,
+        }
+        for collection, searches, llm_rate, spearman, overlap, p50, p95, per_changed in rows
+    ]
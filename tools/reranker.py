@@ -1,14 +1,244 @@
 """
 Reranker pour améliorer la pertinence des documents récupérés
 Utilise GPT-4o-mini pour évaluer la pertinence sémantique réelle
+
+Reranking en cascade (ENABLE_RERANK_CASCADE) : un score local (tools/local_scorer.py :
+BM25, similarité, source officielle, position du chunk) classe d'abord tous les candidats
+en mémoire. Le LLM n'est appelé que si ce classement est ambigu, c'est-à-dire si l'écart
+entre le dernier candidat retenu et le premier écarté est inférieur à RERANK_CASCADE_MARGIN
+(sur 10). Sinon rerank_score est le score local. Chaque candidat porte rerank_stage
+("local" ou "llm") ; les appels LLM évités sont comptés sur /metrics.
+
+Les scores LLM sont mis en cache par (question normalisée, texte du candidat)
+(tools/rerank_cache.py) : seuls les candidats sans score en cache sont envoyés au LLM.
+
+Étage LLM par groupes : les candidats sont découpés en groupes de RERANK_BATCH_SIZE notés
+en parallèle (client OpenAI asynchrone sur la boucle de tools/async_runner.py), chaque appel
+borné par RERANK_TIMEOUT. Un même candidat d'ancrage (meilleur score local) est ajouté à
+chaque groupe : les scores d'un groupe sont décalés de l'écart entre la note de l'ancre dans
+ce groupe et sa note moyenne, pour rendre les groupes comparables avant la fusion.
+RERANK_COMPACT_OUTPUT : réponse {doc_id, score} sans justification (moins de tokens de
+sortie, pas de JSON tronqué). Un groupe en échec ou hors délai : classement local.
+
+Chaque candidat est présenté au LLM par ses phrases les plus proches de la question
+(tools/passages.py, PASSAGE_RERANK_TOKENS) plutôt que par ses premiers caractères.
 """
 
 import os
-from typing import List, Dict
-from openai import OpenAI
+import json
+import asyncio
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import List, Dict, Optional, Tuple
+
+from openai import AsyncOpenAI
+
+from tools.async_runner import run_coroutine
+from tools.local_scorer import is_ambiguous, local_scores
+from tools.passages import PASSAGE_RERANK_TOKENS, passage_text
+from tools.rerank_cache import get_rerank_cache
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 RERANK_TOP_K = 5  # Nombre de documents à garder après reranking
+ENABLE_RERANK_CASCADE = os.getenv("ENABLE_RERANK_CASCADE", "true").lower() in ("true", "1", "yes")
+RERANK_CASCADE_MARGIN = float(os.getenv("RERANK_CASCADE_MARGIN", "1.0"))  # Écart local (0-10) au rang top_k
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))  # Candidats par appel LLM
+RERANK_COMPACT_OUTPUT = os.getenv("RERANK_COMPACT_OUTPUT", "false").lower() in ("true", "1", "yes")
+RERANK_TIMEOUT = float(os.getenv("RERANK_TIMEOUT", "10"))  # Secondes, par appel LLM
+
+_counters_lock = threading.Lock()
+_counters = {
+    kind: {"reranks": 0, "llm_calls": 0, "llm_skipped": 0, "llm_cached": 0, "llm_errors": 0, "llm_timeouts": 0}
+    for kind in ("documents", "web")
+}
+_client: Optional[AsyncOpenAI] = None
+_client_lock = threading.Lock()
+
+
+def _count(kind: str, event: str, amount: int = 1) -> None:
+    with _counters_lock:
+        _counters[kind][event] += amount
+
+
+def _get_client() -> AsyncOpenAI:
+    """Client asynchrone partagé (utilisé uniquement sur la boucle d'arrière-plan)"""
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+    return _client
+
+
+def reranker_stats() -> Dict:
+    """Compteurs cumulés de la cascade (exposés sur /metrics)"""
+    with _counters_lock:
+        stats = {kind: dict(counters) for kind, counters in _counters.items()}
+    for counters in stats.values():
+        counters["llm_skip_rate"] = round(counters["llm_skipped"] / counters["reranks"], 3) if counters["reranks"] else 0.0
+    cache = get_rerank_cache()
+    return {
+        **stats,
+        "cascade": ENABLE_RERANK_CASCADE,
+        "margin": RERANK_CASCADE_MARGIN,
+        "batch_size": RERANK_BATCH_SIZE,
+        "compact_output": RERANK_COMPACT_OUTPUT,
+        "score_cache": cache.stats() if cache else None,
+    }
+
+
+def _apply_scores(documents: List[Dict], scores, stage: str, top_k: int) -> List[Dict]:
+    """Ajoute rerank_score / rerank_stage, trie et garde les top_k"""
+    for doc, score in zip(documents, scores):
+        doc["rerank_score"] = round(float(score), 2) if stage == "local" else score
+        doc["rerank_stage"] = stage
+    return sorted(documents, key=lambda x: x.get("rerank_score", 0), reverse=True)[:top_k]
+
+
+def _local_stage(question: str, documents: List[Dict], top_k: int, kind: str):
+    """
+    Premier étage de la cascade.
+
+    Returns:
+        (scores locaux, documents classés si le LLM est inutile, sinon None)
+    """
+    scores = local_scores(question, documents, kind)
+    _count(kind, "reranks")
+    if not ENABLE_RERANK_CASCADE:
+        return scores, None
+
+    ambiguous, boundary = is_ambiguous(scores, top_k, RERANK_CASCADE_MARGIN)
+    if ambiguous:
+        print(f"Classement local ambigu (écart {boundary:.2f} < {RERANK_CASCADE_MARGIN} au rang {top_k}) : reranking LLM")
+        return scores, None
+
+    _count(kind, "llm_skipped")
+    print(f"⚡ Reranking local ({kind}) : écart {boundary:.2f} au rang {top_k}, appel LLM évité")
+    return scores, _apply_scores(documents, scores, "local", top_k)
+
+
+def _cached_scores(kind: str, question: str, texts: List[str]) -> Tuple[Dict[int, float], List[int]]:
+    """
+    Scores LLM déjà connus des candidats (texte tel que présenté au LLM).
+
+    Returns:
+        ({indice: score} en cache, indices à envoyer au LLM)
+    """
+    cache = get_rerank_cache()
+    cached = cache.get_many(kind, question, texts) if cache else {}
+    return cached, [i for i in range(len(texts)) if i not in cached]
+
+
+def _store_scores(kind: str, question: str, texts: List[str], scores: Dict[int, float]) -> None:
+    cache = get_rerank_cache()
+    if cache:
+        cache.put_many(kind, question, {texts[i]: score for i, score in scores.items()})
+
+
+def _parse_rankings(content: str) -> Dict[int, float]:
+    """Réponse JSON du LLM → {indice du document: score}"""
+    rankings = json.loads(content)
+    scores = {}
+    for rank in rankings.get("rankings", []):
+        doc_id = rank.get("doc_id")
+        score = rank.get("score", 0)
+        if doc_id:
+            scores[doc_id - 1] = score  # -1 car doc_id commence à 1
+    return scores
+
+
+def _ranking_format() -> str:
+    """Format de réponse demandé au LLM (compact : sans justification)"""
+    if RERANK_COMPACT_OUTPUT:
+        return '{"rankings": [{"doc_id": 1, "score": 10}]}\nPas de justification : doc_id et score uniquement.'
+    return '{"rankings": [{"doc_id": 1, "score": 10, "reason": "..."}]}'
+
+
+async def _score_group(client: AsyncOpenAI, messages: List[Dict], temperature: float) -> Dict[int, float]:
+    """Un appel LLM sur un groupe de candidats → {indice dans le groupe: score}"""
+    response = await asyncio.wait_for(
+        client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            temperature=temperature,
+            response_format={"type": "json_object"}
+        ),
+        timeout=RERANK_TIMEOUT
+    )
+    return _parse_rankings(response.choices[0].message.content)
+
+
+def _llm_scores(kind: str, question: str, texts: List[str], indices: List[int], local) -> Dict[int, float]:
+    """
+    Étage LLM : groupes de RERANK_BATCH_SIZE candidats notés en parallèle, puis calibrés
+    sur le candidat d'ancrage.
+
+    Args:
+        texts: Texte présenté au LLM pour chaque candidat
+        indices: Candidats à noter (sans score en cache)
+        local: Scores locaux (choix de l'ancre)
+
+    Returns:
+        {indice dans la liste complète: score}
+
+    Raises:
+        Exception: Premier échec d'un groupe (délai dépassé compris) ; aucun score partiel
+    """
+    groups = [indices[i:i + RERANK_BATCH_SIZE] for i in range(0, len(indices), RERANK_BATCH_SIZE)]
+    anchor = None
+    if len(groups) > 1:
+        # Ancre parmi les candidats à noter : une ancre en cache garderait son ancien score,
+        # et les nouveaux scores seraient calibrés sur une référence différente
+        anchor = max(indices, key=lambda i: local[i])
+        groups = [group if anchor in group else [*group, anchor] for group in groups]
+
+    build_messages = _document_messages if kind == "documents" else _web_messages
+    temperature = 0.7 if kind == "documents" else 0.3
+
+    async def score_groups():
+        client = _get_client()
+        return await asyncio.gather(
+            *(_score_group(client, build_messages(question, [texts[i] for i in group]), temperature) for group in groups),
+            return_exceptions=True
+        )
+
+    _count(kind, "llm_calls", len(groups))
+    try:
+        results = run_coroutine(score_groups(), timeout=RERANK_TIMEOUT + 5)
+    except FutureTimeoutError:
+        _count(kind, "llm_timeouts")
+        raise
+    for result in results:
+        if isinstance(result, asyncio.TimeoutError):
+            _count(kind, "llm_timeouts")
+            raise TimeoutError(f"reranking LLM au-delà de {RERANK_TIMEOUT}s") from result
+        if isinstance(result, Exception):
+            raise result
+
+    # Scores ramenés aux indices de la liste complète
+    group_scores = [
+        {group[i]: score for i, score in result.items() if 0 <= i < len(group)}
+        for group, result in zip(groups, results)
+    ]
+    anchor_scores = [scores.get(anchor) for scores in group_scores] if anchor is not None else []
+    known = [score for score in anchor_scores if score is not None]
+    if not known:
+        merged = {}
+        for scores in group_scores:
+            merged.update(scores)
+        return merged
+
+    reference = sum(known) / len(known)
+    merged = {anchor: round(reference, 2)}
+    for scores, anchor_score in zip(group_scores, anchor_scores):
+        shift = reference - anchor_score if anchor_score is not None else 0.0
+        for i, score in scores.items():
+            if i != anchor:
+                merged[i] = round(min(10.0, max(0.0, score + shift)), 2)
+    print(f"   {len(groups)} groupes calibrés sur l'ancre (notes {known} → {reference:.2f})")
+    return {i: score for i, score in merged.items() if i in indices}
 
 
 def rerank_documents(question: str, documents: List[Dict], top_k: int = RERANK_TOP_K) -> List[Dict]:
@@ -32,18 +262,47 @@ def rerank_documents(question: str, documents: List[Dict], top_k: int = RERANK_T
         print(f"Reranking skippé : seulement {len(documents)} documents (≤ {top_k})")
         return documents
     
+    local, ranked = _local_stage(question, documents, top_k, "documents")
+    if ranked is not None:
+        return ranked
+    
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        # Texte présenté au LLM (passages ciblés par la question), aussi clé du cache
+        texts = [passage_text(question, doc.get("content", ""), PASSAGE_RERANK_TOKENS, 500) for doc in documents]
+        scores, missing = _cached_scores("documents", question, texts)
         
-        print(f"Reranking de {len(documents)} documents pour ne garder que les {top_k} meilleurs...")
+        print(f"Reranking de {len(documents)} documents pour ne garder que les {top_k} meilleurs "
+              f"({len(documents) - len(missing)} scores en cache)...")
+        if missing:
+            scores.update(_llm_scores("documents", question, texts, missing, local))
+            _store_scores("documents", question, texts, {i: scores[i] for i in missing if i in scores})
+        else:
+            _count("documents", "llm_cached")
         
-        # Préparer le prompt de reranking
-        docs_text = ""
-        for i, doc in enumerate(documents):
-            content = doc.get("content", "")[:500]  # Limiter à 500 caractères
-            docs_text += f"\n[DOC {i+1}]\n{content}\n"
+        # rerank_score ajouté aux documents, tri décroissant, top_k conservés
+        final_docs = _apply_scores(documents, [scores.get(i, 0) for i in range(len(documents))], "llm", top_k)
         
-        rerank_prompt = f"""Tu es un expert en évaluation de pertinence de documents pour les procédures administratives togolaises.
+        print(f" Reranking terminé : {len(final_docs)} documents conservés")
+        for i, doc in enumerate(final_docs[:3], 1):  # Afficher les 3 meilleurs
+            print(f"  {i}. Score: {doc.get('rerank_score', 0)}/10 (similarity: {doc.get('similarity_score', 0):.3f})")
+        
+        return final_docs
+        
+    except Exception as e:
+        _count("documents", "llm_errors")
+        print(f"Erreur lors du reranking: {e}")
+        print(f"   Fallback: classement local des {top_k} meilleurs documents")
+        return _apply_scores(documents, local, "local", top_k)
+
+
+def _document_messages(question: str, texts: List[str]) -> List[Dict]:
+    """Messages du reranking d'un groupe de documents"""
+    # Préparer le prompt de reranking
+    docs_text = ""
+    for i, content in enumerate(texts):
+        docs_text += f"\n[DOC {i+1}]\n{content}\n"
+    
+    rerank_prompt = f"""Tu es un expert en évaluation de pertinence de documents pour les procédures administratives togolaises.
 
 **Question de l'utilisateur :**
 {question}
@@ -60,54 +319,14 @@ def rerank_documents(question: str, documents: List[Dict], top_k: int = RERANK_T
 - 0 = Non pertinent
 
 **Réponds UNIQUEMENT avec un JSON valide au format :**
-{{"rankings": [{{"doc_id": 1, "score": 10, "reason": "..."}}]}}
+{_ranking_format()}
 
 Ne réponds qu'avec le JSON, rien d'autre."""
 
-        # Appeler GPT-4o-mini pour le reranking
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Tu es un expert en reranking de documents. Tu réponds uniquement avec du JSON valide."},
-                {"role": "user", "content": rerank_prompt}
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
-        
-        # parser la réponse
-        import json
-        rankings = json.loads(response.choices[0].message.content)
-        
-        # créer un mapping doc_id → score
-        scores = {}
-        for rank in rankings.get("rankings", []):
-            doc_id = rank.get("doc_id")
-            score = rank.get("score", 0)
-            if doc_id:
-                scores[doc_id - 1] = score  # -1 car doc_id commence à 1
-        
-        # ajouter le rerank_score aux documents
-        for i, doc in enumerate(documents):
-            doc["rerank_score"] = scores.get(i, 0)
-        
-        # on trie par rerank_score décroissant
-        reranked = sorted(documents, key=lambda x: x.get("rerank_score", 0), reverse=True)
-        
-        # on garde seulement les top_k
-        final_docs = reranked[:top_k]
-        
-        print(f" Reranking terminé : {len(final_docs)} documents conservés")
-        for i, doc in enumerate(final_docs[:3], 1):  # Afficher les 3 meilleurs
-            print(f"  {i}. Score: {doc.get('rerank_score', 0)}/10 (similarity: {doc.get('similarity_score', 0):.3f})")
-        
-        return final_docs
-        
-    except Exception as e:
-        print(f"Erreur lors du reranking: {e}")
-        print(f"   Fallback: retour des {top_k} premiers documents sans reranking")
-        # Fallback : retourner les top_k premiers documents triés par similarity
-        return documents[:top_k]
+    return [
+        {"role": "system", "content": "Tu es un expert en reranking de documents. Tu réponds uniquement avec du JSON valide."},
+        {"role": "user", "content": rerank_prompt}
+    ]
 
 
 def rerank_web_results(question: str, web_results: List[Dict], top_k: int = 5) -> List[Dict]:
@@ -132,23 +351,56 @@ def rerank_web_results(question: str, web_results: List[Dict], top_k: int = 5) -
         print(f"Reranking web skippé : seulement {len(web_results)} résultats (≤ {top_k})")
         return web_results
     
+    local, ranked = _local_stage(question, web_results, top_k, "web")
+    if ranked is not None:
+        return ranked
+    
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
-        print(f" Reranking de {len(web_results)} résultats web pour ne garder que les {top_k} meilleurs...")
-        
-        # preparer le prompt de reranking pour résultats web
-        results_text = ""
-        for i, result in enumerate(web_results):
+        # Bloc présenté au LLM pour chaque résultat, aussi clé du cache
+        blocks = []
+        for result in web_results:
             title = result.get("title", "Sans titre")
-            content = result.get("content", "")[:400]
+            content = passage_text(question, result.get("content", ""), PASSAGE_RERANK_TOKENS, 400)
             url = result.get("url", "")
             is_official = " OFFICIEL" if result.get("is_official", False) else " Non officiel"
             reliability = result.get("reliability_score", 0.5)
-            
-            results_text += f"\n[RESULT {i+1}] {is_official} (Fiabilité: {reliability:.2f})\nTitre: {title}\nURL: {url}\nContenu: {content}\n"
+            blocks.append(f"{is_official} (Fiabilité: {reliability:.2f})\nTitre: {title}\nURL: {url}\nContenu: {content}")
+        scores, missing = _cached_scores("web", question, blocks)
+        
+        print(f" Reranking de {len(web_results)} résultats web pour ne garder que les {top_k} meilleurs "
+              f"({len(web_results) - len(missing)} scores en cache)...")
+        if missing:
+            scores.update(_llm_scores("web", question, blocks, missing, local))
+            _store_scores("web", question, blocks, {i: scores[i] for i in missing if i in scores})
+        else:
+            _count("web", "llm_cached")
+        
+        # rerank_score ajouté aux résultats, tri décroissant, top_k conservés
+        final_results = _apply_scores(web_results, [scores.get(i, 0) for i in range(len(web_results))], "llm", top_k)
         
-        rerank_prompt = f"""Tu es un expert en évaluation de pertinence de sources web pour les procédures administratives togolaises.
+        print(f" Reranking web terminé : {len(final_results)} résultats conservés")
+        for i, result in enumerate(final_results[:3], 1):
+            is_official = "🏛️" if result.get("is_official") else "🌐"
+            print(f"  {i}. {is_official} Score: {result.get('rerank_score', 0)}/10 - {result.get('title', 'Sans titre')[:50]}")
+        
+        return final_results
+        
+    except Exception as e:
+        _count("web", "llm_errors")
+        print(f" Erreur lors du reranking web: {e}")
+        print(f"   Fallback: classement local des {top_k} meilleurs résultats")
+        # Fallback : score local (source officielle et fiabilité comprises)
+        return _apply_scores(web_results, local, "local", top_k)
+
+
+def _web_messages(question: str, blocks: List[str]) -> List[Dict]:
+    """Messages du reranking d'un groupe de résultats web"""
+    # preparer le prompt de reranking pour résultats web
+    results_text = ""
+    for i, block in enumerate(blocks):
+        results_text += f"\n[RESULT {i+1}] {block}\n"
+    
+    rerank_prompt = f"""Tu es un expert en évaluation de pertinence de sources web pour les procédures administratives togolaises.
 
 **Question de l'utilisateur :**
 {question}
@@ -166,51 +418,9 @@ def rerank_web_results(question: str, web_results: List[Dict], top_k: int = 5) -
 Évalue chaque résultat et donne un score de 0 à 10. Privilégie FORTEMENT les sources officielles.
 
 **Réponds UNIQUEMENT avec un JSON valide au format :**
-{{"rankings": [{{"doc_id": 1, "score": 10, "reason": "..."}}]}}"""
+{_ranking_format()}"""
 
-        # Appeler GPT-4o-mini pour le reranking
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Tu es un expert en reranking de sources web. Tu réponds uniquement avec du JSON valide."},
-                {"role": "user", "content": rerank_prompt}
-            ],
-            temperature=0.3,
-            response_format={"type": "json_object"}
-        )
-        
-        # Parser la réponse
-        import json
-        rankings = json.loads(response.choices[0].message.content)
-        
-        # Créer un mapping doc_id → score
-        scores = {}
-        for rank in rankings.get("rankings", []):
-            doc_id = rank.get("doc_id")
-            score = rank.get("score", 0)
-            if doc_id:
-                scores[doc_id - 1] = score
-        
-        # Ajouter le rerank_score aux résultats
-        for i, result in enumerate(web_results):
-            result["rerank_score"] = scores.get(i, 0)
-        
-        # Trier par rerank_score décroissant
-        reranked = sorted(web_results, key=lambda x: x.get("rerank_score", 0), reverse=True)
-        
-        # Garder seulement les top_k
-        final_results = reranked[:top_k]
-        
-        print(f" Reranking web terminé : {len(final_results)} résultats conservés")
-        for i, result in enumerate(final_results[:3], 1):
-            is_official = "🏛️" if result.get("is_official") else "🌐"
-            print(f"  {i}. {is_official} Score: {result.get('rerank_score', 0)}/10 - {result.get('title', 'Sans titre')[:50]}")
-        
-        return final_results
-        
-    except Exception as e:
-        print(f" Erreur lors du reranking web: {e}")
-        print(f"   Fallback: retour des {top_k} premiers résultats sans reranking")
-        # Fallback : prioriser les sources officielles
-        web_results.sort(key=lambda x: (x.get("is_official", False), x.get("reliability_score", 0)), reverse=True)
-        return web_results[:top_k]
+    return [
+        {"role": "system", "content": "Tu es un expert en reranking de sources web. Tu réponds uniquement avec du JSON valide."},
+        {"role": "user", "content": rerank_prompt}
+    ]
@@ -0,0 +1,200 @@
+"""
+Cache sémantique des résultats de vector_search_tool
+
+Beaucoup de citoyens posent les mêmes questions (passeport, CNI, acte de naissance)
+avec des formulations proches. Une question dont l'embedding est à moins d'un rayon
+cosinus d'une question déjà traitée reçoit le résultat complet en cache (sources
+rerankées comprises) : ni requête SQL, ni appel LLM de reranking.
+
+- Rayon : similarité cosinus minimale RESULT_CACHE_MIN_SIMILARITY
+- Durée de vie : RESULT_CACHE_TTL secondes
+- Taille : RESULT_CACHE_MAX_ENTRIES entrées (éviction LRU)
+- Périmètre : une entrée ne sert que pour les mêmes collections et les mêmes filtres de métadonnées
+- Invalidation : chaque entrée connaît son périmètre (collections recherchées, None = toutes) ;
+  une écriture de /vectorize ou /vectorize-file dans une collection invalide les entrées concernées.
+
+Le cache est propre au processus : avec plusieurs workers, seul le worker qui a traité
+l'ingestion est invalidé immédiatement, les autres au plus tard après RESULT_CACHE_TTL.
+"""
+
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+# Configuration
+ENABLE_RESULT_CACHE = os.getenv("ENABLE_RESULT_CACHE", "true").lower() in ("true", "1", "yes")
+RESULT_CACHE_MIN_SIMILARITY = float(os.getenv("RESULT_CACHE_MIN_SIMILARITY", "0.97"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "500"))
+
+
+def _scope(collections: Optional[Iterable[str]]) -> Optional[Tuple[str, ...]]:
+    if isinstance(collections, str):
+        collections = [collections]
+    return tuple(sorted(collections)) if collections else None
+
+
+class SemanticResultCache:
+    """
+    Cache LRU de résultats indexé par embedding de question (recherche par rayon cosinus)
+    """
+
+    def __init__(
+        self,
+        min_similarity: float = RESULT_CACHE_MIN_SIMILARITY,
+        ttl: float = RESULT_CACHE_TTL,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+    ):
+        self.min_similarity = min_similarity
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # id d'entrée → (embedding normalisé, (périmètre, variante de filtres), résultat, date d'insertion)
+        self._entries: "OrderedDict[int, Tuple[np.ndarray, Tuple, Dict, float]]" = OrderedDict()
+        self._next_id = 0
+        self._matrix: Optional[np.ndarray] = None  # Embeddings empilés, reconstruits après modification
+        self._matrix_ids: list = []
+        self._generation = 0  # Incrémenté à chaque invalidation
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _invalidate_matrix(self) -> None:
+        self._matrix = None
+        self._matrix_ids = []
+
+    def _drop(self, entry_id: int, counter: str) -> None:
+        self._entries.pop(entry_id, None)
+        self._counters[counter] += 1
+        self._invalidate_matrix()
+
+    def _purge_expired(self, now: float) -> None:
+        expired = [entry_id for entry_id, (_, _, _, created_at) in self._entries.items() if now - created_at > self.ttl]
+        for entry_id in expired:
+            self._drop(entry_id, "expirations")
+
+    def get(
+        self,
+        embedding: np.ndarray,
+        collections: Optional[Iterable[str]] = None,
+        variant: str = "",
+    ) -> Optional[Dict]:
+        """
+        Retourne une copie du résultat de la question la plus proche dans le rayon, ou None
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        vector = vector / norm
+        scope = (_scope(collections), variant)
+
+        with self._lock:
+            self._purge_expired(time.time())
+            if not self._entries:
+                self._counters["misses"] += 1
+                return None
+
+            if self._matrix is None:
+                self._matrix_ids = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[entry_id][0] for entry_id in self._matrix_ids])
+
+            similarities = self._matrix @ vector
+            for position in np.argsort(-similarities):
+                if similarities[position] < self.min_similarity:
+                    break
+                entry_id = self._matrix_ids[position]
+                _, entry_scope, result, _ = self._entries[entry_id]
+                if entry_scope == scope:
+                    self._entries.move_to_end(entry_id)
+                    self._counters["hits"] += 1
+                    cached = copy.deepcopy(result)
+                    cached["cache"] = {"hit": True, "similarity": round(float(similarities[position]), 4)}
+                    return cached
+
+            self._counters["misses"] += 1
+            return None
+
+    @property
+    def generation(self) -> int:
+        """À lire avant la recherche et à passer à put() : écarte un résultat calculé pendant une ingestion"""
+        return self._generation
+
+    def put(
+        self,
+        embedding: np.ndarray,
+        result: Dict,
+        collections: Optional[Iterable[str]] = None,
+        variant: str = "",
+        generation: Optional[int] = None,
+    ) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[self._next_id] = (
+                vector / norm, (_scope(collections), variant), copy.deepcopy(result), time.time()
+            )
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                entry_id = next(iter(self._entries))
+                self._drop(entry_id, "evictions")
+            self._invalidate_matrix()
+
+    def invalidate(self, collection: str) -> int:
+        """
+        Supprime les entrées dont le périmètre inclut `collection` (ou toutes les collections)
+
+        Returns:
+            Nombre d'entrées supprimées
+        """
+        with self._lock:
+            self._generation += 1
+            stale = [
+                entry_id for entry_id, (_, (scope, _), _, _) in self._entries.items()
+                if scope is None or collection in scope
+            ]
+            for entry_id in stale:
+                self._drop(entry_id, "invalidations")
+        return len(stale)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "min_similarity": self.min_similarity,
+                "ttl_seconds": self.ttl,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+# --- Instance globale (singleton pattern) ---
+_result_cache: Optional[SemanticResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[SemanticResultCache]:
+    """
+    Retourne le cache de résultats du processus, ou None si ENABLE_RESULT_CACHE=false
+    """
+    global _result_cache
+
+    if not ENABLE_RESULT_CACHE:
+        return None
+
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = SemanticResultCache()
+
+    return _result_cache
@@ -0,0 +1,659 @@
+"""
+Construction des requêtes de recherche vectorielle (pgvector)
+
+Le ORDER BY porte directement sur l'opérateur de distance (<=>) pour que le planner
+puisse utiliser l'index ANN (ivfflat / HNSW). Un ORDER BY sur "1 - distance" force
+un scan séquentiel de tous les vecteurs.
+
+Mode hybride (RETRIEVAL_MODE=hybrid) : recherche dense + recherche lexicale plein texte
+(tsvector français, index GIN) fusionnées par Reciprocal Rank Fusion dans une seule requête.
+Les requêtes administratives contiennent des tokens exacts (ANID, DGDN, "F CFA", numéros
+de formulaires) que la recherche dense rate souvent.
+
+Mode quantifié (RETRIEVAL_MODE=quantized) : première passe en distance de Hamming sur la
+copie binaire embedding_bit, puis rescoring cosinus exact des QUANTIZED_CANDIDATES premiers.
+Comparaison avec le chemin exact : `python manage.py bench-quantized`.
+
+Mode deux étapes (RETRIEVAL_MODE=two_stage) : candidats via le préfixe Matryoshka
+normalisé embedding_short (256 dims), rescoring par le vecteur complet.
+
+Filtres (SearchFilters) : liste de collections, filtre JSONB (cmetadata @> ...) et préfixe
+d'URL, poussés dans la requête ANN. Avec des filtres, le parcours itératif de l'index
+(hnsw.iterative_scan, pgvector >= 0.8) continue tant que LIMIT n'est pas atteint, au lieu de
+renvoyer moins de résultats que demandé quand les filtres éliminent les premiers voisins.
+
+Recherche en deux phases (ENABLE_TWO_PHASE_RETRIEVAL) : la recherche ne renvoie que
+(id, collection_id, distance, taille du contenu) ; le texte et les métadonnées ne sont
+chargés (hydrate_chunks) que pour les candidats qui passent le seuil et la diversification.
+"""
+
+import os
+import re
+import json
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from psycopg.rows import dict_row
+
+from database.schema import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_TABLE,
+    SHORT_EMBEDDING_DIMENSIONS,
+    VECTOR_INDEX_NAME,
+    distance_expression,
+)
+from database.shards import group_by_shard, shard_connection
+from tools.embeddings import matryoshka_prefix
+
+# Réglages ANN par défaut (None = valeur du serveur)
+VECTOR_SEARCH_PROBES = int(os.getenv("VECTOR_SEARCH_PROBES", "0")) or None  # ivfflat.probes
+VECTOR_SEARCH_EF_SEARCH = int(os.getenv("VECTOR_SEARCH_EF_SEARCH", "0")) or None  # hnsw.ef_search
+# Parcours itératif de l'index pour les recherches filtrées : relaxed_order | strict_order | off
+VECTOR_ITERATIVE_SCAN = os.getenv("VECTOR_ITERATIVE_SCAN", "relaxed_order").lower()
+
+# Recherche hybride (dense + lexicale, fusion RRF)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense").lower()  # dense | hybrid | quantized | two_stage
+HYBRID_DENSE_WEIGHT = float(os.getenv("HYBRID_DENSE_WEIGHT", "1.0"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+RRF_K = int(os.getenv("RRF_K", "60"))  # Constante de lissage RRF : 1 / (k + rang)
+
+# Recherche quantifiée binaire (nécessite ENABLE_BINARY_QUANTIZATION à l'ingestion)
+QUANTIZED_CANDIDATES = int(os.getenv("QUANTIZED_CANDIDATES", "200"))
+
+# Recherche Matryoshka en deux étapes (préfixe embedding_short puis vecteur complet)
+TWO_STAGE_CANDIDATES = int(os.getenv("TWO_STAGE_CANDIDATES", "100"))
+
+# Colonnes réellement utilisées par vector_search_tool (pas l'embedding brut)
+SEARCH_COLUMNS = ("id", "document", "cmetadata", "collection_id")
+# Phase 1 de la recherche en deux phases : identifiants et taille du contenu (sans détoaster le texte)
+ENABLE_TWO_PHASE_RETRIEVAL = os.getenv("ENABLE_TWO_PHASE_RETRIEVAL", "true").lower() in ("true", "1", "yes")
+ID_COLUMNS = (
+    "id",
+    "collection_id",
+    "octet_length(document) + pg_column_size(cmetadata) AS payload_bytes",
+)
+HYDRATE_COLUMNS = ("document", "cmetadata")
+
+# Volumétrie transférée par la recherche (exposée sur /metrics)
+_transfer_lock = threading.Lock()
+_transfer_counters = {
+    "searches": 0,
+    "candidate_rows": 0,
+    "hydrated_rows": 0,
+    "candidate_payload_bytes": 0,  # Ce qu'une recherche en une phase aurait chargé
+    "hydrated_payload_bytes": 0,
+}
+
+
+def _qualified(columns: Sequence[str], alias: str) -> List[str]:
+    """Préfixe les colonnes simples par l'alias de table (les expressions sont laissées telles quelles)"""
+    return [column if " " in column else f"{alias}.{column}" for column in columns]
+
+
+def _output_names(columns: Sequence[str]) -> List[str]:
+    """Nom de sortie de chaque colonne projetée ("expr AS nom" → nom)"""
+    return [column.rsplit(" AS ", 1)[-1] for column in columns]
+
+
+@dataclass
+class SearchFilters:
+    """
+    Filtres poussés dans la requête de recherche.
+
+    Attributes:
+        collections: collection_id autorisés (vide = toutes les collections)
+        metadata: Filtre de containment JSONB, ex: {"is_official": true, "source": "file_upload"}
+        url_prefix: Préfixe de cmetadata->>'url', ex: "https://service-public.gouv.tg/"
+    """
+    collections: Tuple[str, ...] = ()
+    metadata: Dict = field(default_factory=dict)
+    url_prefix: Optional[str] = None
+
+    def is_empty(self) -> bool:
+        return not (self.collections or self.metadata or self.url_prefix)
+
+    def merge(self, other: "SearchFilters") -> "SearchFilters":
+        """Combine deux jeux de filtres (les collections de `other` remplacent celles-ci)"""
+        return SearchFilters(
+            collections=other.collections or self.collections,
+            metadata={**self.metadata, **other.metadata},
+            url_prefix=other.url_prefix or self.url_prefix,
+        )
+
+    def cache_variant(self) -> str:
+        """Filtres hors collections, sous forme stable (clé du cache de résultats)"""
+        return json.dumps({"metadata": self.metadata, "url_prefix": self.url_prefix}, sort_keys=True)
+
+    def where_clause(self) -> Tuple[str, Dict]:
+        """
+        Returns:
+            (clause "WHERE ..." ou "", paramètres nommés f_*)
+        """
+        conditions, params = [], {}
+        if self.collections:
+            conditions.append("collection_id = ANY(%(f_collections)s)")
+            params["f_collections"] = list(self.collections)
+        if self.metadata:
+            conditions.append("cmetadata @> %(f_metadata)s::jsonb")
+            params["f_metadata"] = json.dumps(self.metadata)
+        if self.url_prefix:
+            escaped = re.sub(r"([\\%_])", r"\\\1", self.url_prefix)
+            conditions.append("cmetadata->>'url' LIKE %(f_url_prefix)s")
+            params["f_url_prefix"] = f"{escaped}%"
+        if not conditions:
+            return "", params
+        return "WHERE " + " AND ".join(conditions), params
+
+
+def _filter_sql(filters: Optional[SearchFilters]) -> Tuple[str, Dict]:
+    return filters.where_clause() if filters is not None else ("", {})
+
+
+def build_search_query(columns: Sequence[str] = SEARCH_COLUMNS, where: str = "") -> str:
+    """
+    Construit la requête de recherche des plus proches voisins.
+
+    Paramètres nommés attendus : %(query)b (vecteur) et %(limit)s.
+
+    Args:
+        columns: Colonnes à projeter en plus de la similarité
+        where: Clause de filtrage (SearchFilters.where_clause)
+
+    Returns:
+        Requête SQL compatible avec l'index ANN
+    """
+    projection = ",\n            ".join(columns)
+    distance = distance_expression("%(query)b")
+    if where:
+        output_projection = ",\n            ".join(_output_names(columns))
+        # Le parcours itératif "relaxed_order" peut rendre des voisins légèrement désordonnés :
+        # tri final sur le résultat matérialisé
+        return f"""
+        WITH nearest AS MATERIALIZED (
+            SELECT
+                {projection},
+                {distance} AS distance
+            FROM {EMBEDDING_TABLE}
+            {where}
+            ORDER BY {distance}
+            LIMIT %(limit)s
+        )
+        SELECT
+            {output_projection},
+            1 - distance AS cosine_similarity
+        FROM nearest
+        ORDER BY distance
+    """
+    return f"""
+        SELECT
+            {projection},
+            1 - ({distance}) AS cosine_similarity
+        FROM {EMBEDDING_TABLE}
+        ORDER BY {distance}
+        LIMIT %(limit)s
+    """
+
+
+def apply_search_settings(
+    cursor,
+    probes: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    iterative: bool = False,
+) -> None:
+    """
+    Applique les réglages ANN pour la transaction courante uniquement (équivalent SET LOCAL).
+
+    Args:
+        cursor: Curseur psycopg dans une transaction ouverte
+        probes: Nombre de listes ivfflat visitées (rappel ↑, latence ↑)
+        ef_search: Taille de la liste de candidats HNSW (rappel ↑, latence ↑)
+        iterative: Recherche filtrée → parcours itératif de l'index (VECTOR_ITERATIVE_SCAN)
+    """
+    probes = probes or VECTOR_SEARCH_PROBES
+    ef_search = ef_search or VECTOR_SEARCH_EF_SEARCH
+
+    if probes:
+        cursor.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(int(probes)),))
+    if ef_search:
+        cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(int(ef_search)),))
+    if iterative and VECTOR_ITERATIVE_SCAN != "off":
+        cursor.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", (VECTOR_ITERATIVE_SCAN,))
+        cursor.execute("SELECT set_config('ivfflat.iterative_scan', %s, true)", (VECTOR_ITERATIVE_SCAN,))
+
+
+def search_chunks(
+    cursor,
+    query_embedding: np.ndarray,
+    top_k: int,
+    probes: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    filters: Optional[SearchFilters] = None,
+    columns: Sequence[str] = SEARCH_COLUMNS,
+) -> List[Dict]:
+    """
+    Recherche les top_k chunks les plus proches de l'embedding de la question.
+
+    Args:
+        cursor: Curseur psycopg (row_factory=dict_row)
+        query_embedding: Embedding de la question
+        top_k: Nombre de chunks à retourner
+        probes / ef_search: Réglages ANN pour cette requête
+        filters: Collections / métadonnées / préfixe d'URL
+        columns: Colonnes projetées (ID_COLUMNS pour la phase 1 de la recherche en deux phases)
+
+    Returns:
+        Liste de lignes {id, document, cmetadata, collection_id, cosine_similarity}
+    """
+    where, params = _filter_sql(filters)
+    apply_search_settings(cursor, probes=probes, ef_search=ef_search, iterative=bool(where))
+    cursor.execute(build_search_query(columns, where=where), {"query": query_embedding, "limit": top_k, **params})
+    return cursor.fetchall()
+
+
+def _build_rescoring_query(candidate_order: str, columns: Sequence[str] = SEARCH_COLUMNS, where: str = "") -> str:
+    """
+    Requête en deux passes : candidats triés par `candidate_order` (index compact),
+    puis tri par distance cosinus exacte sur l'embedding float32 complet.
+
+    Paramètres nommés : %(query)b, %(candidates)s, %(limit)s (+ ceux de candidate_order).
+    """
+    projection = ",\n            ".join(_qualified(columns, "e"))
+    exact_distance = distance_expression("%(query)b", storage="vector")
+    return f"""
+        WITH candidates AS (
+            SELECT id
+            FROM {EMBEDDING_TABLE}
+            {where}
+            ORDER BY {candidate_order}
+            LIMIT %(candidates)s
+        )
+        SELECT
+            {projection},
+            1 - ({exact_distance}) AS cosine_similarity
+        FROM candidates c
+        JOIN {EMBEDDING_TABLE} e ON e.id = c.id
+        ORDER BY {exact_distance}
+        LIMIT %(limit)s
+    """
+
+
+def build_quantized_query(columns: Sequence[str] = SEARCH_COLUMNS, where: str = "") -> str:
+    """Candidats par distance de Hamming (<~>) sur embedding_bit, rescoring cosinus exact"""
+    return _build_rescoring_query(
+        f"embedding_bit <~> binary_quantize(%(query)b::vector)::bit({EMBEDDING_DIMENSIONS})",
+        columns,
+        where
+    )
+
+
+def build_two_stage_query(columns: Sequence[str] = SEARCH_COLUMNS, where: str = "") -> str:
+    """
+    Candidats par produit scalaire (<#>) sur le préfixe Matryoshka normalisé embedding_short,
+    rescoring cosinus exact. Paramètre supplémentaire : %(short_query)b.
+    """
+    return _build_rescoring_query(
+        f"embedding_short <#> %(short_query)b::vector({SHORT_EMBEDDING_DIMENSIONS})",
+        columns,
+        where
+    )
+
+
+def quantized_search_chunks(
+    cursor,
+    query_embedding: np.ndarray,
+    top_k: int,
+    candidates: int = QUANTIZED_CANDIDATES,
+    filters: Optional[SearchFilters] = None,
+    columns: Sequence[str] = SEARCH_COLUMNS,
+) -> List[Dict]:
+    """
+    Recherche en deux passes : Hamming (binaire) puis cosinus exact.
+
+    hnsw.ef_search borne le nombre de candidats renvoyés par l'index HNSW :
+    il est relevé au nombre de candidats demandés.
+
+    Returns:
+        Lignes au format de search_chunks (cosine_similarity exacte)
+    """
+    candidates = max(candidates, top_k)
+    where, params = _filter_sql(filters)
+    apply_search_settings(cursor, ef_search=max(candidates, VECTOR_SEARCH_EF_SEARCH or 0), iterative=bool(where))
+    cursor.execute(
+        build_quantized_query(columns, where=where),
+        {"query": query_embedding, "candidates": candidates, "limit": top_k, **params}
+    )
+    return cursor.fetchall()
+
+
+def two_stage_search_chunks(
+    cursor,
+    query_embedding: np.ndarray,
+    top_k: int,
+    candidates: int = TWO_STAGE_CANDIDATES,
+    filters: Optional[SearchFilters] = None,
+    columns: Sequence[str] = SEARCH_COLUMNS,
+) -> List[Dict]:
+    """
+    Recherche Matryoshka : préfixe court (index HNSW compact) puis vecteur complet.
+
+    Le préfixe de la question est dérivé de son embedding complet (pas de second appel API).
+    Les lignes sans embedding_short (avant backfill) ne sont pas candidates.
+
+    Returns:
+        Lignes au format de search_chunks (cosine_similarity exacte)
+    """
+    candidates = max(candidates, top_k)
+    where, params = _filter_sql(filters)
+    apply_search_settings(cursor, ef_search=max(candidates, VECTOR_SEARCH_EF_SEARCH or 0), iterative=bool(where))
+    cursor.execute(build_two_stage_query(columns, where=where), {
+        "query": query_embedding,
+        "short_query": matryoshka_prefix(query_embedding, SHORT_EMBEDDING_DIMENSIONS),
+        "candidates": candidates,
+        "limit": top_k,
+        **params,
+    })
+    return cursor.fetchall()
+
+
+def _lexical_text(question: str) -> str:
+    """Retire les opérateurs de moteur web (site:...) ajoutés par l'agent aux requêtes"""
+    return re.sub(r"\bsite:\S+", " ", question).strip()
+
+
+def build_hybrid_query(columns: Sequence[str] = SEARCH_COLUMNS, where: str = "") -> str:
+    """
+    Construit la requête hybride : top-N dense (index ANN) + top-N lexical (index GIN),
+    fusion RRF pondérée, en un seul aller-retour.
+
+    Paramètres nommés : %(query)b, %(text)s, %(candidates)s, %(limit)s,
+    %(dense_weight)s, %(lexical_weight)s, %(rrf_k)s.
+
+    La requête lexicale est en OU (plainto_tsquery avec & remplacés par |) : une requête
+    par mots-clés ne doit pas exiger que tous les termes soient présents.
+    """
+    projection = ",\n            ".join(_qualified(columns, "e"))
+    distance = distance_expression("%(query)b")
+    lexical_filter = where.replace("WHERE ", "AND ", 1)
+    return f"""
+        WITH dense AS (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+            FROM (
+                SELECT id, {distance} AS distance
+                FROM {EMBEDDING_TABLE}
+                {where}
+                ORDER BY {distance}
+                LIMIT %(candidates)s
+            ) nearest
+        ),
+        lexical AS (
+            SELECT id, lexical_score, ROW_NUMBER() OVER (ORDER BY lexical_score DESC) AS rank
+            FROM (
+                SELECT id, ts_rank_cd(document_tsv, q.query) AS lexical_score
+                FROM {EMBEDDING_TABLE},
+                     (SELECT replace(plainto_tsquery('french', %(text)s)::text, '&', '|')::tsquery AS query) q
+                WHERE document_tsv @@ q.query
+                {lexical_filter}
+                ORDER BY lexical_score DESC
+                LIMIT %(candidates)s
+            ) matches
+        ),
+        fused AS (
+            SELECT
+                COALESCE(d.id, l.id) AS id,
+                COALESCE(%(dense_weight)s / (%(rrf_k)s + d.rank), 0)
+                    + COALESCE(%(lexical_weight)s / (%(rrf_k)s + l.rank), 0) AS rrf_score,
+                d.rank AS dense_rank,
+                l.rank AS lexical_rank
+            FROM dense d
+            FULL OUTER JOIN lexical l ON l.id = d.id
+        )
+        SELECT
+            {projection},
+            1 - ({distance}) AS cosine_similarity,
+            f.rrf_score,
+            f.dense_rank,
+            f.lexical_rank
+        FROM fused f
+        JOIN {EMBEDDING_TABLE} e ON e.id = f.id
+        ORDER BY f.rrf_score DESC
+        LIMIT %(limit)s
+    """
+
+
+def hybrid_search_chunks(
+    cursor,
+    query_embedding: np.ndarray,
+    question: str,
+    top_k: int,
+    dense_weight: float = HYBRID_DENSE_WEIGHT,
+    lexical_weight: float = HYBRID_LEXICAL_WEIGHT,
+    probes: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    filters: Optional[SearchFilters] = None,
+    columns: Sequence[str] = SEARCH_COLUMNS,
+) -> List[Dict]:
+    """
+    Recherche hybride dense + lexicale fusionnée par RRF.
+
+    Returns:
+        Lignes de search_chunks + {rrf_score, dense_rank, lexical_rank}
+        (rang None = absent de cette liste de candidats)
+    """
+    where, params = _filter_sql(filters)
+    apply_search_settings(cursor, probes=probes, ef_search=ef_search, iterative=bool(where))
+    cursor.execute(build_hybrid_query(columns, where=where), {
+        "query": query_embedding,
+        "text": _lexical_text(question),
+        "candidates": top_k * 2,
+        "limit": top_k,
+        "dense_weight": dense_weight,
+        "lexical_weight": lexical_weight,
+        "rrf_k": RRF_K,
+        **params,
+    })
+    return cursor.fetchall()
+
+
+def search_documents(
+    query_embedding: np.ndarray,
+    top_k: int,
+    question: str = "",
+    filters: Optional[SearchFilters] = None,
+    mode: str = RETRIEVAL_MODE,
+    columns: Sequence[str] = SEARCH_COLUMNS,
+    shard: Optional[int] = None,
+    statement_timeout: Optional[float] = None,
+) -> List[Dict]:
+    """
+    API de recherche : choisit le chemin selon `mode` et pousse les filtres dans la requête.
+
+    Args:
+        query_embedding: Embedding de la question
+        top_k: Nombre de chunks à retourner
+        question: Texte de la question (requis pour le mode hybrid)
+        filters: Collections / métadonnées / préfixe d'URL (None = tout le corpus)
+        mode: dense | hybrid | quantized | two_stage
+        columns: SEARCH_COLUMNS, ou ID_COLUMNS puis hydrate_chunks (recherche en deux phases)
+        shard: Index dans SHARD_DSNS (None = base principale) ; les lignes portent la clé "shard"
+        statement_timeout: Secondes avant que le serveur n'abandonne la requête (SET LOCAL)
+
+    Returns:
+        Lignes au format de search_chunks
+    """
+    # Connexion PostgreSQL (pgvector) empruntée au pool partagé (ou à celui du shard)
+    with shard_connection(shard) as conn, conn.cursor(row_factory=dict_row) as cursor:
+        if statement_timeout:
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", (f"{int(statement_timeout * 1000)}ms",))
+        if mode == "hybrid":
+            # Dense + lexical (tsvector) fusionnés par RRF en un seul aller-retour
+            rows = hybrid_search_chunks(cursor, query_embedding, question, top_k=top_k, filters=filters, columns=columns)
+        elif mode == "quantized":
+            # Candidats Hamming (embedding_bit) puis rescoring cosinus exact
+            rows = quantized_search_chunks(cursor, query_embedding, top_k=top_k, filters=filters, columns=columns)
+        elif mode == "two_stage":
+            # Candidats via le préfixe Matryoshka (embedding_short) puis vecteur complet
+            rows = two_stage_search_chunks(cursor, query_embedding, top_k=top_k, filters=filters, columns=columns)
+        else:
+            # ORDER BY sur l'opérateur de distance → utilisation de l'index ANN
+            rows = search_chunks(cursor, query_embedding, top_k=top_k, filters=filters, columns=columns)
+
+    if shard is not None:
+        rows = [{**row, "shard": shard} for row in rows]
+
+    with _transfer_lock:
+        _transfer_counters["searches"] += 1
+        _transfer_counters["candidate_rows"] += len(rows)
+        _transfer_counters["candidate_payload_bytes"] += sum(row.get("payload_bytes") or 0 for row in rows)
+    return rows
+
+
+def id_lookup_clause(rows: List[Dict]) -> Tuple[str, Dict]:
+    """
+    WHERE de relecture de lignes par id. Avec leur collection_id, la table partitionnée
+    n'ouvre que les partitions concernées et utilise sa clé primaire (collection_id, id).
+
+    Returns:
+        (clause, paramètres nommés ids / collections)
+    """
+    params = {"ids": [row["id"] for row in rows]}
+    collections = {row.get("collection_id") for row in rows}
+    if None in collections:
+        return "WHERE id = ANY(%(ids)s)", params
+    params["collections"] = sorted(collections)
+    return "WHERE id = ANY(%(ids)s) AND collection_id = ANY(%(collections)s)", params
+
+
+def hydrate_chunks(rows: List[Dict], columns: Sequence[str] = HYDRATE_COLUMNS) -> List[Dict]:
+    """
+    Phase 2 de la recherche en deux phases : charge le contenu des seuls survivants
+    (seuil, diversification) en une requête WHERE id = ANY(...).
+
+    Les lignes qui ont déjà leur contenu (backend mmap) ne sont pas rechargées ;
+    une ligne supprimée entre les deux phases disparaît du résultat.
+
+    Returns:
+        Lignes complétées, dans l'ordre d'entrée
+    """
+    missing = [row for row in rows if "document" not in row]
+    if not missing:
+        return rows
+
+    # Une requête par shard d'origine (une seule sans sharding)
+    projection = ", ".join(columns)
+    contents = {}
+    for shard, shard_rows in group_by_shard(missing).items():
+        where, params = id_lookup_clause(shard_rows)
+        with shard_connection(shard) as conn, conn.cursor(row_factory=dict_row) as cursor:
+            cursor.execute(f"SELECT id, {projection} FROM {EMBEDDING_TABLE} {where}", params)
+            contents.update((record["id"], record) for record in cursor.fetchall())
+
+    hydrated = []
+    for row in rows:
+        if "document" in row:
+            hydrated.append(row)
+        elif row["id"] in contents:
+            hydrated.append({**row, **contents[row["id"]]})
+
+    with _transfer_lock:
+        _transfer_counters["hydrated_rows"] += len(contents)
+        _transfer_counters["hydrated_payload_bytes"] += sum(
+            row.get("payload_bytes") or 0 for row in rows if row["id"] in contents
+        )
+    return hydrated
+
+
+def transfer_stats() -> Dict:
+    """Octets de contenu chargés par la recherche vs ce qu'une recherche en une phase aurait chargé"""
+    with _transfer_lock:
+        stats = dict(_transfer_counters)
+    candidate_bytes = stats["candidate_payload_bytes"]
+    stats["two_phase_enabled"] = ENABLE_TWO_PHASE_RETRIEVAL
+    stats["bytes_saved_ratio"] = (
+        round(1 - stats["hydrated_payload_bytes"] / candidate_bytes, 4) if candidate_bytes else 0.0
+    )
+    return stats
+
+
+def _collect_index_scans(plan: Dict) -> List[str]:
+    """Liste les index utilisés par un plan EXPLAIN (FORMAT JSON)"""
+    found = []
+    if plan.get("Node Type") in ("Index Scan", "Index Only Scan", "Bitmap Index Scan"):
+        found.append(plan.get("Index Name", ""))
+    for child in plan.get("Plans", []):
+        found.extend(_collect_index_scans(child))
+    return found
+
+
+def _collect_table_scans(plan: Dict) -> List[Tuple[str, Optional[str]]]:
+    """Parcours de tables d'un plan EXPLAIN : (table, index), index None pour un scan séquentiel"""
+    node = plan.get("Node Type")
+    if node in ("Index Scan", "Index Only Scan"):
+        return [(plan.get("Relation Name"), plan.get("Index Name"))]
+    if node == "Bitmap Heap Scan":
+        return [(plan.get("Relation Name"), name) for name in _collect_index_scans(plan)]
+    if node == "Seq Scan":
+        return [(plan.get("Relation Name"), None)]
+    found = []
+    for child in plan.get("Plans", []):
+        found.extend(_collect_table_scans(child))
+    return found
+
+
+def _partition_tree(cursor, relation: str) -> List[str]:
+    """Noms d'une table ou d'un index et de ses partitions (lui seul s'il n'est pas partitionné)"""
+    cursor.execute(
+        """
+        SELECT c.relname
+        FROM pg_partition_tree(to_regclass(%s)) AS tree
+        JOIN pg_class AS c ON c.oid = tree.relid
+        """,
+        (relation,)
+    )
+    return [next(iter(row.values())) if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+
+
+def check_index_usage(cursor, dimensions: int = EMBEDDING_DIMENSIONS, index_name: str = VECTOR_INDEX_NAME) -> List[str]:
+    """
+    Vérifie via EXPLAIN que la requête de recherche passe par l'index ANN.
+
+    Le scan séquentiel est désactivé pendant le test : si le planner ne choisit
+    toujours pas l'index, c'est que la forme de la requête l'en empêche.
+
+    Table partitionnée par collection : le plan ne nomme que les index des partitions
+    (noms générés, ou suffixés par migrate-index). Sont acceptés l'index parent et tous
+    les index qui lui sont attachés, et chaque partition parcourue doit en utiliser un.
+
+    Returns:
+        Index utilisés par le plan
+
+    Raises:
+        RuntimeError: Si une partition (ou la table) est parcourue sans l'index ANN
+    """
+    accepted = set(_partition_tree(cursor, index_name))
+    tables = set(_partition_tree(cursor, EMBEDDING_TABLE))
+    probe_vector = np.random.default_rng(0).standard_normal(dimensions).astype(np.float32)
+
+    cursor.execute("SELECT set_config('enable_seqscan', 'off', true)")
+    cursor.execute(
+        "EXPLAIN (FORMAT JSON) " + build_search_query(),
+        {"query": probe_vector, "limit": 20}
+    )
+    explain = cursor.fetchone()
+    explain = explain[0] if not isinstance(explain, dict) else next(iter(explain.values()))
+    if isinstance(explain, str):
+        explain = json.loads(explain)
+
+    plan = explain[0]["Plan"]
+    indexes = _collect_index_scans(plan)
+    scans = [(table, index) for table, index in _collect_table_scans(plan) if table in tables]
+    missed = sorted({table for table, index in scans if index not in accepted})
+    if not scans or missed:
+        raise RuntimeError(
+            f"La recherche vectorielle n'utilise pas l'index {index_name} "
+            f"(index du plan: {indexes or 'aucun'}"
+            f"{f', parcourus sans index ANN: {missed}' if missed else ''}). "
+            f"Vérifier l'ORDER BY et l'opclass de l'index."
+        )
+    return indexes
@@ -0,0 +1,211 @@
+"""
+Banc d'essai des chemins de recherche vectorielle (rappel et latence)
+
+La vérité terrain est une recherche exacte (scan séquentiel, index désactivés) :
+chaque chemin approché est comparé à elle en rappel@k, sur les mêmes requêtes.
+
+Requêtes : questions réelles de la table conversations (encodées via embed_query),
+ou à défaut des embeddings de chunks tirés au hasard.
+
+benchmark_vector_io mesure le coût CPU client du transport des vecteurs (texte vs binaire).
+"""
+
+import json
+import time
+import base64
+from typing import Callable, Dict, List, Sequence, Set, Tuple
+
+import numpy as np
+from psycopg.rows import dict_row
+
+from database.schema import EMBEDDING_DIMENSIONS, EMBEDDING_TABLE
+from tools.retrieval import QUANTIZED_CANDIDATES, quantized_search_chunks, search_chunks
+from tools.vector_io import decode_embedding
+
+
+def _timed(fn: Callable) -> Tuple[object, float]:
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _latency_summary(values: Sequence[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "mean": 0.0}
+    array = np.asarray(values, dtype=np.float64)
+    return {
+        "p50": round(float(np.percentile(array, 50)), 2),
+        "p95": round(float(np.percentile(array, 95)), 2),
+        "mean": round(float(array.mean()), 2),
+    }
+
+
+def recall_at_k(found_ids: Sequence[str], truth_ids: Set[str]) -> float:
+    if not truth_ids:
+        return 1.0
+    return len(set(found_ids) & truth_ids) / len(truth_ids)
+
+
+def sample_query_embeddings(cursor, count: int) -> List[np.ndarray]:
+    """
+    Questions récentes des utilisateurs si disponibles, sinon embeddings de chunks existants
+    """
+    from tools.embeddings import embed_query
+
+    try:
+        cursor.execute(
+            """
+            SELECT question FROM conversations
+            GROUP BY question
+            ORDER BY MAX(created_at) DESC
+            LIMIT %s
+            """,
+            (count,)
+        )
+        questions = [row["question"] for row in cursor.fetchall()]
+    except Exception:
+        cursor.connection.rollback()
+        questions = []
+
+    if questions:
+        return [embed_query(question) for question in questions]
+
+    cursor.execute(
+        f"SELECT embedding FROM {EMBEDDING_TABLE} WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s",
+        (count,)
+    )
+    return [np.asarray(row["embedding"], dtype=np.float32) for row in cursor.fetchall()]
+
+
+def exact_search_ids(cursor, query_embedding: np.ndarray, top_k: int) -> List[str]:
+    """Plus proches voisins exacts (index désactivés pour la transaction courante)"""
+    cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+    cursor.execute(
+        f"SELECT id FROM {EMBEDDING_TABLE} ORDER BY embedding <=> %(query)b::vector LIMIT %(limit)s",
+        {"query": query_embedding, "limit": top_k}
+    )
+    return [row["id"] for row in cursor.fetchall()]
+
+
+def benchmark_quantized_search(
+    conn,
+    query_count: int = 50,
+    top_k: int = 20,
+    candidates: int = QUANTIZED_CANDIDATES,
+) -> Dict:
+    """
+    Compare exact / ANN (chemin actuel) / quantifié binaire + rescoring.
+
+    Chaque recherche s'exécute dans sa propre transaction (réglages SET LOCAL isolés).
+
+    Returns:
+        {queries, top_k, candidates, recall: {ann, quantized}, latency_ms: {exact, ann, quantized}}
+    """
+    with conn.cursor(row_factory=dict_row) as cursor:
+        queries = sample_query_embeddings(cursor, query_count)
+        conn.rollback()
+
+        latencies = {"exact": [], "ann": [], "quantized": []}
+        recalls = {"ann": [], "quantized": []}
+
+        for query_embedding in queries:
+            truth, elapsed = _timed(lambda: exact_search_ids(cursor, query_embedding, top_k))
+            latencies["exact"].append(elapsed)
+            conn.rollback()
+            truth = set(truth)
+
+            rows, elapsed = _timed(lambda: search_chunks(cursor, query_embedding, top_k=top_k))
+            latencies["ann"].append(elapsed)
+            recalls["ann"].append(recall_at_k([row["id"] for row in rows], truth))
+            conn.rollback()
+
+            rows, elapsed = _timed(lambda: quantized_search_chunks(cursor, query_embedding, top_k, candidates))
+            latencies["quantized"].append(elapsed)
+            recalls["quantized"].append(recall_at_k([row["id"] for row in rows], truth))
+            conn.rollback()
+
+    return {
+        "queries": len(queries),
+        "top_k": top_k,
+        "candidates": candidates,
+        "recall": {name: round(float(np.mean(values)), 4) if values else 0.0 for name, values in recalls.items()},
+        "latency_ms": {name: _latency_summary(values) for name, values in latencies.items()},
+    }
+
+
+def _cpu_timed(fn: Callable) -> Tuple[float, float]:
+    """(CPU du processus, temps écoulé) en ms"""
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    fn()
+    return (time.process_time() - cpu_start) * 1000, (time.perf_counter() - wall_start) * 1000
+
+
+def _per_item(cpu_ms: float, wall_ms: float, count: int) -> Dict[str, float]:
+    return {
+        "cpu_us": round(cpu_ms * 1000 / count, 2),
+        "wall_us": round(wall_ms * 1000 / count, 2),
+    }
+
+
+def benchmark_vector_io(conn, samples: int = 200, dimensions: int = EMBEDDING_DIMENSIONS) -> Dict:
+    """
+    Compare le transport texte et binaire des vecteurs, sur des vecteurs aléatoires :
+    - api : décodage d'une réponse embeddings (liste JSON de flottants vs base64 + np.frombuffer)
+    - query : paramètre de requête (littéral '[...]'::vector vs %b binaire), par requête
+    - copy : COPY de chunks dans une table temporaire (FORMAT TEXT vs FORMAT BINARY), par chunk
+
+    Returns:
+        {samples, dimensions, api|query|copy: {text, binary: {cpu_us, wall_us}}}
+    """
+    rng = np.random.default_rng(0)
+    vectors = [rng.standard_normal(dimensions).astype(np.float32) for _ in range(samples)]
+    report = {"samples": samples, "dimensions": dimensions}
+
+    # Réponse API : le SDK reçoit du JSON dans les deux cas, seul le contenu du champ embedding change
+    json_payloads = [json.dumps(vector.tolist()) for vector in vectors]
+    base64_payloads = [json.dumps(base64.b64encode(vector.tobytes()).decode("ascii")) for vector in vectors]
+    report["api"] = {
+        "text": _per_item(*_cpu_timed(
+            lambda: [np.array(json.loads(payload), dtype=np.float32) for payload in json_payloads]
+        ), samples),
+        "binary": _per_item(*_cpu_timed(
+            lambda: [decode_embedding(json.loads(payload)) for payload in base64_payloads]
+        ), samples),
+    }
+
+    with conn.cursor() as cursor:
+        def query_text():
+            for vector in vectors:
+                literal = "[" + ",".join(map(str, vector.tolist())) + "]"
+                cursor.execute("SELECT vector_dims(%s::vector)", (literal,)).fetchone()
+
+        def query_binary():
+            for vector in vectors:
+                cursor.execute("SELECT vector_dims(%b::vector)", (vector,)).fetchone()
+
+        report["query"] = {
+            "text": _per_item(*_cpu_timed(query_text), samples),
+            "binary": _per_item(*_cpu_timed(query_binary), samples),
+        }
+        conn.rollback()
+
+        cursor.execute(f"CREATE TEMP TABLE _bench_vector_io (id TEXT, embedding VECTOR({dimensions})) ON COMMIT DROP")
+
+        def copy_text():
+            with cursor.copy("COPY _bench_vector_io (id, embedding) FROM STDIN") as copy:
+                for i, vector in enumerate(vectors):
+                    copy.write_row((str(i), "[" + ",".join(map(str, vector.tolist())) + "]"))
+
+        def copy_binary():
+            with cursor.copy("COPY _bench_vector_io (id, embedding) FROM STDIN (FORMAT BINARY)") as copy:
+                copy.set_types(["text", "vector"])
+                for i, vector in enumerate(vectors):
+                    copy.write_row((str(i), vector))
+
+        report["copy"] = {
+            "text": _per_item(*_cpu_timed(copy_text), samples),
+            "binary": _per_item(*_cpu_timed(copy_binary), samples),
+        }
+        conn.rollback()
+
+    return report
@@ -0,0 +1,66 @@
+"""
+Recherche scatter-gather sur les shards (SHARD_DSNS, voir database/shards.py)
+
+La question est envoyée à tous les shards en parallèle, chacun renvoyant son propre top-k
+(nécessaire pour que le top-k global soit exact). Les résultats sont fusionnés par score
+brut : même modèle d'embedding et même métrique partout, les scores sont comparables.
+
+Délais : SHARD_TIMEOUT secondes par shard à partir du démarrage de sa recherche, appliqués
+côté client (le résultat d'un shard en retard est ignoré) et côté serveur (statement_timeout,
+la requête est abandonnée). Chaque question a ses propres workers (un par shard) : deux
+questions simultanées ne se mettent pas en file l'une derrière l'autre.
+Un shard lent ou indisponible ne bloque pas la recherche : les résultats partiels des
+autres shards sont renvoyés, avec "partial": true et le statut de chaque shard.
+"""
+
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database.shards import SHARD_DSNS
+from tools.federated import _score, scatter
+from tools.retrieval import RETRIEVAL_MODE, SEARCH_COLUMNS, SearchFilters, search_documents
+
+# Configuration
+SHARD_TIMEOUT = float(os.getenv("SHARD_TIMEOUT", "3"))  # Secondes, par shard
+
+
+def sharded_search(
+    query_embedding: np.ndarray,
+    top_k: int,
+    question: str = "",
+    filters: Optional[SearchFilters] = None,
+    mode: str = RETRIEVAL_MODE,
+    columns: Sequence[str] = SEARCH_COLUMNS,
+    timeout: float = SHARD_TIMEOUT,
+) -> Tuple[List[Dict], Dict]:
+    """
+    Recherche sur tous les shards en parallèle, fusion en un top-k global.
+
+    Returns:
+        (au plus top_k lignes au format de search_documents, avec la clé "shard",
+         rapport {partial, shards: {shard-N: {status, latency_ms, rows}}})
+    """
+    tasks = {
+        f"shard-{shard}": (lambda shard=shard: search_documents(
+            query_embedding, top_k=top_k, question=question, filters=filters, mode=mode,
+            columns=columns, shard=shard, statement_timeout=timeout
+        ))
+        for shard in range(len(SHARD_DSNS))
+    }
+    # Un worker par shard, propre à la question : aucune recherche n'attend celles d'une autre
+    results, report = scatter(tasks, timeout)
+
+    merged, seen = [], set()
+    for rows in results.values():
+        for row in rows:
+            if row["id"] not in seen:
+                seen.add(row["id"])
+                merged.append(row)
+    merged.sort(key=_score, reverse=True)
+
+    return merged[:top_k], {
+        "partial": len(results) < len(tasks),
+        "shards": report,
+    }
@@ -0,0 +1,283 @@
+"""
+Seuil de similarité adaptatif et élagage des candidats avant reranking
+
+Un seuil fixe (0.70) envoie soit trop de candidats au reranking LLM, soit aucun (et l'agent
+repart sur Tavily). Stratégies (THRESHOLD_STRATEGY) :
+- "fixed" : SIMILARITY_THRESHOLD
+- "gap" : coude de la distribution ; si l'écart entre deux similarités consécutives dépasse
+  THRESHOLD_MIN_GAP, seuls les chunks au-dessus de la plus grande cassure sont gardés
+- "zscore" : moyenne + THRESHOLD_ZSCORE écarts-types des similarités de la requête
+- "calibrated" : seuil par collection appris hors ligne (table similarity_thresholds,
+  `python manage.py calibrate-thresholds`), "gap" pour les collections non calibrées
+
+Les seuils sont bornés à [THRESHOLD_FLOOR, THRESHOLD_CEILING]. Si aucun chunk ne passe mais
+que le meilleur dépasse THRESHOLD_FLOOR, les chunks à moins de THRESHOLD_MIN_GAP de lui sont
+gardés (sauvetage) plutôt que de renvoyer l'agent vers la recherche web.
+
+Chaque élagage est comparé au seuil fixe : appels de reranking et replis web évités
+(négatif = ajoutés), par recherche dans la sortie du tool et cumulés sur /metrics.
+
+Calibration : avec ENABLE_SIMILARITY_LOG, chaque candidat reranké est journalisé
+(collection, similarité, score LLM 0-10) dans similarity_log. Le seuil d'une collection est
+le percentile CALIBRATION_PERCENTILE des similarités des chunks jugés pertinents
+(score ≥ CALIBRATION_RELEVANT_SCORE) : au-dessous, le reranker ne retient presque jamais rien.
+"""
+
+import os
+import time
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database.pool import get_connection
+
+# Configuration
+THRESHOLD_STRATEGY = os.getenv("THRESHOLD_STRATEGY", "gap").lower()  # fixed | gap | zscore | calibrated
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.70"))  # Seuil fixe (et référence)
+THRESHOLD_FLOOR = float(os.getenv("THRESHOLD_FLOOR", "0.55"))
+THRESHOLD_CEILING = float(os.getenv("THRESHOLD_CEILING", "0.85"))
+THRESHOLD_MIN_GAP = float(os.getenv("THRESHOLD_MIN_GAP", "0.04"))
+THRESHOLD_ZSCORE = float(os.getenv("THRESHOLD_ZSCORE", "0.5"))
+ENABLE_SIMILARITY_LOG = os.getenv("ENABLE_SIMILARITY_LOG", "false").lower() in ("true", "1", "yes")
+CALIBRATION_PERCENTILE = float(os.getenv("CALIBRATION_PERCENTILE", "10"))
+CALIBRATION_RELEVANT_SCORE = 7  # Score LLM (0-10) à partir duquel un chunk est "pertinent"
+CALIBRATION_MIN_SAMPLES = 50  # Chunks pertinents requis pour calibrer une collection
+CALIBRATED_THRESHOLDS_TTL = 300  # Secondes entre deux lectures de similarity_thresholds
+
+_calibrated: Tuple[float, Dict[str, float]] = (0.0, {})
+_calibrated_lock = threading.Lock()
+_counters_lock = threading.Lock()
+_counters = {
+    "searches": 0,
+    "candidates": 0,
+    "kept": 0,
+    "baseline_kept": 0,
+    "rescued": 0,
+    "rerank_calls_avoided": 0,
+    "web_fallbacks_avoided": 0,
+}
+
+
+def _clamp(value: float) -> float:
+    return float(min(max(value, THRESHOLD_FLOOR), THRESHOLD_CEILING))
+
+
+def gap_threshold(similarities: Sequence[float], min_gap: float = THRESHOLD_MIN_GAP) -> float:
+    """
+    Seuil au coude : similarité juste au-dessus de la plus grande cassure (≥ min_gap)
+    entre deux candidats consécutifs au-dessus du plancher, sinon SIMILARITY_THRESHOLD.
+    """
+    ordered = np.sort(np.asarray(similarities, dtype=np.float64))[::-1]
+    ordered = ordered[ordered >= THRESHOLD_FLOOR]
+    if len(ordered) < 2:
+        return _clamp(SIMILARITY_THRESHOLD)
+    gaps = ordered[:-1] - ordered[1:]
+    cut = int(np.argmax(gaps))
+    if gaps[cut] < min_gap:
+        return _clamp(SIMILARITY_THRESHOLD)
+    return _clamp(ordered[cut])
+
+
+def zscore_threshold(similarities: Sequence[float], z: float = THRESHOLD_ZSCORE) -> float:
+    """Moyenne + z écarts-types des similarités de la requête"""
+    values = np.asarray(similarities, dtype=np.float64)
+    if len(values) < 2:
+        return _clamp(SIMILARITY_THRESHOLD)
+    return _clamp(values.mean() + z * values.std())
+
+
+def adaptive_threshold(similarities: Sequence[float], strategy: str = THRESHOLD_STRATEGY) -> float:
+    """Seuil global d'une requête selon la stratégie (calibrated → gap, voir prune_candidates)"""
+    if strategy == "fixed":
+        return SIMILARITY_THRESHOLD
+    if strategy == "zscore":
+        return zscore_threshold(similarities)
+    return gap_threshold(similarities)
+
+
+def get_calibrated_thresholds() -> Dict[str, float]:
+    """Seuils par collection (similarity_thresholds), relus au plus toutes les CALIBRATED_THRESHOLDS_TTL s"""
+    global _calibrated
+
+    loaded_at, thresholds = _calibrated
+    if time.time() - loaded_at < CALIBRATED_THRESHOLDS_TTL:
+        return thresholds
+
+    with _calibrated_lock:
+        loaded_at, thresholds = _calibrated
+        if time.time() - loaded_at < CALIBRATED_THRESHOLDS_TTL:
+            return thresholds
+        try:
+            with get_connection() as conn:
+                rows = conn.execute("SELECT collection_id, threshold FROM similarity_thresholds").fetchall()
+            thresholds = {collection: _clamp(threshold) for collection, threshold in rows}
+        except Exception as e:
+            print(f"⚠️ Seuils calibrés indisponibles ({e}), stratégie gap")
+            thresholds = {}
+        _calibrated = (time.time(), thresholds)
+    return thresholds
+
+
+def prune_candidates(
+    rows: List[Dict],
+    strategy: str = THRESHOLD_STRATEGY,
+    keep: Optional[Callable[[Dict], bool]] = None,
+    rerank_above: Optional[int] = None,
+    rerank_cap: Optional[int] = None,
+) -> Tuple[List[Dict], Dict]:
+    """
+    Élague les candidats sous le seuil (par collection en mode calibrated).
+
+    Args:
+        rows: Lignes de recherche (cosine_similarity, collection_id)
+        keep: Prédicat de conservation inconditionnelle (ex: bons rangs lexicaux en hybride)
+        rerank_above: Le reranking LLM n'a lieu qu'au-delà de ce nombre de candidats (None = désactivé)
+        rerank_cap: Candidats max transmis au reranking (MMR), pour comparer au seuil fixe
+
+    Returns:
+        (lignes gardées, rapport {strategy, threshold, thresholds, kept, baseline_kept,
+         rescued, rerank_calls_avoided, web_fallbacks_avoided})
+    """
+    keep = keep or (lambda row: False)
+    similarities = [row["cosine_similarity"] for row in rows]
+    threshold = adaptive_threshold(similarities, strategy)
+
+    thresholds = {}
+    if strategy == "calibrated":
+        calibrated = get_calibrated_thresholds()
+        thresholds = {
+            row.get("collection_id"): calibrated[row.get("collection_id")]
+            for row in rows if row.get("collection_id") in calibrated
+        }
+
+    def passes(row: Dict) -> bool:
+        return row["cosine_similarity"] >= thresholds.get(row.get("collection_id"), threshold) or keep(row)
+
+    kept = [row for row in rows if passes(row)]
+    rescued = False
+    if not kept and similarities and max(similarities) >= THRESHOLD_FLOOR:
+        # Sauvetage : meilleurs chunks proches les uns des autres plutôt qu'un repli web
+        floor = max(THRESHOLD_FLOOR, max(similarities) - THRESHOLD_MIN_GAP)
+        kept = [row for row in rows if row["cosine_similarity"] >= floor]
+        rescued = True
+
+    baseline_kept = sum(1 for row in rows if row["cosine_similarity"] >= SIMILARITY_THRESHOLD or keep(row))
+
+    def reranks(count: int) -> int:
+        if rerank_above is None:
+            return 0
+        count = min(count, rerank_cap) if rerank_cap else count
+        return 1 if count > rerank_above else 0
+
+    report = {
+        "strategy": strategy,
+        "threshold": round(min([threshold, *thresholds.values()]), 4),
+        "thresholds": {collection: round(value, 4) for collection, value in thresholds.items()},
+        "candidates": len(rows),
+        "kept": len(kept),
+        "baseline_threshold": SIMILARITY_THRESHOLD,
+        "baseline_kept": baseline_kept,
+        "rescued": rescued,
+        "rerank_calls_avoided": reranks(baseline_kept) - reranks(len(kept)),
+        "web_fallbacks_avoided": int(baseline_kept == 0) - int(len(kept) == 0),
+    }
+
+    with _counters_lock:
+        _counters["searches"] += 1
+        _counters["candidates"] += len(rows)
+        _counters["kept"] += len(kept)
+        _counters["baseline_kept"] += baseline_kept
+        _counters["rescued"] += int(rescued)
+        _counters["rerank_calls_avoided"] += report["rerank_calls_avoided"]
+        _counters["web_fallbacks_avoided"] += report["web_fallbacks_avoided"]
+
+    return kept, report
+
+
+def pruning_stats() -> Dict:
+    """Compteurs cumulés de l'élagage (exposés sur /metrics)"""
+    with _counters_lock:
+        return {**_counters, "strategy": THRESHOLD_STRATEGY}
+
+
+def log_similarities(documents: List[Dict]) -> None:
+    """
+    Journalise les candidats rerankés (collection, similarité, score LLM) pour la calibration.
+    Une seule instruction ; une erreur n'interrompt jamais la recherche.
+    """
+    # Scores du LLM seulement : le score local de la cascade ne juge pas la pertinence
+    scored = [doc for doc in documents if doc.get("rerank_stage") == "llm"]
+    if not ENABLE_SIMILARITY_LOG or not scored:
+        return
+    try:
+        with get_connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO similarity_log (collection_id, similarity, rerank_score)
+                SELECT * FROM unnest(%s::text[], %s::real[], %s::real[])
+                """,
+                (
+                    [doc["metadata"].get("collection") for doc in scored],
+                    [doc["similarity_score"] for doc in scored],
+                    [doc["rerank_score"] for doc in scored],
+                )
+            )
+    except Exception as e:
+        print(f"⚠️ Journal des similarités indisponible: {e}")
+
+
+def calibrate_thresholds(
+    percentile: float = CALIBRATION_PERCENTILE,
+    min_samples: int = CALIBRATION_MIN_SAMPLES,
+    days: int = 30,
+) -> List[Dict]:
+    """
+    Recalcule similarity_thresholds à partir de similarity_log (derniers `days` jours).
+
+    Returns:
+        Une entrée par collection : {collection_id, threshold, relevant, total, calibrated}
+        (calibrated False = moins de `min_samples` chunks pertinents, seuil non enregistré)
+    """
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT
+                collection_id,
+                percentile_cont(%(fraction)s) WITHIN GROUP (ORDER BY similarity)
+                    FILTER (WHERE rerank_score >= %(relevant)s) AS threshold,
+                COUNT(*) FILTER (WHERE rerank_score >= %(relevant)s) AS relevant,
+                COUNT(*) AS total
+            FROM similarity_log
+            WHERE created_at > NOW() - make_interval(days => %(days)s)
+              AND collection_id IS NOT NULL
+            GROUP BY collection_id
+            ORDER BY collection_id
+            """,
+            {"fraction": percentile / 100, "relevant": CALIBRATION_RELEVANT_SCORE, "days": days}
+        ).fetchall()
+
+        report = []
+        for collection, threshold, relevant, total in rows:
+            calibrated = threshold is not None and relevant >= min_samples
+            if calibrated:
+                threshold = _clamp(threshold)
+                conn.execute(
+                    """
+                    INSERT INTO similarity_thresholds (collection_id, threshold, samples, updated_at)
+                    VALUES (%s, %s, %s, NOW())
+                    ON CONFLICT (collection_id) DO UPDATE
+                    SET threshold = EXCLUDED.threshold,
+                        samples = EXCLUDED.samples,
+                        updated_at = NOW()
+                    """,
+                    (collection, threshold, relevant)
+                )
+            report.append({
+                "collection_id": collection,
+                "threshold": round(float(threshold), 4) if threshold is not None else None,
+                "relevant": relevant,
+                "total": total,
+                "calibrated": calibrated,
+            })
+    return report
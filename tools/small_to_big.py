@@ -0,0 +1,227 @@
+"""
+Chunks hiérarchiques "small-to-big"
+
+Les chunks de 4000 caractères donnent des embeddings grossiers et envoient de gros blocs
+au reranker et à l'agent. Avec ENABLE_SMALL_TO_BIG, l'ingestion :
+- garde le découpage 4000/800 comme sections parentes (table langchain_pg_parent, sans embedding)
+- découpe chaque parent en enfants d'environ CHILD_CHUNK_SIZE caractères, seuls embeddés et recherchés
+  (cmetadata : parent_id, parent_index, chunk_index = rang de l'enfant dans le document)
+
+À la recherche (SMALL_TO_BIG_MODE) :
+- "parent" : les enfants trouvés sont remplacés par leurs parents dédupliqués (une requête)
+- "window" : chaque chunk trouvé est élargi aux chunk_index voisins (± SMALL_TO_BIG_WINDOW) de la
+  même source, en une requête ; fonctionne aussi sur les données ingérées sans parents
+- "off" : chunks renvoyés tels quels
+"""
+
+import os
+import json
+from uuid import uuid4
+from typing import Dict, List, Tuple
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from psycopg.rows import dict_row
+
+from database.shards import group_by_shard, shard_connection
+from database.schema import EMBEDDING_TABLE, PARENT_TABLE
+
+# Configuration
+ENABLE_SMALL_TO_BIG = os.getenv("ENABLE_SMALL_TO_BIG", "false").lower() in ("true", "1", "yes")
+CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", "500"))
+CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", "100"))
+SMALL_TO_BIG_MODE = os.getenv("SMALL_TO_BIG_MODE", "off").lower()  # off | parent | window
+SMALL_TO_BIG_WINDOW = int(os.getenv("SMALL_TO_BIG_WINDOW", "1"))
+
+# Champs de cmetadata identifiant le document source d'un chunk
+SOURCE_KEYS = ("url", "filename")
+
+
+def split_parent_child(documents: List[Document]) -> Tuple[List[Tuple[str, Document]], List[Document]]:
+    """
+    Découpe les chunks parents en enfants.
+
+    Args:
+        documents: Chunks parents (métadonnées chunk_index/chunk_count du découpage 4000/800)
+
+    Returns:
+        (parents [(parent_id, document)], enfants à embedder)
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHILD_CHUNK_SIZE,
+        chunk_overlap=CHILD_CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ".", " ", ""],
+        length_function=len
+    )
+
+    parents, children = [], []
+    for parent in documents:
+        parent_id = str(uuid4())
+        parents.append((parent_id, parent))
+        for text in splitter.split_text(parent.page_content):
+            children.append(Document(
+                page_content=text,
+                metadata={
+                    **parent.metadata,
+                    "parent_id": parent_id,
+                    "parent_index": parent.metadata.get("chunk_index", 0),
+                    "chunk_size": len(text),
+                }
+            ))
+
+    # chunk_index = rang de l'enfant dans le document (fenêtres de voisins)
+    for child_index, child in enumerate(children):
+        child.metadata["chunk_index"] = child_index
+        child.metadata["chunk_count"] = len(children)
+
+    return parents, children
+
+
+async def store_parents(cursor, collection: str, parents: List[Tuple[str, Document]]) -> None:
+    """Insère les sections parentes (curseur async de l'ingestion, même transaction que les enfants)"""
+    for parent_id, parent in parents:
+        await cursor.execute(
+            f"""
+            INSERT INTO {PARENT_TABLE} (id, collection_id, document, cmetadata)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (id) DO UPDATE
+            SET document = EXCLUDED.document,
+                cmetadata = EXCLUDED.cmetadata,
+                updated_at = NOW()
+            """,
+            (parent_id, collection, parent.page_content, json.dumps(parent.metadata))
+        )
+
+
+def _expand_to_parents(cursor, rows: List[Dict]) -> List[Dict]:
+    parent_ids = list(dict.fromkeys(
+        (row.get("cmetadata") or {}).get("parent_id") for row in rows
+        if (row.get("cmetadata") or {}).get("parent_id")
+    ))
+    if not parent_ids:
+        return rows
+
+    cursor.execute(
+        f"SELECT id, document, cmetadata FROM {PARENT_TABLE} WHERE id = ANY(%s)",
+        (parent_ids,)
+    )
+    parents = {parent["id"]: parent for parent in cursor.fetchall()}
+
+    expanded, seen = [], {}
+    for row in rows:
+        parent_id = (row.get("cmetadata") or {}).get("parent_id")
+        parent = parents.get(parent_id)
+        if parent is None:
+            expanded.append(row)
+            continue
+        if parent_id in seen:
+            # Parent déjà présent via un enfant mieux classé
+            seen[parent_id]["matched_children"] += 1
+            continue
+        merged = {
+            **row,
+            "id": parent_id,
+            "document": parent["document"],
+            "cmetadata": parent["cmetadata"],
+            "matched_children": 1,
+        }
+        seen[parent_id] = merged
+        expanded.append(merged)
+    return expanded
+
+
+def _source_filter(row: Dict):
+    meta = row.get("cmetadata") or {}
+    for key in SOURCE_KEYS:
+        if meta.get(key):
+            return {key: meta[key]}
+    return None
+
+
+def _expand_to_windows(cursor, rows: List[Dict], window: int) -> List[Dict]:
+    hits = []  # (position dans rows, source, chunk_index)
+    for position, row in enumerate(rows):
+        source = _source_filter(row)
+        if source is not None:
+            hits.append((position, source, int((row.get("cmetadata") or {}).get("chunk_index", 0))))
+    if not hits:
+        return rows
+
+    # Un seul aller-retour : les fenêtres de tous les hits sont passées en tableaux
+    cursor.execute(
+        f"""
+        SELECT DISTINCT ON (h.hit, (e.cmetadata->>'chunk_index')::int)
+            h.hit,
+            (e.cmetadata->>'chunk_index')::int AS chunk_index,
+            e.document
+        FROM unnest(%(collections)s::text[], %(sources)s::jsonb[], %(lows)s::int[], %(highs)s::int[])
+            WITH ORDINALITY AS h(collection_id, source, low, high, hit)
+        JOIN {EMBEDDING_TABLE} e
+            ON e.collection_id = h.collection_id
+            AND e.cmetadata @> h.source
+            AND (e.cmetadata->>'chunk_index')::int BETWEEN h.low AND h.high
+        ORDER BY h.hit, (e.cmetadata->>'chunk_index')::int, e.updated_at DESC
+        """,
+        {
+            "collections": [rows[position].get("collection_id") for position, _, _ in hits],
+            "sources": [json.dumps(source) for _, source, _ in hits],
+            "lows": [chunk_index - window for _, _, chunk_index in hits],
+            "highs": [chunk_index + window for _, _, chunk_index in hits],
+        }
+    )
+    windows: Dict[int, List[Tuple[int, str]]] = {}
+    for record in cursor.fetchall():
+        windows.setdefault(record["hit"], []).append((record["chunk_index"], record["document"]))
+
+    expanded, covered = [], set()
+    hit_by_position = {position: (hit_number, source, chunk_index)
+                       for hit_number, (position, source, chunk_index) in enumerate(hits, start=1)}
+    for position, row in enumerate(rows):
+        if position not in hit_by_position:
+            expanded.append(row)
+            continue
+        hit_number, source, chunk_index = hit_by_position[position]
+        source_key = json.dumps(source, sort_keys=True)
+        if (row.get("collection_id"), source_key, chunk_index) in covered:
+            # Déjà inclus dans la fenêtre d'un chunk mieux classé
+            continue
+        chunks = sorted(windows.get(hit_number, []))
+        if not chunks:
+            expanded.append(row)
+            continue
+        for neighbour_index, _ in chunks:
+            covered.add((row.get("collection_id"), source_key, neighbour_index))
+        expanded.append({
+            **row,
+            "document": "\n".join(text for _, text in chunks),
+            "window": [chunks[0][0], chunks[-1][0]],
+        })
+    return expanded
+
+
+def expand_small_to_big(rows: List[Dict], mode: str = SMALL_TO_BIG_MODE, window: int = SMALL_TO_BIG_WINDOW) -> List[Dict]:
+    """
+    Remplace les chunks trouvés par leur contexte (parents ou fenêtres de voisins),
+    dédupliqué et dans l'ordre de classement d'origine.
+
+    Returns:
+        Lignes au format de search_chunks (document élargi)
+    """
+    if mode not in ("parent", "window") or not rows:
+        return rows
+
+    # Parents et voisins sont sur le shard du chunk trouvé : une requête par shard,
+    # puis remise dans l'ordre de classement d'origine
+    ranked = [{**row, "_rank": rank} for rank, row in enumerate(rows)]
+    expanded = []
+    for shard, shard_rows in group_by_shard(ranked).items():
+        with shard_connection(shard) as conn, conn.cursor(row_factory=dict_row) as cursor:
+            if mode == "parent":
+                expanded.extend(_expand_to_parents(cursor, shard_rows))
+            else:
+                expanded.extend(_expand_to_windows(cursor, shard_rows, window))
+
+    expanded.sort(key=lambda row: row["_rank"])
+    for row in expanded:
+        row.pop("_rank", None)
+    return expanded
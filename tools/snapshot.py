@@ -0,0 +1,415 @@
+"""
+Instantanés compacts de la base vectorielle (démarrage rapide d'un nouvel environnement)
+
+Recrawler via /vectorize repaie chaque embedding : `manage.py export-snapshot` écrit
+langchain_pg_embedding (et les sections parentes small-to-big) dans une archive NPZ
+en colonnes, et `manage.py import-snapshot` la recharge dans une base neuve.
+
+Contenu de l'archive (entrées .npy, lisibles par np.load) :
+- manifest : JSON (version, lignes, dimensions, dtype, modèle d'embedding, collections)
+- vectors : matrice (n, dimensions) float16 (défaut, moitié de la taille) ou float32
+- ids / documents / cmetadata : colonnes de longueur variable, octets UTF-8 concaténés
+  (<nom>.data) et offsets int64 (<nom>.offsets, n + 1 valeurs)
+- collection_codes : int32, indice dans manifest["collections"]
+- parent_* : mêmes colonnes pour langchain_pg_parent (sans vecteurs)
+
+Mémoire constante dans les deux sens : l'export parcourt la table par un curseur serveur
+(les colonnes texte transitent par des fichiers temporaires), l'import relit chaque entrée
+par blocs. Les vecteurs sont stockés bruts (non compressés), le texte est compressé.
+
+L'import charge une table intermédiaire par COPY binaire, sans index ni clé primaire mais
+avec toutes ses colonnes (embedding_bit compris : aucun ALTER ne réécrit la table après
+chargement), crée la clé primaire et les index après chargement (HNSW, ivfflat dimensionné
+sur les lignes chargées), puis l'échange avec la table cible. Réservé à une base vide : la table cible doit être absente ou vide.
+embedding_short est recalculé depuis le vecteur importé, updated_at vaut la date d'import.
+"""
+
+import os
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+
+from database.schema import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_TABLE,
+    ENABLE_COLLECTION_PARTITIONING,
+    INDEX_BUILD_MAINTENANCE_WORK_MEM,
+    PARENT_TABLE,
+    PARENT_TABLE_STATEMENT,
+    POSTGRES_CONNECTION_STRING,
+    SHORT_INDEX_NAME,
+    UNASSIGNED_COLLECTION,
+    VECTOR_INDEX_TYPE,
+    embedding_schema_statements,
+    embedding_table_statements,
+    index_definition,
+    partition_statement,
+    primary_key_statement,
+    secondary_index_statements,
+    short_index_definition,
+    swap_embedding_table,
+)
+from tools.embeddings import EMBEDDING_MODEL, matryoshka_prefix
+
+# Configuration
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DTYPES = ("float16", "float32")
+SNAPSHOT_BATCH_SIZE = 2000  # Lignes lues par aller-retour du curseur serveur / écrites par bloc
+IMPORT_TABLE = f"{EMBEDDING_TABLE}_import"
+
+MANIFEST_ENTRY = "manifest"
+TEXT_COLUMNS = ("ids", "documents", "cmetadata")
+
+
+class _BlobColumn:
+    """Colonne de longueur variable en cours d'export : octets concaténés + offsets, sur disque"""
+
+    def __init__(self, workdir: str, name: str):
+        self.name = name
+        self.data = open(os.path.join(workdir, f"{name}.data"), "w+b")
+        self.offsets = open(os.path.join(workdir, f"{name}.offsets"), "w+b")
+        self.offsets.write(np.zeros(1, dtype="<i8").tobytes())
+        self.size = 0
+        self.count = 0
+
+    def extend(self, values: Sequence[bytes]) -> None:
+        lengths = np.fromiter((len(value) for value in values), dtype=np.int64, count=len(values))
+        self.offsets.write((self.size + np.cumsum(lengths)).astype("<i8").tobytes())
+        self.data.write(b"".join(values))
+        self.size += int(lengths.sum())
+        self.count += len(values)
+
+    def write_to(self, archive: zipfile.ZipFile) -> None:
+        for suffix, handle, dtype, shape in (
+            ("data", self.data, "u1", (self.size,)),
+            ("offsets", self.offsets, "<i8", (self.count + 1,)),
+        ):
+            handle.flush()
+            handle.seek(0)
+            _write_entry(archive, f"{self.name}.{suffix}", dtype, shape, iter(lambda h=handle: h.read(1 << 20), b""))
+            handle.close()
+
+
+def _write_entry(archive: zipfile.ZipFile, name: str, dtype: str, shape: tuple, chunks, compress: bool = True) -> None:
+    """Écrit une entrée .npy par morceaux (en-tête connu d'avance : forme et dtype)"""
+    info = zipfile.ZipInfo(f"{name}.npy", date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with archive.open(info, "w", force_zip64=True) as f:
+        np.lib.format.write_array_header_2_0(f, {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": shape,
+        })
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def _open_entry(archive: zipfile.ZipFile, name: str):
+    """Ouvre une entrée .npy en lecture séquentielle : (fichier positionné après l'en-tête, forme, dtype)"""
+    f = archive.open(f"{name}.npy")
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return f, shape, dtype
+
+
+def _read_rows(f, dtype: np.dtype, count: int, row_shape: tuple = ()) -> np.ndarray:
+    items = count * int(np.prod(row_shape, dtype=np.int64)) if row_shape else count
+    array = np.frombuffer(f.read(items * dtype.itemsize), dtype=dtype)
+    return array.reshape((-1, *row_shape)) if row_shape else array
+
+
+class _BlobReader:
+    """Lecture par blocs d'une colonne de longueur variable (offsets et données en parallèle)"""
+
+    def __init__(self, archive: zipfile.ZipFile, name: str):
+        self.data, _, _ = _open_entry(archive, f"{name}.data")
+        self.offsets, _, self.dtype = _open_entry(archive, f"{name}.offsets")
+        self.position = int(_read_rows(self.offsets, self.dtype, 1)[0])
+
+    def read(self, count: int) -> List[bytes]:
+        ends = _read_rows(self.offsets, self.dtype, count)
+        block = self.data.read(int(ends[-1]) - self.position) if len(ends) else b""
+        starts = np.concatenate([[self.position], ends[:-1]]) - self.position
+        values = [block[start:end] for start, end in zip(starts, ends - self.position)]
+        if len(ends):
+            self.position = int(ends[-1])
+        return values
+
+    def close(self) -> None:
+        self.data.close()
+        self.offsets.close()
+
+
+def _connect(**kwargs):
+    conn = psycopg.connect(POSTGRES_CONNECTION_STRING, **kwargs)
+    register_vector(conn)
+    return conn
+
+
+def _export_table(conn, archive, workdir: str, table: str, prefix: str, dtype: Optional[str], batch_size: int) -> Dict:
+    """
+    Exporte une table (embeddings si dtype, sinon sections parentes) par un curseur serveur.
+
+    Returns:
+        {"rows", "collections"}
+    """
+    with_vectors = dtype is not None
+    where = "WHERE embedding IS NOT NULL" if with_vectors else ""
+    count = conn.execute(f"SELECT COUNT(*) FROM {table} {where}").fetchone()[0]
+
+    columns = {name: _BlobColumn(workdir, f"{prefix}{name}") for name in TEXT_COLUMNS}
+    codes_path = os.path.join(workdir, f"{prefix}collection_codes")
+    collections: Dict[Optional[str], int] = {}
+    position = 0
+
+    def stream_rows() -> Iterator[bytes]:
+        nonlocal position
+        projection = "id, collection_id, document, cmetadata" + (", embedding" if with_vectors else "")
+        with open(codes_path, "wb") as codes, conn.cursor(name=f"snapshot_{prefix or 'chunks'}") as cursor:
+            cursor.execute(f"SELECT {projection} FROM {table} {where}")
+            while position < count:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                # Instantané REPEATABLE READ : le COUNT borne le parcours
+                rows = rows[:count - position]
+
+                columns["ids"].extend([row[0].encode("utf-8") for row in rows])
+                columns["documents"].extend([(row[2] or "").encode("utf-8") for row in rows])
+                columns["cmetadata"].extend([
+                    json.dumps(row[3] or {}, ensure_ascii=False).encode("utf-8") for row in rows
+                ])
+                codes.write(np.fromiter(
+                    (collections.setdefault(row[1], len(collections)) for row in rows), dtype="<i4", count=len(rows)
+                ).tobytes())
+                position += len(rows)
+
+                if with_vectors:
+                    yield np.stack([np.asarray(row[4], dtype=np.float32) for row in rows]).astype(dtype).tobytes()
+
+    if with_vectors:
+        # Vecteurs écrits au fil du parcours (seule entrée ouverte pendant le curseur)
+        _write_entry(archive, "vectors", dtype, (count, EMBEDDING_DIMENSIONS), stream_rows(), compress=False)
+    else:
+        for _ in stream_rows():
+            pass
+
+    for column in columns.values():
+        column.write_to(archive)
+    with open(codes_path, "rb") as codes:
+        _write_entry(archive, f"{prefix}collection_codes", "<i4", (position,), iter(lambda: codes.read(1 << 20), b""))
+
+    if position != count:
+        raise RuntimeError(f"{table}: {position} lignes lues au lieu de {count}")
+    return {"rows": position, "collections": list(collections)}
+
+
+def export_snapshot(path: str, dtype: str = "float16", batch_size: int = SNAPSHOT_BATCH_SIZE) -> Dict:
+    """
+    Exporte langchain_pg_embedding et langchain_pg_parent dans une archive NPZ,
+    depuis un instantané cohérent (transaction REPEATABLE READ).
+
+    Args:
+        path: Fichier .npz écrit (d'abord sous <path>.tmp, renommé à la fin)
+        dtype: Précision des vecteurs stockés ("float16" ou "float32")
+        batch_size: Lignes par aller-retour du curseur serveur
+
+    Returns:
+        Manifest de l'instantané
+    """
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"dtype invalide: {dtype} (attendu: {', '.join(SNAPSHOT_DTYPES)})")
+
+    tmp_path = f"{path}.tmp"
+    workdir = tempfile.mkdtemp(prefix="dagan-snapshot-")
+    try:
+        with _connect() as conn, conn.transaction(), zipfile.ZipFile(tmp_path, "w", allowZip64=True) as archive:
+            conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            dimensions = conn.execute(
+                f"SELECT vector_dims(embedding) FROM {EMBEDDING_TABLE} WHERE embedding IS NOT NULL LIMIT 1"
+            ).fetchone()
+            if dimensions and dimensions[0] != EMBEDDING_DIMENSIONS:
+                raise RuntimeError(f"Embeddings de {dimensions[0]} dimensions, EMBEDDING_DIMENSIONS={EMBEDDING_DIMENSIONS}")
+            has_parents = conn.execute("SELECT to_regclass(%s) IS NOT NULL", (PARENT_TABLE,)).fetchone()[0]
+            short_index = conn.execute("SELECT to_regclass(%s) IS NOT NULL", (SHORT_INDEX_NAME,)).fetchone()[0]
+
+            chunks = _export_table(conn, archive, workdir, EMBEDDING_TABLE, "", dtype, batch_size)
+            print(f"   {chunks['rows']} chunks exportés")
+            parents = {"rows": 0, "collections": []}
+            if has_parents:
+                parents = _export_table(conn, archive, workdir, PARENT_TABLE, "parent_", None, batch_size)
+                print(f"   {parents['rows']} sections parentes exportées")
+
+            manifest = {
+                "version": SNAPSHOT_VERSION,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "embedding_model": EMBEDDING_MODEL,
+                "dimensions": EMBEDDING_DIMENSIONS,
+                "dtype": dtype,
+                "rows": chunks["rows"],
+                "collections": chunks["collections"],
+                "parent_rows": parents["rows"],
+                "parent_collections": parents["collections"],
+                "short_index": short_index,
+            }
+            encoded = json.dumps(manifest, ensure_ascii=False)
+            _write_entry(archive, MANIFEST_ENTRY, f"<U{max(1, len(encoded))}", (), [encoded.encode("utf-32-le")])
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    print(f"✓ Instantané écrit: {path} ({manifest['rows']} chunks, {dtype}, {size_mb:.1f} Mo)")
+    return manifest
+
+
+def read_manifest(path: str) -> Dict:
+    """Manifest d'un instantané (sans lire les données)"""
+    with zipfile.ZipFile(path) as archive, archive.open(f"{MANIFEST_ENTRY}.npy") as f:
+        return json.loads(str(np.load(f)))
+
+
+def _check_empty(cursor, table: str, drop: bool = True) -> None:
+    """Refuse l'import si `table` a des lignes ; la supprime si elle est vide (créée par un démarrage de l'API)"""
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+    if not cursor.fetchone()[0]:
+        return
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+    if cursor.fetchone()[0]:
+        raise RuntimeError(f"{table} contient déjà des lignes : import réservé à une base vide")
+    if drop:
+        cursor.execute(f"DROP TABLE {table}")
+
+
+def _import_table(cursor, archive, prefix: str, table: str, rows: int, collections: List[str], batch_size: int) -> int:
+    """COPY binaire d'une table de l'instantané (embeddings si prefix vide)"""
+    with_vectors = not prefix
+    readers = {name: _BlobReader(archive, f"{prefix}{name}") for name in TEXT_COLUMNS}
+    codes, _, codes_dtype = _open_entry(archive, f"{prefix}collection_codes")
+    vectors = None
+    if with_vectors:
+        vectors, _, vectors_dtype = _open_entry(archive, "vectors")
+
+    if with_vectors:
+        columns, types = "id, collection_id, embedding, embedding_short, document, cmetadata", \
+            ["text", "text", "vector", "vector", "text", "jsonb"]
+    else:
+        columns, types = "id, collection_id, document, cmetadata", ["text", "text", "text", "jsonb"]
+
+    loaded = 0
+    try:
+        with cursor.copy(f"COPY {table} ({columns}) FROM STDIN (FORMAT BINARY)") as copy:
+            copy.set_types(types)
+            while loaded < rows:
+                count = min(batch_size, rows - loaded)
+                ids = readers["ids"].read(count)
+                documents = readers["documents"].read(count)
+                metadata = readers["cmetadata"].read(count)
+                collection_ids = [collections[code] for code in _read_rows(codes, codes_dtype, count)]
+                block = None
+                if with_vectors:
+                    block = _read_rows(vectors, vectors_dtype, count, (EMBEDDING_DIMENSIONS,)).astype(np.float32)
+
+                for i in range(count):
+                    values = [ids[i].decode("utf-8"), collection_ids[i]]
+                    if with_vectors:
+                        values += [block[i], matryoshka_prefix(block[i])]
+                    values += [documents[i].decode("utf-8"), json.loads(metadata[i])]
+                    copy.write_row(values)
+                loaded += count
+                print(f"   {loaded}/{rows} lignes chargées ({table})")
+    finally:
+        for reader in readers.values():
+            reader.close()
+        codes.close()
+        if vectors is not None:
+            vectors.close()
+    return loaded
+
+
+def import_snapshot(path: str, batch_size: int = SNAPSHOT_BATCH_SIZE) -> Dict:
+    """
+    Charge un instantané dans une base vide :
+    1. Table intermédiaire complète, sans index ni clé primaire (partitionnée si ENABLE_COLLECTION_PARTITIONING)
+    2. COPY binaire par blocs (embedding_short recalculé)
+    3. Clé primaire et index créés après chargement
+    4. Échange avec la table cible dans une transaction courte
+
+    Returns:
+        Manifest de l'instantané
+    """
+    manifest = read_manifest(path)
+    if manifest["version"] > SNAPSHOT_VERSION:
+        raise RuntimeError(f"Version d'instantané {manifest['version']} non supportée (max {SNAPSHOT_VERSION})")
+    if manifest["dimensions"] != EMBEDDING_DIMENSIONS:
+        raise RuntimeError(
+            f"Instantané en {manifest['dimensions']} dimensions, EMBEDDING_DIMENSIONS={EMBEDDING_DIMENSIONS}"
+        )
+    if manifest["embedding_model"] != EMBEDDING_MODEL:
+        print(f"⚠️  Instantané produit avec {manifest['embedding_model']}, EMBEDDING_MODEL={EMBEDDING_MODEL}")
+
+    partitioned = ENABLE_COLLECTION_PARTITIONING
+    collections = manifest["collections"]
+    if partitioned:
+        # Clé de partition non nulle (même convention que partition-table)
+        collections = [collection if collection is not None else UNASSIGNED_COLLECTION for collection in collections]
+
+    with _connect(autocommit=True) as conn, conn.cursor() as cursor, zipfile.ZipFile(path) as archive:
+        _check_empty(cursor, EMBEDDING_TABLE)
+        _check_empty(cursor, PARENT_TABLE, drop=False)
+
+        # Reste d'un import interrompu
+        cursor.execute(f"DROP TABLE IF EXISTS {IMPORT_TABLE} CASCADE")
+        for statement in embedding_table_statements(IMPORT_TABLE, partitioned=partitioned, primary_key=False):
+            cursor.execute(statement)
+        if partitioned:
+            for collection in set(collections):
+                cursor.execute(partition_statement(collection, table=IMPORT_TABLE))
+        cursor.execute(PARENT_TABLE_STATEMENT)
+
+        print(f"→ Chargement de {manifest['rows']} chunks ({manifest['dtype']})...")
+        with conn.transaction():
+            _import_table(cursor, archive, "", IMPORT_TABLE, manifest["rows"], collections, batch_size)
+            if manifest["parent_rows"]:
+                _import_table(
+                    cursor, archive, "parent_", PARENT_TABLE,
+                    manifest["parent_rows"], manifest["parent_collections"], batch_size
+                )
+
+        print("🔨 Création des index après chargement...")
+        cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", (INDEX_BUILD_MAINTENANCE_WORK_MEM,))
+        cursor.execute(primary_key_statement(IMPORT_TABLE, partitioned))
+        for statement in [
+            *embedding_schema_statements(IMPORT_TABLE, partitioned=partitioned),
+            *secondary_index_statements(IMPORT_TABLE),
+        ]:
+            cursor.execute(statement)
+        if VECTOR_INDEX_TYPE == "ivfflat":
+            cursor.execute(index_definition(
+                index_name=f"{IMPORT_TABLE}_embedding_idx", row_count=manifest["rows"], table=IMPORT_TABLE
+            ))
+        if manifest.get("short_index"):
+            cursor.execute(short_index_definition(f"{IMPORT_TABLE}_embedding_short_idx", IMPORT_TABLE))
+        cursor.execute(f"ANALYZE {IMPORT_TABLE}")
+
+        with conn.transaction():
+            cursor.execute("SET LOCAL lock_timeout = '10s'")
+            # Table recréée vide par l'API pendant le chargement
+            _check_empty(cursor, EMBEDDING_TABLE)
+            swap_embedding_table(cursor, IMPORT_TABLE)
+
+    print(f"✓ Instantané importé: {manifest['rows']} chunks, {manifest['parent_rows']} sections parentes")
+    return manifest
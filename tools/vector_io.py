@@ -0,0 +1,110 @@
+"""
+Transport binaire des vecteurs (API OpenAI → NumPy → PostgreSQL)
+
+Un embedding de 2000 dimensions en texte fait ~20 Ko de flottants à parser à chaque saut.
+Ce module garde les vecteurs en binaire de bout en bout :
+- API : encoding_format="base64", décodé par np.frombuffer (pas de liste Python intermédiaire)
+- Requêtes : paramètres %b, envoyés au format binaire pgvector (dumpers de register_vector)
+- Ingestion : COPY ... (FORMAT BINARY) dans une table temporaire, puis upsert en une instruction
+
+Les tableaux décodés partagent le buffer base64 décodé et sont en lecture seule :
+toute transformation (normalisation, troncature) crée un nouveau tableau.
+
+Mesure du gain : `python manage.py bench-vector-io`.
+"""
+
+import base64
+from typing import Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from database.schema import EMBEDDING_DIMENSIONS, EMBEDDING_TABLE, SHORT_EMBEDDING_DIMENSIONS
+
+EMBEDDING_DTYPE = np.dtype("<f4")  # Format des embeddings base64 renvoyés par l'API
+
+# Table temporaire d'ingestion (vidée à chaque commit, réutilisée par la connexion du pool)
+INGEST_TABLE = "_ingest_chunks"
+INGEST_COLUMNS = ("id", "collection_id", "embedding", "embedding_short", "document", "cmetadata")
+INGEST_TYPES = ("text", "text", "vector", "vector", "text", "jsonb")
+
+
+def decode_embedding(data: Union[str, Sequence[float]]) -> np.ndarray:
+    """
+    Décode un embedding de l'API : chaîne base64 (float32 little-endian) ou liste de flottants
+    """
+    if isinstance(data, str):
+        return np.frombuffer(base64.b64decode(data), dtype=EMBEDDING_DTYPE)
+    return np.asarray(data, dtype=np.float32)
+
+
+def decode_embeddings(response) -> List[np.ndarray]:
+    """Vecteurs d'une réponse embeddings.create, dans l'ordre des entrées"""
+    return [decode_embedding(item.embedding) for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def create_embeddings(client, texts: Union[str, List[str]], model: str, dimensions: int) -> List[np.ndarray]:
+    """embeddings.create (client synchrone) en base64"""
+    response = client.embeddings.create(
+        model=model,
+        input=texts,
+        dimensions=dimensions,
+        encoding_format="base64"
+    )
+    return decode_embeddings(response)
+
+
+async def acreate_embeddings(client, texts: Union[str, List[str]], model: str, dimensions: int) -> List[np.ndarray]:
+    """embeddings.create (client asynchrone) en base64"""
+    response = await client.embeddings.create(
+        model=model,
+        input=texts,
+        dimensions=dimensions,
+        encoding_format="base64"
+    )
+    return decode_embeddings(response)
+
+
+async def copy_chunks(cursor, rows: Iterable[Tuple], partitioned: bool = False) -> int:
+    """
+    Ingestion binaire : COPY (FORMAT BINARY) dans une table temporaire puis upsert
+    dans langchain_pg_embedding, dans la transaction courante (curseur async).
+
+    Args:
+        rows: Tuples (id, collection_id, embedding, embedding_short, document, cmetadata dict)
+        partitioned: Table partitionnée par collection (clé primaire (collection_id, id))
+
+    Returns:
+        Nombre de lignes copiées
+    """
+    await cursor.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {INGEST_TABLE} (
+            id TEXT,
+            collection_id TEXT,
+            embedding VECTOR({EMBEDDING_DIMENSIONS}),
+            embedding_short VECTOR({SHORT_EMBEDDING_DIMENSIONS}),
+            document TEXT,
+            cmetadata JSONB
+        ) ON COMMIT DELETE ROWS
+    """)
+
+    count = 0
+    columns = ", ".join(INGEST_COLUMNS)
+    async with cursor.copy(f"COPY {INGEST_TABLE} ({columns}) FROM STDIN (FORMAT BINARY)") as copy:
+        copy.set_types(list(INGEST_TYPES))
+        for row in rows:
+            await copy.write_row(row)
+            count += 1
+
+    # DISTINCT ON : un même id deux fois dans le lot ferait échouer ON CONFLICT
+    await cursor.execute(f"""
+        INSERT INTO {EMBEDDING_TABLE} ({columns})
+        SELECT DISTINCT ON (id) {columns} FROM {INGEST_TABLE}
+        ON CONFLICT ({"collection_id, id" if partitioned else "id"}) DO UPDATE
+        SET embedding = EXCLUDED.embedding,
+            embedding_short = EXCLUDED.embedding_short,
+            document = EXCLUDED.document,
+            cmetadata = EXCLUDED.cmetadata,
+            updated_at = NOW()
+    """)
+    await cursor.execute(f"TRUNCATE {INGEST_TABLE}")
+    return count
@@ -1,22 +1,45 @@
 import os
+import re
 import json
+import time
 import numpy as np
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from pgvector.psycopg2 import register_vector
-from typing import List
+from typing import List, Tuple
 from langchain.tools import tool
-from openai import OpenAI
 from tools.reranker import rerank_documents
+from tools.rerank_eval import log_rerank_eval, sample_rerank_eval, shadow_rerank
+from tools.retrieval import (
+    ENABLE_TWO_PHASE_RETRIEVAL,
+    ID_COLUMNS,
+    RETRIEVAL_MODE,
+    SEARCH_COLUMNS,
+    SearchFilters,
+    hydrate_chunks,
+    search_documents,
+)
+from tools.embeddings import embed_query
+from tools.mmap_index import get_mmap_index
+from tools.result_cache import get_result_cache
+from tools.small_to_big import SMALL_TO_BIG_MODE, expand_small_to_big
+from tools.passages import ENABLE_PASSAGE_EXTRACTION, PASSAGE_CONTEXT_TOKENS, extract_passages
+from tools.diversify import ENABLE_MMR, MMR_LAMBDA, MMR_TOP_K, dedupe_by_text, diversify
+from tools.similarity_threshold import log_similarities, prune_candidates
+from tools.federated import ENABLE_FEDERATED_SEARCH, federated_search
+from tools.sharding import sharded_search
+from database.shards import is_sharded
 
 # Configuration
-POSTGRES_CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-# Chercher dans TOUTES les collections (pas juste une seule)
-DOCUMENTS_COLLECTION = None  # None = chercher dans toutes les collections
+# Périmètre par défaut : collections (séparées par des virgules, vide = toutes) et filtre JSONB
+VECTOR_SEARCH_COLLECTIONS = tuple(
+    c.strip() for c in os.getenv("VECTOR_SEARCH_COLLECTIONS", "").split(",") if c.strip()
+)
+VECTOR_SEARCH_METADATA_FILTER = json.loads(os.getenv("VECTOR_SEARCH_METADATA_FILTER", "") or "{}")
+DEFAULT_SEARCH_FILTERS = SearchFilters(collections=VECTOR_SEARCH_COLLECTIONS, metadata=VECTOR_SEARCH_METADATA_FILTER)
 CRAG_TOP_K = int(os.getenv("CRAG_TOP_K", "20"))
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
 ENABLE_RERANKING = os.getenv("ENABLE_RERANKING", "true").lower() in ("true", "1", "yes")
+# Backend de recherche : "pgvector" (source de vérité) ou "mmap" (index local partagé, voir tools/mmap_index.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pgvector").lower()
+# Mode hybride : un chunk bien classé en lexical (token exact) est gardé même sous le seuil cosinus
+HYBRID_LEXICAL_KEEP = int(os.getenv("HYBRID_LEXICAL_KEEP", "3"))
 
 
 def calculate_cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
@@ -31,12 +54,36 @@ def calculate_cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     return float(np.dot(vec1_np, vec2_np) / denom)
 
 
-def adaptive_threshold(similarities: List[float], alpha: float = 0.1) -> float:
+# Opérateurs de filtrage acceptés dans la requête de l'agent (même convention que site:...)
+SEARCH_OPERATOR_PATTERN = re.compile(r"\b(collection|source|officiel|url):(\S+)", re.IGNORECASE)
+
+
+def parse_search_operators(question: str) -> Tuple[str, SearchFilters]:
     """
-    Seuil fixe conservateur pour garantir la pertinence des résultats
-    Augmenté à 0.70 pour éviter les faux positifs
+    Extrait les opérateurs de filtrage de la requête :
+    - collection:NOM (répétable) → collections
+    - source:file_upload → cmetadata @> {"source": "file_upload"}
+    - officiel:oui → cmetadata @> {"is_official": true}
+    - url:https://service-public.gouv.tg/ → préfixe de cmetadata->>'url'
+
+    Returns:
+        (requête sans les opérateurs, filtres)
     """
-    return 0.70  # Seuil fixe : garder uniquement les documents avec similarité >= 70%
+    collections, metadata, url_prefix = [], {}, None
+    for name, value in SEARCH_OPERATOR_PATTERN.findall(question):
+        name = name.lower()
+        value = value.strip("\"'")
+        if name == "collection":
+            collections.append(value)
+        elif name == "source":
+            metadata["source"] = value
+        elif name == "officiel":
+            metadata["is_official"] = value.lower() in ("oui", "true", "1", "yes")
+        elif name == "url":
+            url_prefix = value
+
+    cleaned = re.sub(r"\s+", " ", SEARCH_OPERATOR_PATTERN.sub(" ", question)).strip()
+    return cleaned or question, SearchFilters(collections=tuple(collections), metadata=metadata, url_prefix=url_prefix)
 
 
 @tool
@@ -44,84 +91,141 @@ def vector_search_tool(question: str) -> dict:
     """
     Recherche de documents pertinents dans la base vectorielle (pgvector)
     avec reranking hybride (cosine + LLM).
+    Filtres optionnels dans la requête : collection:NOM, source:file_upload, officiel:oui, url:PRÉFIXE
     """
     try:
-        #  Génération de l'embedding de la question
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        response = client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=question,
-            dimensions=2000
-        )
-        question_embedding = response.data[0].embedding
-
-        # Connexion PostgreSQL (pgvector)
-        conn = psycopg2.connect(POSTGRES_CONNECTION_STRING)
-        register_vector(conn)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        # Recherche vectorielle brute dans TOUTES les collections
-        # NOTE: ORDER BY sur la similarité calculée (DESC) au lieu de l'opérateur de distance
-        cursor.execute(
-            """
-            SELECT 
-                document,
-                cmetadata,
-                embedding,
-                collection_id,
-                1 - (embedding <=> %s::vector) AS cosine_similarity
-            FROM langchain_pg_embedding
-            ORDER BY 1 - (embedding <=> %s::vector) DESC
-            LIMIT %s
-            """,
-            (question_embedding, question_embedding, CRAG_TOP_K)
-        )
+        # Opérateurs de filtrage retirés du texte, combinés au périmètre par défaut
+        question, query_filters = parse_search_operators(question)
+        filters = DEFAULT_SEARCH_FILTERS.merge(query_filters)
+
+        #  Génération de l'embedding de la question (cache mémoire/persistant)
+        question_embedding = embed_query(question)
+
+        # Cache sémantique : question quasi identique déjà traitée → ni SQL ni reranking LLM
+        result_cache = get_result_cache()
+        if result_cache is not None:
+            cached_result = result_cache.get(question_embedding, filters.collections, filters.cache_variant())
+            if cached_result is not None:
+                print(f"⚡ CACHE SÉMANTIQUE: résultat réutilisé (similarité {cached_result['cache']['similarity']:.4f})")
+                return cached_result
+            cache_generation = result_cache.generation
 
-        rows = cursor.fetchall()
+        rows = None
+        federation = None  # Rapport par collection (latence, statut) en mode fédéré
+        sharding = None  # Rapport par shard (latence, statut, résultats partiels)
+        # L'index mmap est purement dense et non filtré : le reste passe par PostgreSQL
+        if VECTOR_BACKEND == "mmap" and RETRIEVAL_MODE == "dense" and filters.is_empty():
+            # Index local memmap : pas d'aller-retour PostgreSQL
+            try:
+                mmap_index = get_mmap_index()
+                if mmap_index is not None:
+                    rows = mmap_index.search(question_embedding, top_k=CRAG_TOP_K)
+                else:
+                    print("⚠️ Index mmap absent (manage.py build-mmap-index), fallback pgvector")
+            except Exception as e:
+                print(f"⚠️ Erreur index mmap ({e}), fallback pgvector")
+
+        if rows is None:
+            # Filtres poussés dans la requête ANN (parcours itératif de l'index)
+            # En deux phases : ids et distances seulement, le texte est chargé pour les survivants
+            columns = ID_COLUMNS if ENABLE_TWO_PHASE_RETRIEVAL else SEARCH_COLUMNS
+            if is_sharded():
+                # Scatter-gather sur tous les shards, top-k global (partiel si un shard est lent)
+                rows, sharding = sharded_search(
+                    question_embedding, top_k=CRAG_TOP_K, question=question, filters=filters, columns=columns
+                )
+            elif ENABLE_FEDERATED_SEARCH:
+                # Une recherche par collection en parallèle, top-k par collection, scores normalisés
+                rows, federation = federated_search(
+                    question_embedding, top_k=CRAG_TOP_K, question=question, filters=filters, columns=columns
+                )
+            else:
+                rows = search_documents(
+                    question_embedding, top_k=CRAG_TOP_K, question=question, filters=filters, columns=columns
+                )
         
         # DEBUG: Afficher les résultats bruts
         print(f"\n{'='*60}")
         print(f"VECTOR SEARCH DEBUG")
         print(f"{'='*60}")
         print(f"Query: {question}")
-        print(f"DOCUMENTS_COLLECTION: {DOCUMENTS_COLLECTION}")
+        print(f"Filtres: {filters if not filters.is_empty() else 'aucun (toutes les collections)'}")
+        print(f"VECTOR_BACKEND: {VECTOR_BACKEND} | RETRIEVAL_MODE: {RETRIEVAL_MODE}")
         print(f"CRAG_TOP_K (limite SQL): {CRAG_TOP_K}")
         print(f"Documents récupérés (brut SQL): {len(rows)}")
+        if sharding:
+            print(f"\nShards{' (RÉSULTATS PARTIELS)' if sharding['partial'] else ''}:")
+            for shard, report in sharding["shards"].items():
+                print(f"  {shard}: {report['status']} | {report['rows']} chunks | {report['latency_ms']} ms")
+        if federation:
+            print(f"\nRecherche fédérée par collection:")
+            for collection, report in sorted(federation.items(), key=lambda item: -item[1]["latency_ms"]):
+                print(f"  {collection}: {report['status']} | {report['rows']} chunks | {report['latency_ms']} ms")
         if rows:
             print(f"\nTop 5 similarités brutes:")
             for i, r in enumerate(rows[:5], 1):
                 print(f"  {i}. {r['cosine_similarity']:.4f} - Collection: {r.get('collection_id', 'N/A')}")
             print(f"\nCollections trouvées: {set(r.get('collection_id', 'unknown') for r in rows)}")
         print(f"{'='*60}\n")
-        
-        cursor.close()
-        conn.close()
 
         if not rows:
             return {
                 "status": "no_results",
                 "summary": "Aucun document trouvé dans la base vectorielle.",
-                "sources": []
+                "sources": [],
+                **({"collections": federation} if federation else {}),
+                **({"shards": sharding} if sharding else {})
             }
 
-        # Filtrage adaptatif selon la distribution des similarités
-        similarities = [r["cosine_similarity"] for r in rows]
-        threshold = adaptive_threshold(similarities)
-        filtered_docs = [r for r in rows if r["cosine_similarity"] >= threshold]
+        # Filtrage adaptatif selon la distribution des similarités (voir tools/similarity_threshold.py)
+        filtered_docs, pruning = prune_candidates(
+            rows,
+            keep=lambda r: r.get("lexical_rank") is not None and r["lexical_rank"] <= HYBRID_LEXICAL_KEEP,
+            rerank_above=5 if ENABLE_RERANKING else None,
+            rerank_cap=MMR_TOP_K if ENABLE_MMR else None,
+        )
+        threshold = pruning["threshold"]
 
-        print(f"📊 FILTRAGE ADAPTATIF:")
-        print(f"   Seuil calculé: {threshold:.4f}")
-        print(f"   Documents après filtrage: {len(filtered_docs)}/{len(rows)}")
+        print(f"📊 FILTRAGE ADAPTATIF ({pruning['strategy']}):")
+        print(f"   Seuil calculé: {threshold:.4f}{' (sauvetage des meilleurs chunks)' if pruning['rescued'] else ''}")
+        if pruning["thresholds"]:
+            print(f"   Seuils calibrés: {pruning['thresholds']}")
+        print(f"   Documents après filtrage: {len(filtered_docs)}/{len(rows)} (seuil fixe {pruning['baseline_threshold']}: {pruning['baseline_kept']})")
+        print(f"   Reranking évité: {pruning['rerank_calls_avoided']} | Repli web évité: {pruning['web_fallbacks_avoided']}")
 
         if not filtered_docs:
             return {
                 "status": "no_relevant_documents",
                 "summary": f"Aucun document au-dessus du seuil adaptatif ({threshold:.2f}).",
                 "threshold": threshold,
+                "pruning": pruning,
                 "sources": [],
-                
+                **({"collections": federation} if federation else {}),
+                **({"shards": sharding} if sharding else {})
             }
 
+        # Diversification : quasi-doublons (recouvrement des chunks) retirés avant le reranking LLM
+        if ENABLE_MMR:
+            diversified_docs = diversify(filtered_docs)
+            print(f"🎯 MMR (λ={MMR_LAMBDA}): {len(filtered_docs)} → {len(diversified_docs)} candidats")
+            filtered_docs = diversified_docs
+
+        # Phase 2 : texte et métadonnées des seuls survivants, en une requête
+        filtered_docs = hydrate_chunks(filtered_docs)
+        if ENABLE_TWO_PHASE_RETRIEVAL:
+            hydrated_bytes = sum(r.get("payload_bytes") or 0 for r in filtered_docs)
+            candidate_bytes = sum(r.get("payload_bytes") or 0 for r in rows)
+            print(f"📦 DEUX PHASES: {hydrated_bytes}/{candidate_bytes} octets de contenu chargés")
+
+        if ENABLE_MMR:
+            filtered_docs = dedupe_by_text(filtered_docs)
+
+        # Small-to-big : chunks trouvés → parents dédupliqués ou fenêtres de voisins (une requête)
+        if SMALL_TO_BIG_MODE != "off":
+            expanded_docs = expand_small_to_big(filtered_docs)
+            print(f"🧩 SMALL-TO-BIG ({SMALL_TO_BIG_MODE}): {len(filtered_docs)} chunks → {len(expanded_docs)} contextes")
+            filtered_docs = expanded_docs
+
         #  Préparation des documents
         relevant_docs = []
         for row in filtered_docs:
@@ -132,6 +236,7 @@ def vector_search_tool(question: str) -> dict:
                 "favicon": meta.get("favicon", ""),
                 "similarity_score": round(row["cosine_similarity"], 4),
                 "metadata": {
+                    "collection": row.get("collection_id"),
                     "chunk_index": meta.get("chunk_index", 0),
                     "chunk_count": meta.get("chunk_count", 1),
                     "is_official": meta.get("is_official", False)
@@ -141,13 +246,22 @@ def vector_search_tool(question: str) -> dict:
         # Reranking LLM (optionnel, contrôlé par ENABLE_RERANKING)
         if ENABLE_RERANKING and len(relevant_docs) > 5:
             print(f"🔄 RERANKING: {len(relevant_docs)} documents → Top 5")
+            evaluate = sample_rerank_eval()
+            started = time.perf_counter()
             reranked_docs = rerank_documents(question, relevant_docs, top_k=5)
+            if evaluate:
+                log_rerank_eval(relevant_docs, reranked_docs, 5, (time.perf_counter() - started) * 1000)
+            # Similarités et scores LLM de tous les candidats : calibration des seuils par collection
+            log_similarities(relevant_docs)
         else:
             if not ENABLE_RERANKING:
                 print(f"⏭️ RERANKING DÉSACTIVÉ (ENABLE_RERANKING=false)")
             else:
                 print(f"⏭️ RERANKING SKIP: {len(relevant_docs)} documents (≤5)")
             reranked_docs = relevant_docs
+            # Mode ombre : reranking hors du chemin de la requête, comparé à l'ordre par similarité
+            if not ENABLE_RERANKING and len(relevant_docs) > 5 and sample_rerank_eval():
+                shadow_rerank(question, relevant_docs, 5)
 
         #  Score hybride
         for doc in reranked_docs:
@@ -163,14 +277,37 @@ def vector_search_tool(question: str) -> dict:
 
         reranked_docs.sort(key=lambda x: x["final_score"], reverse=True)
 
+        # Passages ciblés : l'agent reçoit les phrases utiles, positions gardées pour les citations
+        if ENABLE_PASSAGE_EXTRACTION:
+            full_chars = sum(len(doc["content"]) for doc in reranked_docs)
+            for doc in reranked_docs:
+                doc["metadata"]["content_length"] = len(doc["content"])
+                doc["content"], doc["passages"] = extract_passages(question, doc["content"], PASSAGE_CONTEXT_TOKENS)
+            print(f"✂️ PASSAGES: {sum(len(doc['content']) for doc in reranked_docs)}/{full_chars} caractères envoyés à l'agent")
+
         #  Résumé de sortie
-        return {
+        result = {
             "status": "success",
             "count": len(reranked_docs),
             "threshold": round(threshold, 3),
+            "pruning": pruning,
             "sources": reranked_docs,
             "summary": f"{len(reranked_docs)} document(s) retenu(s) avec reranking hybride (seuil adaptatif: {threshold:.2f})."
         }
+        if federation:
+            # Latence et statut par collection : repérer une partition lente ou en erreur
+            result["collections"] = federation
+        if sharding:
+            result["shards"] = sharding
+        # Un résultat incomplet (shard ou collection en retard) n'est pas mis en cache
+        incomplete = (sharding and sharding["partial"]) or (
+            federation and any(report["status"] != "ok" for report in federation.values())
+        )
+        if result_cache is not None and not incomplete:
+            result_cache.put(
+                question_embedding, result, filters.collections, filters.cache_variant(), generation=cache_generation
+            )
+        return result
 
     except Exception as e:
         return {